@@ -0,0 +1,60 @@
+"""
+Measures how concurrent fan-out hides upstream latency, against a local
+stand-in server with a synthetic dataset::
+
+    python benchmarks/fanout.py [latency] [rate_limit]
+
+The defaults (50ms, no rate limit) roughly match the real API from within
+the UK. Pass a rate limit (e.g. 15, as the real API enforces) to see how
+many requests are refused.
+"""
+import sys
+import time
+
+from police_api.pool import concurrent_map
+from police_api.testing import StandInServer, SyntheticDataset
+
+
+def timed(label, func):
+    start = time.time()
+    result = func()
+    print('%-40s %.2fs' % (label, time.time() - start))
+    return result
+
+
+def main(latency=0.05, rate_limit=None):
+    dataset = SyntheticDataset(forces=4, neighbourhoods=8,
+                               crimes_per_month=200)
+    with StandInServer(dataset, latency=latency,
+                       rate_limit=rate_limit) as server:
+        api = server.client()
+        forces = api.get_forces()
+        neighbourhoods = [n for f in forces for n in f.neighbourhoods]
+        print('%d neighbourhoods, %.0fms latency' % (
+            len(neighbourhoods), latency * 1000))
+
+        fresh = [api.get_neighbourhood(n.force.id, n.id)
+                 for n in neighbourhoods]
+        timed('serial details', lambda: [(n.population, n.boundary)
+                                         for n in fresh])
+        for workers in (1, 4, 16):
+            fresh = [api.get_neighbourhood(n.force.id, n.id)
+                     for n in neighbourhoods]
+            timed('preload details (%d workers)' % workers,
+                  lambda: api.preload(fresh, include=['boundary'],
+                                      workers=workers))
+
+        boundaries = [n.boundary for n in neighbourhoods]
+        for workers in (1, 4, 16):
+            timed('crimes by area (%d workers)' % workers,
+                  lambda: concurrent_map(api.get_crimes_area, boundaries,
+                                         workers))
+        refused = sum(1 for verb, path, status in server.log
+                      if status == 429)
+        print('%d requests, %d refused' % (len(server.log), refused))
+        print(api.service.transfer.report())
+
+
+if __name__ == '__main__':
+    args = [float(a) for a in sys.argv[1:]]
+    main(*args)
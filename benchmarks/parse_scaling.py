@@ -0,0 +1,76 @@
+"""
+Measures how decoding large crimes-street responses scales across worker
+processes.
+
+Pass the paths of recorded response bodies to benchmark those, otherwise a
+set of synthetic 10,000-crime payloads is generated::
+
+    python benchmarks/parse_scaling.py [payload.json ...]
+"""
+import json
+import multiprocessing
+import random
+import sys
+import time
+
+from police_api.parallel import ParsePool, parse_crimes
+
+CATEGORIES = ['anti-social-behaviour', 'burglary', 'criminal-damage-arson',
+              'drugs', 'other-theft', 'shoplifting', 'vehicle-crime',
+              'violent-crime']
+OUTCOMES = [None, 'Under investigation', 'Offender fined',
+            'Investigation complete; no suspect identified']
+
+
+def synthetic_payload(size=10000, seed=0):
+    rng = random.Random(seed)
+    crimes = []
+    for i in range(size):
+        outcome = rng.choice(OUTCOMES)
+        crimes.append({
+            'id': 20000000 + i,
+            'persistent_id': '%064x' % rng.getrandbits(256),
+            'month': '2014-03',
+            'category': rng.choice(CATEGORIES),
+            'context': '',
+            'location_type': 'Force',
+            'location_subtype': '',
+            'location': {
+                'latitude': '%.6f' % rng.uniform(52.6, 52.7),
+                'longitude': '%.6f' % rng.uniform(-1.2, -1.1),
+                'street': {'id': rng.randint(1, 5000),
+                           'name': 'On or near Test Street'},
+            },
+            'outcome_status': {'category': outcome, 'date': '2014-03'}
+            if outcome else None,
+        })
+    return json.dumps(crimes).encode('utf-8')
+
+
+def main(paths):
+    if paths:
+        payloads = [open(p, 'rb').read() for p in paths]
+    else:
+        payloads = [synthetic_payload(seed=i) for i in range(16)]
+    total = sum(len(p) for p in payloads)
+    print('%d payloads, %.1f MB' % (len(payloads), total / 1e6))
+
+    start = time.time()
+    for payload in payloads:
+        parse_crimes(payload)
+    baseline = time.time() - start
+    print('in-process: %.2fs' % baseline)
+
+    processes = 1
+    while processes <= multiprocessing.cpu_count():
+        with ParsePool(processes=processes) as pool:
+            start = time.time()
+            pool.parse_crimes(payloads)
+            elapsed = time.time() - start
+        print('%2d processes: %.2fs (%.2fx)' % (
+            processes, elapsed, baseline / elapsed))
+        processes *= 2
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,62 @@
+"""
+Compares the size and speed of police_api.serialisation against pickle for
+a list of crimes::
+
+    python benchmarks/serialisation.py [crimes-street.json]
+
+Pass a recorded crimes-street response body to benchmark that, otherwise a
+synthetic 10,000-crime payload is used.
+"""
+import json
+import pickle
+import sys
+import time
+
+from police_api import PoliceAPI
+from police_api.columnar import CrimeColumns
+from police_api.crime import CrimeCategory
+from police_api.serialisation import attach, dumps, loads
+
+from parse_scaling import CATEGORIES, synthetic_payload
+
+
+def timed(func, repeat=5):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main(paths):
+    if paths:
+        payload = open(paths[0], 'rb').read()
+    else:
+        payload = synthetic_payload()
+    data = json.loads(payload.decode('utf-8'))
+    api = PoliceAPI()
+    # Fill the category tables locally rather than fetching them.
+    categories = set(CATEGORIES) | set(c['category'] for c in data)
+    for month in set(c['month'] for c in data):
+        api.crime_categories[month] = dict(
+            (c, CrimeCategory(api, data={'url': c, 'name': c}))
+            for c in categories)
+    crimes = CrimeColumns.from_json(data).to_crimes(api)
+    print('%d crimes, %.1f MB of JSON' % (len(crimes), len(payload) / 1e6))
+
+    for name, encode, decode in [
+            ('pickle', lambda: pickle.dumps(crimes, -1),
+             lambda data: attach(pickle.loads(data), api)),
+            ('police_api', lambda: dumps(crimes),
+             lambda data: loads(data, api))]:
+        encode_time, data = timed(encode)
+        decode_time, result = timed(lambda: decode(data))
+        assert len(result) == len(crimes)
+        print('%-10s %8.1f KB  encode %.3fs  decode %.3fs' % (
+            name, len(data) / 1e3, encode_time, decode_time))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,42 +1,82 @@
+import json
+import logging
+import queue
+import threading
+from collections import OrderedDict
+
+from .aggregate import CountTable, count
+from .columnar import CrimeColumns
 from .crime import NoLocationCrime, Crime, CrimeCategory
 from .exceptions import InvalidCategoryException
 from .forces import Force
-from .neighbourhoods import Neighbourhood
+from .identity import IdentityMap
+from .neighbourhoods import Neighbourhood  # NOQA
+from .pool import WorkerPool, concurrent_map
 from .service import BaseService, APIError
-from .utils import encode_polygon
+from .snapshot import Snapshot
+from .spatial import SpatialIndex  # NOQA
+from .utils import encode_polygon, month_range
 from .version import __version__  # NOQA
 
+logger = logging.getLogger(__name__)
+
 
 class PoliceAPI(object):
 
     def __init__(self, **config):
+        snapshot = config.pop('snapshot', None)
+        snapshot_check = config.pop('snapshot_check', True)
+        self.identity = IdentityMap(self, config.pop('identity_map_size',
+                                                     1024))
         self.service = BaseService(self, **config)
         self.crime_categories = {}
+        self._lock = threading.Lock()
+        self.snapshot = None
+        self.snapshot_stale = False
+        if snapshot is not None:
+            self.load_snapshot(snapshot, check=snapshot_check)
+
+    def load_snapshot(self, snapshot, check=True):
+        """
+        Fill the reference data from a ``Snapshot`` (or the path of a saved
+        one). If ``check`` is ``True``, the snapshot is compared with the
+        API's available dates, and if it is stale the categories for the
+        latest month are left to be fetched.
+        """
+        if not isinstance(snapshot, Snapshot):
+            snapshot = Snapshot.load(snapshot)
+        self.snapshot = snapshot
+        self.snapshot_stale = False
+        if check:
+            new = snapshot.new_months(self)
+            if new:
+                logger.warning('Reference data snapshot is stale; missing %s'
+                               % ', '.join(sorted(new)))
+                self.snapshot_stale = True
+        snapshot.apply(self, latest=not self.snapshot_stale)
 
     def get_forces(self):
         forces = []
-        for f in self.service.request('GET', 'forces'):
-            forces.append(Force(self, id=f['id'], name=f['name']))
+        for f in self.service.request_reference('GET', 'forces'):
+            forces.append(self.get_force(f['id'], name=f['name']))
         return forces
 
     def get_force(self, id, **attrs):
-        return Force(self, id=id, **attrs)
+        return self.identity.force(id, **attrs)
 
     def get_neighbourhoods(self, force):
         if not isinstance(force, Force):
-            force = Force(self, id=force)
+            force = self.get_force(force)
 
         neighbourhoods = []
-        for n in self.service.request('GET', '%s/neighbourhoods' % force.id):
-            neighbourhoods.append(
-                Neighbourhood(self, force=force, id=n['id'], name=n['name']))
+        method = '%s/neighbourhoods' % force.id
+        for n in self.service.request_reference('GET', method):
+            neighbourhoods.append(self.identity.neighbourhood(
+                force, n['id'], name=n['name']))
         return sorted(neighbourhoods, key=lambda n: n.name)
 
     def get_neighbourhood(self, force, id, **attrs):
-        if not isinstance(force, Force):
-            force = Force(self, id=force, **attrs)
-
-        return Neighbourhood(self, force=force, id=id, **attrs)
+        return self.identity.neighbourhood(force, id, **attrs)
 
     def locate_neighbourhood(self, lat, lng):
         method = 'locate-neighbourhood'
@@ -48,6 +88,28 @@ class PoliceAPI(object):
         except APIError:
             pass
 
+    def preload(self, resources, fields=None, include=(), workers=8):
+        """
+        Load the details and sub-resources (e.g. ``officers``, ``events``,
+        ``boundary``) of many forces or neighbourhoods concurrently.
+        Details are only fetched for resources missing one of ``fields`` (or
+        any field, if ``None``); pass ``fields=[]`` to skip them.
+        Sub-resources a resource doesn't have are skipped.
+        """
+        resources = list(resources)
+        tasks = []
+        for resource in resources:
+            if not resource._requested and (fields is None or any(
+                    f in resource.fields for f in fields)):
+                tasks.append((resource, None))
+            for name in include:
+                if hasattr(type(resource), name):
+                    tasks.append((resource, name))
+        concurrent_map(
+            lambda t: t[0].load() if t[1] is None else getattr(*t),
+            tasks, workers)
+        return resources
+
     def get_dates(self):
         response = self.service.request('GET', 'crimes-street-dates')
         return [d['date'] for d in response]
@@ -57,13 +119,24 @@ class PoliceAPI(object):
 
     def _populate_crime_categories(self, date=None):
         response = self.service.request('GET', 'crime-categories', date=date)
-        self.crime_categories[date] = {}
+        self._set_crime_categories(date, response)
+
+    def _set_crime_categories(self, date, response):
+        categories = {}
         for c in filter(lambda x: x['url'] != 'all-crime', response):
-            self.crime_categories[date][c['url']] = CrimeCategory(self, data=c)
+            categories[c['url']] = CrimeCategory(self, data=c)
+        # Publish the table in one step, so lock-free readers never see it
+        # half-filled.
+        self.crime_categories[date] = categories
 
     def _get_crime_categories(self, date=None):
-        if date not in self.crime_categories:
-            self._populate_crime_categories(date=date)
+        try:
+            return self.crime_categories[date]
+        except KeyError:
+            pass
+        with self._lock:
+            if date not in self.crime_categories:
+                self._populate_crime_categories(date=date)
         return self.crime_categories[date]
 
     def get_crime_categories(self, date=None):
@@ -106,20 +179,64 @@ class PoliceAPI(object):
             crimes.append(Crime(self, data=c))
         return crimes
 
-    def get_crimes_area(self, points, date=None, category=None):
+    def _crimes_area_request(self, points, date=None, category=None):
         if isinstance(category, CrimeCategory):
             category = category.id
         method = 'crimes-street/%s' % (category or 'all-crime')
         kwargs = {
             'poly': encode_polygon(points),
         }
-        crimes = []
         if date is not None:
             kwargs['date'] = date
-        for c in self.service.request('POST', method, **kwargs):
+        return method, kwargs
+
+    def get_crimes_area(self, points, date=None, category=None):
+        method, kwargs = self._crimes_area_request(points, date=date,
+                                                   category=category)
+        area_cache = self.service.area_cache
+        if area_cache is None:
+            response = self.service.request('POST', method, **kwargs)
+        else:
+            def fetch(points):
+                poly = encode_polygon(points)
+                return self.service.request('POST', method,
+                                            **dict(kwargs, poly=poly))
+
+            response = area_cache.get(points, (method, date), fetch)
+        crimes = []
+        for c in response:
             crimes.append(Crime(self, data=c))
         return crimes
 
+    def aggregate_crimes(self, area, months=None, by=('category',),
+                         category=None, workers=8):
+        if area and isinstance(area[0][0], (list, tuple)):
+            tiles = area
+        else:
+            tiles = [area]
+        months = list(months or [None])
+
+        def fetch(query):
+            points, month = query
+            method, kwargs = self._crimes_area_request(points, date=month,
+                                                       category=category)
+            return CrimeColumns.from_json(
+                self.service.request('POST', method, **kwargs))
+
+        queries = [(t, m) for m in months for t in tiles]
+        results = concurrent_map(fetch, queries, workers)
+        table = CountTable(by)
+        seen = {}
+        for (points, month), columns in zip(queries, results):
+            # Tiles may overlap, so a crime is only counted once per month.
+            ids = seen.setdefault(month, set())
+            keep = [i for i, id in enumerate(columns.id) if id not in ids]
+            ids.update(columns.id)
+            if len(keep) < len(columns):
+                columns = columns.take(keep)
+            table.update(count(columns, by))
+        return table
+
     def get_crimes_location(self, location_id, date=None):
         kwargs = {
             'location_id': location_id,
@@ -133,7 +250,7 @@ class PoliceAPI(object):
 
     def get_crimes_no_location(self, force, date=None, category=None):
         if not isinstance(force, Force):
-            force = Force(self, id=force)
+            force = self.get_force(force)
 
         if isinstance(category, CrimeCategory):
             category = category.id
@@ -148,3 +265,85 @@ class PoliceAPI(object):
         for c in self.service.request('GET', 'crimes-no-location', **kwargs):
             crimes.append(NoLocationCrime(self, data=c))
         return crimes
+
+    def _months(self, start=None, end=None, months=None):
+        """
+        The months to fetch for a range query, and which of them won't
+        change: those the API has published, except the latest
+        ``mutable_months``, which may still be revised.
+        """
+        dates = self.get_dates()
+        if months is None:
+            months = month_range(start or dates[-1], end or dates[0])
+        immutable = set(dates[self.service.config['mutable_months']:])
+        return list(months), immutable
+
+    def _crimes_range(self, verb, method, kwargs, cls, start, end, months,
+                      workers, stream):
+        months, immutable = self._months(start, end, months)
+        params = tuple(sorted(kwargs.items()))
+
+        def fetch(month):
+            key = (verb, method, params, month)
+            data = self.service.month_cache.get(key)
+            if data is None:
+                data = self.service.request_raw(verb, method, date=month,
+                                                **kwargs)
+                if month in immutable:
+                    self.service.month_cache.set(key, data)
+            # The cache holds the raw response, since hydrating crimes
+            # modifies the decoded data.
+            return month, [cls(self, data=c)
+                           for c in json.loads(data.decode('utf-8'))]
+
+        if stream:
+            return self._stream_months(fetch, months, workers)
+        return OrderedDict(concurrent_map(fetch, months, workers))
+
+    def _stream_months(self, fetch, months, workers):
+        if not months:
+            return
+        done = queue.Queue()
+        pool = WorkerPool(min(workers, len(months)))
+        try:
+            for month in months:
+                pool.submit(fetch, month).add_done_callback(done.put)
+            for month in months:
+                yield done.get().result()
+        finally:
+            pool.close(cancel=True)
+
+    def get_crimes_point_range(self, lat, lng, start=None, end=None,
+                               months=None, category=None, workers=8,
+                               stream=False):
+        if isinstance(category, CrimeCategory):
+            category = category.id
+        return self._crimes_range(
+            'GET', 'crimes-street/%s' % (category or 'all-crime'),
+            {'lat': lat, 'lng': lng}, Crime, start, end, months, workers,
+            stream)
+
+    def get_crimes_area_range(self, points, start=None, end=None,
+                              months=None, category=None, workers=8,
+                              stream=False):
+        method, kwargs = self._crimes_area_request(points, category=category)
+        return self._crimes_range('POST', method, kwargs, Crime, start, end,
+                                  months, workers, stream)
+
+    def get_crimes_location_range(self, location_id, start=None, end=None,
+                                  months=None, workers=8, stream=False):
+        return self._crimes_range(
+            'GET', 'crimes-at-location', {'location_id': location_id}, Crime,
+            start, end, months, workers, stream)
+
+    def get_crimes_no_location_range(self, force, start=None, end=None,
+                                     months=None, category=None, workers=8,
+                                     stream=False):
+        if isinstance(force, Force):
+            force = force.id
+        if isinstance(category, CrimeCategory):
+            category = category.id
+        return self._crimes_range(
+            'GET', 'crimes-no-location',
+            {'force': force, 'category': category or 'all-crime'},
+            NoLocationCrime, start, end, months, workers, stream)
@@ -0,0 +1,96 @@
+from collections import Counter
+
+from .columnar import Categorical
+
+# Friendly names for grouping columns, mapped to CrimeColumns attributes.
+ALIASES = {
+    'street': 'location_id',
+    'outcome': 'outcome_status',
+}
+
+
+class CountTable(object):
+    """
+    Crime counts grouped by one or more columns. Tables with the same
+    ``by`` can be added together, to combine partial results across tiles
+    and months.
+    """
+
+    def __init__(self, by, counts=None):
+        self.by = tuple(by)
+        self.counts = Counter(counts or {})
+
+    def __add__(self, other):
+        table = CountTable(self.by, self.counts)
+        table.update(other)
+        return table
+
+    def update(self, other):
+        if other.by != self.by:
+            raise ValueError('Cannot combine tables grouped by %s and %s' %
+                             (self.by, other.by))
+        self.counts.update(other.counts)
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        return self.counts.get(key, 0)
+
+    def __eq__(self, other):
+        return (isinstance(other, CountTable) and self.by == other.by and
+                self.counts == other.counts)
+
+    def __str__(self):
+        return '<CountTable> by %s (%d groups)' % (', '.join(self.by),
+                                                   len(self))
+
+    def __repr__(self):
+        return self.__str__()
+
+    def total(self):
+        return sum(self.counts.values())
+
+    def rows(self):
+        """
+        ``(key, count)`` tuples, largest count first.
+        """
+        return self.counts.most_common()
+
+    def group(self, by):
+        """
+        Re-group the table by a subset of its columns.
+        """
+        positions = [self.by.index(b) for b in by]
+        counts = Counter()
+        for key, count in self.counts.items():
+            counts[tuple(key[p] for p in positions)] += count
+        return CountTable(by, counts)
+
+
+def _codes(columns, name):
+    column = getattr(columns, ALIASES.get(name, name))
+    if isinstance(column, Categorical):
+        return column.codes, column.values
+    return column, None
+
+
+def count(columns, by):
+    """
+    Count the rows of a ``CrimeColumns`` grouped by the columns in ``by``.
+    Dictionary-encoded columns are grouped on their integer codes, and only
+    the distinct keys are decoded afterwards.
+    """
+    by = tuple(by)
+    if not by:
+        return CountTable(by, {(): len(columns)} if len(columns) else {})
+    codes, values = zip(*[_codes(columns, b) for b in by])
+    grouped = Counter(zip(*codes))
+    counts = {}
+    for key, n in grouped.items():
+        key = tuple(v[k] if v is not None else k
+                    for k, v in zip(key, values))
+        counts[key] = counts.get(key, 0) + n
+    return CountTable(by, counts)
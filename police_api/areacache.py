@@ -0,0 +1,180 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from .exceptions import APIError
+from .planner import rectangle, split_box
+from .spatial import (bounding_box, points_in_polygon, polygon_contains,
+                      polygons_intersect)
+
+logger = logging.getLogger(__name__)
+
+
+def _boxes_overlap(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def _merge_cells(cells, columns):
+    # Join runs of neighbouring cells in each row, then rows of runs which
+    # line up, into as few boxes as that allows.
+    rows = []
+    for row in sorted(set(i // columns for i, box in cells)):
+        run = None
+        for i, box in cells:
+            if i // columns != row:
+                continue
+            if run is not None and i == run[0] + 1:
+                run = (i, (run[1][0], run[1][1], box[2], box[3]))
+            else:
+                if run is not None:
+                    rows.append(run[1])
+                run = (i, box)
+        rows.append(run[1])
+    boxes = []
+    for box in sorted(rows, key=lambda b: (b[1], b[3], b[0])):
+        last = boxes[-1] if boxes else None
+        if last is not None and last[1] == box[1] and last[3] == box[3] \
+                and last[2] == box[0]:
+            boxes[-1] = (last[0], last[1], box[2], box[3])
+        else:
+            boxes.append(box)
+    return boxes
+
+
+class _Area(object):
+
+    def __init__(self, points, crimes, fetched):
+        self.points = points
+        self.box = bounding_box(points)
+        self.crimes = crimes
+        self.lats = [float(c['location']['latitude']) for c in crimes]
+        self.lngs = [float(c['location']['longitude']) for c in crimes]
+        self.fetched = fetched
+
+    def within(self, points):
+        inside = points_in_polygon(self.lats, self.lngs, points)
+        return [c for c, keep in zip(self.crimes, inside) if keep]
+
+
+class AreaCache(object):
+    """
+    Remembers the crimes returned for polygons, and answers later queries
+    from them where it can. A polygon inside one already fetched (for the
+    same month and category) is answered by testing the cached crimes
+    against it, without a request. For a polygon which only partly overlaps
+    those fetched, its bounding box is divided into a ``grid`` by ``grid``
+    array of cells, and only the cells which touch the polygon and aren't
+    inside a cached polygon are fetched, as rectangles.
+
+    Up to ``size`` polygons are kept, for ``ttl`` seconds each, so that
+    revisions to recent months are picked up.
+    """
+
+    def __init__(self, size=256, ttl=60 * 60, grid=4, clock=time.time):
+        self.size = size
+        self.ttl = ttl
+        self.grid = grid
+        self.clock = clock
+        self.stats = {'exact': 0, 'contained': 0, 'partial': 0, 'miss': 0,
+                      'requests': 0}
+        self._areas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._areas)
+
+    def clear(self):
+        with self._lock:
+            self._areas.clear()
+
+    def _candidates(self, key, box):
+        now = self.clock()
+        with self._lock:
+            for k in [k for k, area in self._areas.items()
+                      if now - area.fetched >= self.ttl]:
+                del self._areas[k]
+            return [area for (k, points), area in self._areas.items()
+                    if k == key and _boxes_overlap(area.box, box)]
+
+    def _store(self, key, points, crimes):
+        area = _Area(points, crimes, self.clock())
+        with self._lock:
+            self._areas.pop((key, points), None)
+            self._areas[(key, points)] = area
+            while len(self._areas) > self.size:
+                self._areas.popitem(last=False)
+        return area
+
+    def _fetch(self, key, points, fetch):
+        self.stats['requests'] += 1
+        return self._store(key, points, fetch(list(points)))
+
+    def _fetch_box(self, key, box, fetch):
+        # Remainder boxes may hold more crimes than the API will return, so
+        # those are split into quarters, as the planner does.
+        try:
+            return [self._fetch(key, tuple(rectangle(*box)), fetch)]
+        except APIError as e:
+            if e.status_code != 503:
+                raise
+        logger.info('Remainder %s overflowed, splitting' % (box,))
+        areas = []
+        for b in split_box(box, 2, 2):
+            areas.extend(self._fetch_box(key, b, fetch))
+        return areas
+
+    def get(self, points, key, fetch):
+        """
+        The crimes (as decoded JSON) within the polygon ``points`` for
+        ``key`` (e.g. its month and category), calling ``fetch(points)`` for
+        the crimes within any polygon it needs to request.
+        """
+        points = tuple((float(lat), float(lng)) for lat, lng in points)
+        box = bounding_box(points)
+        candidates = self._candidates(key, box)
+        for area in candidates:
+            if area.points == points:
+                self.stats['exact'] += 1
+                return self._copy(area.crimes)
+        for area in candidates:
+            if polygon_contains(area.points, points):
+                self.stats['contained'] += 1
+                return self._copy(area.within(points))
+
+        covered = set()
+        remainder = []
+        if candidates:
+            cells = split_box(box, self.grid, self.grid)
+            for i, cell in enumerate(cells):
+                corners = rectangle(*cell)
+                if not polygons_intersect(points, corners):
+                    continue
+                for area in candidates:
+                    if _boxes_overlap(area.box, cell) and \
+                            polygon_contains(area.points, corners):
+                        covered.add(area)
+                        break
+                else:
+                    remainder.append((i, cell))
+        if not covered:
+            self.stats['miss'] += 1
+            return self._copy(self._fetch(key, points, fetch).crimes)
+
+        self.stats['partial'] += 1
+        areas = list(covered)
+        for cell in _merge_cells(remainder, self.grid):
+            areas.extend(self._fetch_box(key, cell, fetch))
+        crimes = []
+        seen = set()
+        for area in areas:
+            for crime in area.within(points):
+                if crime['id'] not in seen:
+                    seen.add(crime['id'])
+                    crimes.append(crime)
+        return self._copy(crimes)
+
+    def _copy(self, crimes):
+        # Hydrating crimes modifies their data, so callers get their own.
+        return json.loads(json.dumps(crimes))
@@ -0,0 +1,313 @@
+import math
+from array import array
+from collections import Counter
+
+from .columnar import CrimeColumns
+from .spatial import crime_coordinates
+
+# Ellipsoids, as (semi-major axis, semi-minor axis) in metres.
+WGS84 = (6378137.0, 6356752.314245)
+AIRY_1830 = (6377563.396, 6356256.909)
+
+# The Helmert transformation from WGS84 to OSGB36, as translations in
+# metres, scale in parts per million, and rotations in arc-seconds. This is
+# accurate to around 5m across Great Britain.
+HELMERT = (-446.448, 125.157, -542.060, 20.4894, -0.1502, -0.2470, -0.8421)
+
+# The National Grid's Transverse Mercator projection.
+NG_SCALE = 0.9996012717
+NG_ORIGIN = (math.radians(49), math.radians(-2))
+NG_FALSE_ORIGIN = (400000.0, -100000.0)
+
+
+def _to_cartesian(lat, lng, ellipsoid):
+    a, b = ellipsoid
+    e2 = 1 - (b * b) / (a * a)
+    sin_lat = math.sin(lat)
+    nu = a / math.sqrt(1 - e2 * sin_lat * sin_lat)
+    cos_lat = math.cos(lat)
+    return (nu * cos_lat * math.cos(lng), nu * cos_lat * math.sin(lng),
+            (1 - e2) * nu * sin_lat)
+
+
+def _from_cartesian(x, y, z, ellipsoid):
+    a, b = ellipsoid
+    e2 = 1 - (b * b) / (a * a)
+    p = math.sqrt(x * x + y * y)
+    lat = math.atan2(z, p * (1 - e2))
+    for i in range(10):
+        sin_lat = math.sin(lat)
+        nu = a / math.sqrt(1 - e2 * sin_lat * sin_lat)
+        previous, lat = lat, math.atan2(z + e2 * nu * sin_lat, p)
+        if abs(lat - previous) < 1e-12:
+            break
+    return lat, math.atan2(y, x)
+
+
+def _helmert(x, y, z):
+    tx, ty, tz, s, rx, ry, rz = HELMERT
+    s = 1 + s / 1e6
+    rx, ry, rz = [math.radians(r / 3600) for r in (rx, ry, rz)]
+    return (tx + s * x - rz * y + ry * z,
+            ty + rz * x + s * y - rx * z,
+            tz - ry * x + rx * y + s * z)
+
+
+def _transverse_mercator(lat, lng):
+    """
+    Project OSGB36 latitude/longitude (in radians) onto the National Grid.
+    """
+    a, b = AIRY_1830
+    lat0, lng0 = NG_ORIGIN
+    e0, n0 = NG_FALSE_ORIGIN
+    f0 = NG_SCALE
+    e2 = 1 - (b * b) / (a * a)
+    n = (a - b) / (a + b)
+    sin_lat = math.sin(lat)
+    cos_lat = math.cos(lat)
+    tan2 = math.tan(lat) ** 2
+    nu = a * f0 / math.sqrt(1 - e2 * sin_lat * sin_lat)
+    rho = a * f0 * (1 - e2) / (1 - e2 * sin_lat * sin_lat) ** 1.5
+    eta2 = nu / rho - 1
+    d, s = lat - lat0, lat + lat0
+    m = b * f0 * (
+        (1 + n + 1.25 * n ** 2 + 1.25 * n ** 3) * d -
+        (3 * n + 3 * n ** 2 + 2.625 * n ** 3) * math.sin(d) * math.cos(s) +
+        (1.875 * n ** 2 + 1.875 * n ** 3) * math.sin(2 * d) *
+        math.cos(2 * s) -
+        35.0 / 24 * n ** 3 * math.sin(3 * d) * math.cos(3 * s))
+    i = m + n0
+    ii = nu / 2 * sin_lat * cos_lat
+    iii = nu / 24 * sin_lat * cos_lat ** 3 * (5 - tan2 + 9 * eta2)
+    iiia = nu / 720 * sin_lat * cos_lat ** 5 * (61 - 58 * tan2 + tan2 ** 2)
+    iv = nu * cos_lat
+    v = nu / 6 * cos_lat ** 3 * (nu / rho - tan2)
+    vi = nu / 120 * cos_lat ** 5 * (5 - 18 * tan2 + tan2 ** 2 + 14 * eta2 -
+                                    58 * tan2 * eta2)
+    dl = lng - lng0
+    northing = i + ii * dl ** 2 + iii * dl ** 4 + iiia * dl ** 6
+    easting = e0 + iv * dl + v * dl ** 3 + vi * dl ** 5
+    return easting, northing
+
+
+def to_bng(lat, lng):
+    """
+    Convert a WGS84 latitude and longitude (as used by the API) to a British
+    National Grid ``(easting, northing)`` in metres.
+    """
+    x, y, z = _helmert(*_to_cartesian(math.radians(lat), math.radians(lng),
+                                      WGS84))
+    return _transverse_mercator(*_from_cartesian(x, y, z, AIRY_1830))
+
+
+def to_bng_many(lats, lngs):
+    """
+    Convert parallel sequences of latitudes and longitudes to arrays of
+    eastings and northings. Missing (NaN) coordinates stay NaN.
+    """
+    eastings = array('d')
+    northings = array('d')
+    for lat, lng in zip(lats, lngs):
+        if lat != lat or lng != lng:
+            eastings.append(lat)
+            northings.append(lat)
+            continue
+        easting, northing = to_bng(lat, lng)
+        eastings.append(easting)
+        northings.append(northing)
+    return eastings, northings
+
+
+class Grid(object):
+    """
+    Maps coordinates to cell keys. Bounded grids have a ``shape`` of
+    ``(rows, columns)`` and ``(row, column)`` keys, and can produce dense
+    arrays; coordinates outside the bounds are dropped.
+    """
+    shape = None
+
+    def bin(self, lats, lngs):
+        """
+        The cell key for each coordinate (``None`` if it falls outside the
+        grid or is missing).
+        """
+        raise NotImplementedError
+
+
+class _RegularGrid(Grid):
+
+    def __init__(self, cell_size, bounds=None):
+        self.cell_size = float(cell_size)
+        self.bounds = bounds
+        if bounds is not None:
+            south, west, north, east = bounds
+            # Allow for floating point error, so that e.g. 0.1 degrees in
+            # 0.01 degree cells is 10 cells rather than 11.
+            self.shape = (
+                int(math.ceil((north - south) / self.cell_size - 1e-9)),
+                int(math.ceil((east - west) / self.cell_size - 1e-9)))
+
+    def _bin_xy(self, ys, xs):
+        size = self.cell_size
+        floor = math.floor
+        keys = []
+        append = keys.append
+        if self.bounds is None:
+            for y, x in zip(ys, xs):
+                if y != y or x != x:
+                    append(None)
+                else:
+                    append((int(floor(y / size)), int(floor(x / size))))
+            return keys
+        south, west, north, east = self.bounds
+        rows, columns = self.shape
+        for y, x in zip(ys, xs):
+            if not (south <= y < north and west <= x < east):
+                append(None)
+            else:
+                append((min(int((y - south) / size), rows - 1),
+                        min(int((x - west) / size), columns - 1)))
+        return keys
+
+    def cell_bounds(self, key):
+        """
+        The ``(south, west, north, east)`` bounds of a cell, in the grid's
+        own coordinates.
+        """
+        row, column = key
+        south, west = 0.0, 0.0
+        if self.bounds is not None:
+            south, west = self.bounds[:2]
+        return (south + row * self.cell_size, west + column * self.cell_size,
+                south + (row + 1) * self.cell_size,
+                west + (column + 1) * self.cell_size)
+
+
+class LatLngGrid(_RegularGrid):
+    """
+    A regular grid of ``cell_size`` degrees, optionally bounded by ``(south,
+    west, north, east)``.
+    """
+
+    def bin(self, lats, lngs):
+        return self._bin_xy(lats, lngs)
+
+
+class BNGGrid(_RegularGrid):
+    """
+    A regular grid of ``cell_size`` metre squares on the British National
+    Grid, optionally bounded by ``(min_northing, min_easting, max_northing,
+    max_easting)``.
+    """
+
+    def bin(self, lats, lngs):
+        eastings, northings = to_bng_many(lats, lngs)
+        return self._bin_xy(northings, eastings)
+
+
+class HexGrid(Grid):
+    """
+    A grid of pointy-topped hexagons on the British National Grid, each
+    ``size`` metres from centre to corner. Keys are axial ``(q, r)``
+    coordinates. Hex grids are unbounded, so only produce sparse counts.
+    """
+
+    def __init__(self, size):
+        self.size = float(size)
+
+    def bin(self, lats, lngs):
+        eastings, northings = to_bng_many(lats, lngs)
+        size = self.size
+        root3 = math.sqrt(3)
+        keys = []
+        for x, y in zip(eastings, northings):
+            if x != x:
+                keys.append(None)
+                continue
+            q = (root3 / 3 * x - y / 3.0) / size
+            r = (2.0 / 3 * y) / size
+            keys.append(self._round(q, r))
+        return keys
+
+    def _round(self, q, r):
+        s = -q - r
+        rq, rr, rs = round(q), round(r), round(s)
+        dq, dr, ds = abs(rq - q), abs(rr - r), abs(rs - s)
+        if dq > dr and dq > ds:
+            rq = -rr - rs
+        elif dr > ds:
+            rr = -rq - rs
+        return int(rq), int(rr)
+
+    def centre(self, key):
+        """
+        The ``(easting, northing)`` of a hexagon's centre.
+        """
+        q, r = key
+        return (self.size * math.sqrt(3) * (q + r / 2.0),
+                self.size * 1.5 * r)
+
+
+def _coordinates(source):
+    if isinstance(source, CrimeColumns):
+        return source.latitude, source.longitude
+    if isinstance(source, tuple) and len(source) == 2:
+        return source
+    lats = array('d')
+    lngs = array('d')
+    for crime in source:
+        coords = crime_coordinates(crime)
+        if coords is not None:
+            lats.append(coords[0])
+            lngs.append(coords[1])
+    return lats, lngs
+
+
+class HeatMap(object):
+    """
+    Accumulates crime counts per grid cell across any number of queries and
+    months.
+    """
+
+    def __init__(self, grid):
+        self.grid = grid
+        self.counts = Counter()
+        self.dropped = 0
+
+    def add(self, source):
+        """
+        Add crimes from a ``CrimeColumns``, an iterable of ``Crime``
+        objects, or a ``(lats, lngs)`` tuple of coordinate sequences.
+        """
+        keys = self.grid.bin(*_coordinates(source))
+        self.counts.update(keys)
+        self.dropped += self.counts.pop(None, 0)
+        return self
+
+    def __add__(self, other):
+        heatmap = HeatMap(self.grid)
+        heatmap.counts = self.counts + other.counts
+        heatmap.dropped = self.dropped + other.dropped
+        return heatmap
+
+    def total(self):
+        return sum(self.counts.values())
+
+    def sparse(self):
+        """
+        A ``dict`` of cell key to count, for non-empty cells only.
+        """
+        return dict(self.counts)
+
+    def dense(self):
+        """
+        A list of ``array('l')`` rows, one count per cell. Only available
+        for bounded grids.
+        """
+        if self.grid.shape is None:
+            raise ValueError('Dense output needs a bounded grid')
+        rows, columns = self.grid.shape
+        dense = [array('l', [0] * columns) for i in range(rows)]
+        for (row, column), count in self.counts.items():
+            dense[row][column] = count
+        return dense
@@ -0,0 +1,151 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from .pool import WorkerPool
+
+logger = logging.getLogger(__name__)
+
+
+class RefreshingCache(object):
+    """
+    A stale-while-revalidate cache. Values younger than ``ttl`` seconds are
+    served as they are. Older values are still served immediately, for up
+    to ``max_stale`` seconds more, while a background worker fetches a
+    replacement; past that they have expired, and the caller waits for a
+    fresh value. If a background refresh fails the stale value is kept, so
+    an upstream outage only shows once values hard-expire.
+    """
+
+    def __init__(self, ttl, max_stale=24 * 60 * 60, workers=2,
+                 clock=time.time):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.workers = workers
+        self.clock = clock
+        self.stats = {'fresh': 0, 'stale': 0, 'miss': 0, 'refreshed': 0,
+                      'errors': 0}
+        self._entries = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def age(self, key):
+        """
+        Seconds since the value for ``key`` was fetched, or ``None``.
+        """
+        entry = self._entries.get(key)
+        return None if entry is None else self.clock() - entry[1]
+
+    def get(self, key, load):
+        """
+        The value for ``key``, calling ``load()`` to fetch it when missing
+        or expired, and in the background when stale.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, fetched = entry
+            age = self.clock() - fetched
+            if age < self.ttl:
+                self.stats['fresh'] += 1
+                return value
+            if age < self.ttl + self.max_stale:
+                self.stats['stale'] += 1
+                self._refresh(key, load)
+                return value
+        self.stats['miss'] += 1
+        value = load()
+        self.set(key, value)
+        return value
+
+    def set(self, key, value, fetched=None):
+        self._entries[key] = (value,
+                              self.clock() if fetched is None else fetched)
+
+    def invalidate(self, key=None):
+        """
+        Drop the value for ``key``, or every value.
+        """
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def _refresh(self, key, load):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            if self._pool is None:
+                self._pool = WorkerPool(self.workers)
+        self._pool.submit(self._reload, key, load)
+
+    def _reload(self, key, load):
+        try:
+            self.set(key, load())
+            self.stats['refreshed'] += 1
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.warning('Background refresh of %s failed: %s' % (key, e))
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def wait(self):
+        """
+        Block until every background refresh started so far has finished.
+        """
+        while True:
+            with self._lock:
+                if not self._refreshing:
+                    return
+            time.sleep(0.01)
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+
+
+class LRUCache(object):
+    """
+    A thread-safe cache of up to ``size`` values, discarding the least
+    recently used first.
+    """
+
+    def __init__(self, size=512):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
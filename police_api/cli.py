@@ -0,0 +1,106 @@
+import argparse
+import io
+import sys
+
+from . import PoliceAPI
+from .export import EXPORTERS, export, iter_crimes
+from .snapshot import Snapshot
+from .utils import decode_polygon, month_range
+
+
+def _months(args, api):
+    if args.months:
+        return args.months
+    if args.start or args.end:
+        dates = api.get_dates()
+        return month_range(args.start or dates[-1], args.end or dates[0])
+    return [None]
+
+
+def _client(args):
+    return PoliceAPI(**dict(
+        (k, v) for k, v in [('base_url', args.base_url)] if v))
+
+
+def _export(args):
+    api = _client(args)
+    source = iter_crimes(api, forces=args.forces,
+                         areas=[decode_polygon(a) for a in args.areas],
+                         months=_months(args, api), category=args.category)
+    format = args.format
+    if format == 'parquet':
+        rows = export(source, args.output, format)
+    elif args.output:
+        with io.open(args.output, 'w', newline='', encoding='utf-8') as f:
+            rows = export(source, f, format)
+    else:
+        rows = export(source, sys.stdout, format)
+    sys.stderr.write('Exported %d crimes\n' % rows)
+
+
+def _snapshot(args):
+    snapshot = Snapshot.create(_client(args), forces=args.forces or None,
+                               boundaries=not args.no_boundaries)
+    snapshot.save(args.output)
+    sys.stderr.write('Saved %s\n' % snapshot)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='police-api')
+    parser.add_argument('--base-url', help='The base URL of the Police API')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    command = commands.add_parser(
+        'export', help='Export street-level crimes to a file')
+    command.add_argument('-f', '--force', dest='forces', action='append',
+                         default=[], help='A force ID (repeatable)')
+    command.add_argument('-a', '--area', dest='areas', action='append',
+                         default=[],
+                         help='A polygon as lat,lng:lat,lng:... (repeatable)')
+    command.add_argument('-m', '--month', dest='months', action='append',
+                         default=[], help='A month as YYYY-MM (repeatable)')
+    command.add_argument('--from', dest='start',
+                         help='The first month of a range, as YYYY-MM')
+    command.add_argument('--to', dest='end',
+                         help='The last month of a range, as YYYY-MM')
+    command.add_argument('-c', '--category', help='A crime category ID')
+    command.add_argument('--format', choices=sorted(EXPORTERS),
+                         help='The output format (default: from the output '
+                              'file extension, or ndjson)')
+    command.add_argument('-o', '--output',
+                         help='The output file (default: stdout)')
+    command.set_defaults(func=_export)
+
+    command = commands.add_parser(
+        'snapshot', help='Save a snapshot of the reference data')
+    command.add_argument('-f', '--force', dest='forces', action='append',
+                         default=[], help='A force ID (repeatable; default: '
+                                          'every force)')
+    command.add_argument('--no-boundaries', action='store_true',
+                         help="Don't include neighbourhood boundaries")
+    command.add_argument('-o', '--output', required=True,
+                         help='The snapshot file')
+    command.set_defaults(func=_snapshot)
+
+    args = parser.parse_args(argv)
+    if args.command == 'export':
+        if not (args.forces or args.areas):
+            parser.error('export needs at least one --force or --area')
+        if args.format is None:
+            # Checked before anything is fetched or the output is created.
+            if not args.output:
+                args.format = 'ndjson'
+            elif '.' in args.output:
+                args.format = args.output.rsplit('.', 1)[-1].lower()
+            if args.format not in EXPORTERS:
+                parser.error('unrecognised output file extension; give '
+                             '--format (one of %s)'
+                             % ', '.join(sorted(EXPORTERS)))
+        if args.format == 'parquet' and not args.output:
+            parser.error('parquet export requires --output')
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+from array import array
+
+from .crime import Crime
+
+NAN = float('nan')
+
+
+class Categorical(object):
+    """
+    A dictionary-encoded column: each distinct value is stored once, and
+    each row holds an integer code into the list of values.
+    """
+
+    def __init__(self, values=()):
+        self.values = []
+        self.codes = array('i')
+        self._index = {}
+        for value in values:
+            self.append(value)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        return self.values[self.codes[i]]
+
+    def __iter__(self):
+        values = self.values
+        return (values[c] for c in self.codes)
+
+    def __getstate__(self):
+        return self.values, self.codes
+
+    def __setstate__(self, state):
+        self.values, self.codes = state
+        self._index = dict((v, i) for i, v in enumerate(self.values))
+
+    def code(self, value):
+        try:
+            return self._index[value]
+        except KeyError:
+            self._index[value] = len(self.values)
+            self.values.append(value)
+            return self._index[value]
+
+    def append(self, value):
+        self.codes.append(self.code(value))
+
+    def extend(self, other):
+        mapping = [self.code(v) for v in other.values]
+        self.codes.extend(mapping[c] for c in other.codes)
+
+    def take(self, indices):
+        taken = Categorical()
+        taken.values = list(self.values)
+        taken._index = dict(self._index)
+        codes = self.codes
+        taken.codes = array('i', (codes[i] for i in indices))
+        return taken
+
+    def counts(self):
+        """
+        The number of rows holding each value, as a ``dict``.
+        """
+        tally = [0] * len(self.values)
+        for c in self.codes:
+            tally[c] += 1
+        return dict((v, n) for v, n in zip(self.values, tally) if n)
+
+
+class CrimeColumns(object):
+    """
+    Crimes from a ``crimes-street`` style response held as compact, picklable
+    columns rather than ``Crime`` objects. Coordinates are float arrays (NaN
+    where a crime has no location) and repetitive string fields are
+    dictionary-encoded.
+    """
+    plain = ['id', 'persistent_id', 'location_id', 'street_name', 'context',
+             'outcome_date']
+    categorical = ['month', 'category', 'location_type', 'location_subtype',
+                   'outcome_status']
+    columns = plain + categorical + ['latitude', 'longitude']
+
+    def __init__(self):
+        for name in self.plain:
+            setattr(self, name, [])
+        for name in self.categorical:
+            setattr(self, name, Categorical())
+        self.latitude = array('d')
+        self.longitude = array('d')
+
+    @classmethod
+    def from_json(cls, data):
+        """
+        Build columns from decoded ``crimes-street`` JSON.
+        """
+        columns = cls()
+        columns.append_json(data)
+        return columns
+
+    def append_json(self, data):
+        for c in data:
+            location = c.get('location') or {}
+            street = location.get('street') or {}
+            outcome = c.get('outcome_status') or {}
+            self.id.append(c.get('id'))
+            self.persistent_id.append(c.get('persistent_id'))
+            self.month.append(c.get('month'))
+            self.category.append(c.get('category'))
+            self.context.append(c.get('context'))
+            self.location_type.append(c.get('location_type'))
+            self.location_subtype.append(c.get('location_subtype'))
+            self.location_id.append(street.get('id'))
+            self.street_name.append(street.get('name'))
+            latitude = location.get('latitude')
+            self.latitude.append(float(latitude) if latitude else NAN)
+            longitude = location.get('longitude')
+            self.longitude.append(float(longitude) if longitude else NAN)
+            self.outcome_status.append(outcome.get('category'))
+            self.outcome_date.append(outcome.get('date'))
+
+    def __len__(self):
+        return len(self.id)
+
+    def extend(self, other):
+        for name in self.plain + ['latitude', 'longitude']:
+            getattr(self, name).extend(getattr(other, name))
+        for name in self.categorical:
+            getattr(self, name).extend(getattr(other, name))
+
+    def take(self, indices):
+        """
+        A new ``CrimeColumns`` holding only the rows at ``indices``.
+        """
+        indices = list(indices)
+        taken = CrimeColumns()
+        for name in self.plain:
+            column = getattr(self, name)
+            setattr(taken, name, [column[i] for i in indices])
+        for name in self.categorical:
+            setattr(taken, name, getattr(self, name).take(indices))
+        for name in ['latitude', 'longitude']:
+            column = getattr(self, name)
+            setattr(taken, name, array('d', (column[i] for i in indices)))
+        return taken
+
+    def row(self, i):
+        """
+        A flat ``dict`` of the values in row ``i``.
+        """
+        return dict((name, getattr(self, name)[i]) for name in self.columns)
+
+    def rows(self):
+        for i in range(len(self)):
+            yield self.row(i)
+
+    def to_json(self, i):
+        """
+        Row ``i`` in the shape returned by the API, ready for hydration.
+        """
+        latitude = self.latitude[i]
+        location = None
+        if latitude == latitude:
+            location = {
+                'latitude': repr(latitude),
+                'longitude': repr(self.longitude[i]),
+                'street': {
+                    'id': self.location_id[i],
+                    'name': self.street_name[i],
+                },
+            }
+        outcome = None
+        if self.outcome_status[i] is not None:
+            outcome = {
+                'category': self.outcome_status[i],
+                'date': self.outcome_date[i],
+            }
+        return {
+            'id': self.id[i],
+            'persistent_id': self.persistent_id[i],
+            'month': self.month[i],
+            'category': self.category[i],
+            'context': self.context[i],
+            'location_type': self.location_type[i],
+            'location_subtype': self.location_subtype[i],
+            'location': location,
+            'outcome_status': outcome,
+        }
+
+    def to_crimes(self, api):
+        """
+        Hydrate every row into a ``Crime`` attached to ``api``.
+        """
+        return [Crime(api, data=self.to_json(i)) for i in range(len(self))]
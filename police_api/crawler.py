@@ -0,0 +1,317 @@
+import json
+import logging
+import queue
+import sqlite3
+import time
+
+from .pool import WorkerPool
+from .scheduler import BULK
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    months TEXT NOT NULL,
+    started REAL NOT NULL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    run_id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    args TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (run_id, key)
+);
+CREATE TABLE IF NOT EXISTS completed (
+    key TEXT PRIMARY KEY,
+    completed REAL NOT NULL
+);
+"""
+
+PENDING = 'pending'
+DONE = 'done'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+
+
+class Task(object):
+    """
+    A unit of crawl work. ``kind`` selects the handler, and ``args`` is a
+    JSON-serialisable ``dict`` of its parameters.
+    """
+    key_args = {
+        'forces': (),
+        'neighbourhoods': ('force',),
+        'boundary': ('force', 'neighbourhood'),
+        'crimes': ('force', 'neighbourhood', 'month'),
+        'outcomes': ('persistent_id',),
+    }
+
+    def __init__(self, kind, **args):
+        if kind not in self.key_args:
+            raise ValueError('Unknown task kind: %s' % kind)
+        self.kind = kind
+        self.args = args
+
+    @property
+    def key(self):
+        return '/'.join([self.kind] +
+                        [str(self.args[a]) for a in self.key_args[self.kind]])
+
+    def __str__(self):
+        return '<Task> %s' % self.key
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class CrawlReport(object):
+    """
+    Progress and throughput figures for a crawl run.
+    """
+
+    def __init__(self, run_id, started):
+        self.run_id = run_id
+        self.started = started
+        self.finished = None
+        self.counts = {}
+
+    def _count(self, kind, state):
+        counts = self.counts.setdefault(kind, {})
+        counts[state] = counts.get(state, 0) + 1
+
+    def total(self, state):
+        return sum(c.get(state, 0) for c in self.counts.values())
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def throughput(self):
+        """
+        Tasks completed per second.
+        """
+        return self.total(DONE) / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        lines = ['Run %s: %d done, %d skipped, %d failed in %.1fs '
+                 '(%.2f tasks/s)' % (self.run_id, self.total(DONE),
+                                     self.total(SKIPPED), self.total(FAILED),
+                                     self.elapsed, self.throughput)]
+        for kind in sorted(self.counts):
+            counts = self.counts[kind]
+            lines.append('  %s: %s' % (kind, ', '.join(
+                '%d %s' % (counts[s], s) for s in sorted(counts))))
+        return '\n'.join(lines)
+
+
+class Crawler(object):
+    """
+    Walks forces, neighbourhoods, boundaries and crimes (and optionally
+    outcomes) using a bounded pool of worker threads, checkpointing progress
+    to a SQLite database so that an interrupted run can be resumed.
+
+    ``sink`` is called as ``sink(task, result)`` from the coordinating thread
+    for every completed task. A task is only checkpointed as done after the
+    sink has returned.
+    """
+
+    def __init__(self, api, path, sink=None, workers=8, forces=None,
+                 include_outcomes=False, mutable_months=1, max_attempts=3):
+        self.api = api
+        self.path = path
+        self.sink = sink
+        self.workers = workers
+        self.forces = forces
+        self.include_outcomes = include_outcomes
+        self.mutable_months = mutable_months
+        self.max_attempts = max_attempts
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    # Task handlers, run on worker threads. Each returns a (result, children)
+    # tuple.
+
+    def _run_forces(self):
+        forces = self.api.get_forces()
+        children = [Task('neighbourhoods', force=f.id) for f in forces
+                    if self.forces is None or f.id in self.forces]
+        return forces, children
+
+    def _run_neighbourhoods(self, force):
+        neighbourhoods = self.api.get_neighbourhoods(force)
+        children = [Task('boundary', force=force, neighbourhood=n.id)
+                    for n in neighbourhoods]
+        return neighbourhoods, children
+
+    def _run_boundary(self, force, neighbourhood):
+        neighbourhood = self.api.get_neighbourhood(force, neighbourhood)
+        force = neighbourhood.force
+        boundary = neighbourhood.boundary
+        children = [Task('crimes', force=force.id,
+                         neighbourhood=neighbourhood.id,
+                         month=month, boundary=boundary)
+                    for month in self._months]
+        return boundary, children
+
+    def _run_crimes(self, force, neighbourhood, month, boundary):
+        crimes = self.api.get_crimes_area(boundary, date=month)
+        children = []
+        if self.include_outcomes:
+            children = [Task('outcomes', persistent_id=c.persistent_id)
+                        for c in crimes if c.persistent_id]
+        return crimes, children
+
+    def _run_outcomes(self, persistent_id):
+        return self.api.get_crime(persistent_id), []
+
+    def _execute(self, task):
+        handler = getattr(self, '_run_%s' % task.kind)
+        return handler(**task.args)
+
+    # Checkpointing, only ever called from the coordinating thread.
+
+    def _is_immutable(self, task):
+        return (task.kind == 'crimes' and
+                task.args['month'] not in self._mutable)
+
+    def _enqueue(self, run_id, tasks):
+        now = time.time()
+        queued = []
+        with self.db:
+            for task in tasks:
+                state = PENDING
+                if self._is_immutable(task) and self.db.execute(
+                        'SELECT 1 FROM completed WHERE key = ?',
+                        (task.key,)).fetchone():
+                    state = SKIPPED
+                cursor = self.db.execute(
+                    'INSERT OR IGNORE INTO tasks '
+                    '(run_id, key, kind, args, state, updated) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (run_id, task.key, task.kind, json.dumps(task.args),
+                     state, now))
+                if cursor.rowcount and state == PENDING:
+                    queued.append(task)
+                elif cursor.rowcount:
+                    self.report._count(task.kind, SKIPPED)
+        return queued
+
+    def _mark(self, run_id, task, state, error=None):
+        now = time.time()
+        with self.db:
+            self.db.execute(
+                'UPDATE tasks SET state = ?, error = ?, updated = ?, '
+                'attempts = attempts + 1 WHERE run_id = ? AND key = ?',
+                (state, error, now, run_id, task.key))
+            if state == DONE and self._is_immutable(task):
+                self.db.execute(
+                    'INSERT OR REPLACE INTO completed (key, completed) '
+                    'VALUES (?, ?)', (task.key, now))
+
+    def _attempts(self, run_id, task):
+        return self.db.execute(
+            'SELECT attempts FROM tasks WHERE run_id = ? AND key = ?',
+            (run_id, task.key)).fetchone()[0]
+
+    def _start(self, months, resume):
+        row = None
+        if resume:
+            row = self.db.execute(
+                'SELECT id, months, started FROM runs WHERE finished IS NULL '
+                'ORDER BY id DESC LIMIT 1').fetchone()
+        if row is not None:
+            run_id, months, started = row
+            self._months = json.loads(months)
+            self.report = CrawlReport(run_id, time.time())
+            pending = [
+                Task(kind, **json.loads(args))
+                for kind, args in self.db.execute(
+                    'SELECT kind, args FROM tasks WHERE run_id = ? '
+                    'AND state = ?', (run_id, PENDING))]
+            logger.info('Resuming run %s with %d pending tasks' %
+                        (run_id, len(pending)))
+            return run_id, pending
+        if months is None:
+            months = [self.api.get_latest_date()]
+        self._months = list(months)
+        with self.db:
+            run_id = self.db.execute(
+                'INSERT INTO runs (months, started) VALUES (?, ?)',
+                (json.dumps(self._months), time.time())).lastrowid
+        self.report = CrawlReport(run_id, time.time())
+        return run_id, self._enqueue(run_id, [Task('forces')])
+
+    def _mutable_months(self):
+        if not self.mutable_months:
+            return set()
+        return set(self.api.get_dates()[:self.mutable_months])
+
+    def run(self, months=None, resume=True):
+        """
+        Crawl the given months (the latest month if ``None``), resuming the
+        last unfinished run if there is one and ``resume`` is ``True``.
+        Returns a ``CrawlReport``.
+        """
+        self._mutable = self._mutable_months()
+        run_id, pending = self._start(months, resume)
+        completions = queue.Queue()
+        in_flight = 0
+        pool = WorkerPool(self.workers, BULK)
+        try:
+            while pending or in_flight:
+                while pending and in_flight < self.workers:
+                    task = pending.pop()
+                    future = pool.submit(self._execute, task)
+                    future.add_done_callback(
+                        lambda f, task=task: completions.put((task, f)))
+                    in_flight += 1
+                task, future = completions.get()
+                in_flight -= 1
+                error = future.exception()
+                if error is None:
+                    result, children = future.result()
+                    if self.sink is not None:
+                        self.sink(task, result)
+                    pending.extend(self._enqueue(run_id, children))
+                    self._mark(run_id, task, DONE)
+                    self.report._count(task.kind, DONE)
+                elif self._attempts(run_id, task) + 1 < self.max_attempts:
+                    logger.warning('%s failed, retrying: %s' % (task, error))
+                    self._mark(run_id, task, PENDING, str(error))
+                    pending.insert(0, task)
+                else:
+                    logger.error('%s failed: %s' % (task, error))
+                    self._mark(run_id, task, FAILED, str(error))
+                    self.report._count(task.kind, FAILED)
+        finally:
+            pool.close()
+        self.report.finished = time.time()
+        with self.db:
+            self.db.execute('UPDATE runs SET finished = ? WHERE id = ?',
+                            (self.report.finished, run_id))
+        return self.report
+
+    def progress(self, run_id=None):
+        """
+        The number of tasks in each state for a run (the most recent run if
+        ``None``), as a ``dict`` of ``{kind: {state: count}}``.
+        """
+        if run_id is None:
+            row = self.db.execute('SELECT MAX(id) FROM runs').fetchone()
+            run_id = row[0]
+        progress = {}
+        for kind, state, count in self.db.execute(
+                'SELECT kind, state, COUNT(*) FROM tasks WHERE run_id = ? '
+                'GROUP BY kind, state', (run_id,)):
+            progress.setdefault(kind, {})[state] = count
+        return progress
@@ -101,12 +101,20 @@ class Crime(NoLocationCrime):
 
     @property
     def outcomes(self):
+        # Crimes are too numerous to carry a lock each. Concurrent first
+        # reads may both fetch (sharing one upstream call via the service's
+        # single-flight layer), but only the first result is kept.
         if self._outcomes is None:
-            self._outcomes = self._get_outcomes()
+            outcomes = self._get_outcomes()
+            if self._outcomes is None:
+                self._outcomes = outcomes
         return self._outcomes
 
     def _hydrate_location(self, data):
-        return Location(self.api, data=data)
+        identity = getattr(self.api, 'identity', None)
+        if identity is None or not data:
+            return Location(self.api, data=data)
+        return identity.location(data)
 
     def _hydrate_outcome_status(self, data):
         if data:
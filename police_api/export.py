@@ -0,0 +1,215 @@
+import csv
+import json
+
+from .columnar import CrimeColumns
+from .forces import Force
+from .planner import get_crimes_polygon
+
+FIELDS = ['id', 'persistent_id', 'month', 'category', 'location_type',
+          'location_subtype', 'latitude', 'longitude', 'location_id',
+          'street_name', 'context', 'outcome_status', 'outcome_date']
+
+# Columns with few distinct values, which are dictionary-encoded in Parquet.
+CATEGORICAL = ['month', 'category', 'location_type', 'location_subtype',
+               'outcome_status', 'outcome_date']
+
+
+def crime_row(crime):
+    """
+    A flat ``dict`` of a crime's values, keyed by ``FIELDS``. A
+    ``NoLocationCrime`` has ``None`` for the values it lacks.
+    """
+    location = getattr(crime, 'location', None)
+    has_location = location is not None and location.latitude is not None
+    category = getattr(crime, 'category', None)
+    status = getattr(crime, 'outcome_status', None)
+    return {
+        'id': crime.id,
+        'persistent_id': getattr(crime, 'persistent_id', None),
+        'month': crime.month,
+        'category': category.id if category else None,
+        'location_type': getattr(crime, 'location_type', None),
+        'location_subtype': getattr(crime, 'location_subtype', None),
+        'latitude': float(location.latitude) if has_location else None,
+        'longitude': float(location.longitude) if has_location else None,
+        'location_id': location.id if has_location else None,
+        'street_name': location.name if has_location else None,
+        'context': crime.context,
+        'outcome_status': status.category.name if status else None,
+        'outcome_date': status.date if status else None,
+    }
+
+
+def _columns_rows(columns):
+    for row in columns.rows():
+        if row['latitude'] != row['latitude']:
+            row['latitude'] = row['longitude'] = None
+        yield row
+
+
+def iter_rows(source):
+    """
+    Flatten crimes into rows one at a time. ``source`` may yield ``Crime``
+    objects, ``CrimeColumns``, or lists of either.
+    """
+    for item in source:
+        if isinstance(item, CrimeColumns):
+            for row in _columns_rows(item):
+                yield row
+        elif isinstance(item, list):
+            for row in iter_rows(item):
+                yield row
+        else:
+            yield crime_row(item)
+
+
+class Exporter(object):
+    """
+    Writes crime rows to a file as they arrive, without holding the output
+    in memory.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.rows = 0
+
+    def write(self, source):
+        for row in iter_rows(source):
+            self.write_row(row)
+            self.rows += 1
+
+    def write_row(self, row):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class NDJSONExporter(Exporter):
+    """
+    One JSON object per line.
+    """
+
+    def write_row(self, row):
+        self.fileobj.write(json.dumps(row, sort_keys=True))
+        self.fileobj.write('\n')
+
+
+class CSVExporter(Exporter):
+    """
+    Comma-separated values, with a header row.
+    """
+
+    def __init__(self, fileobj):
+        super(CSVExporter, self).__init__(fileobj)
+        self.writer = csv.DictWriter(fileobj, FIELDS)
+        self.writer.writeheader()
+
+    def write_row(self, row):
+        self.writer.writerow(row)
+
+
+class ParquetExporter(Exporter):
+    """
+    Apache Parquet, written in row groups of ``row_group_size`` rows with the
+    low-cardinality columns dictionary-encoded. Requires ``pyarrow``.
+    """
+
+    def __init__(self, fileobj, row_group_size=65536):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('Parquet export requires pyarrow')
+        super(ParquetExporter, self).__init__(fileobj)
+        self.pa = pyarrow
+        self.row_group_size = row_group_size
+        string = pyarrow.string()
+        category = pyarrow.dictionary(pyarrow.int32(), string)
+        types = {
+            'id': pyarrow.int64(),
+            'latitude': pyarrow.float64(),
+            'longitude': pyarrow.float64(),
+            'location_id': pyarrow.int64(),
+        }
+        self.schema = pyarrow.schema([
+            (f, category if f in CATEGORICAL else types.get(f, string))
+            for f in FIELDS])
+        self.writer = pyarrow.parquet.ParquetWriter(
+            fileobj, self.schema, use_dictionary=CATEGORICAL)
+        self._buffer = dict((f, []) for f in FIELDS)
+        self._buffered = 0
+
+    def write_row(self, row):
+        for field in FIELDS:
+            self._buffer[field].append(row[field])
+        self._buffered += 1
+        if self._buffered >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._buffered:
+            return
+        arrays = []
+        for field in self.schema:
+            values = self._buffer[field.name]
+            if field.name in CATEGORICAL:
+                arrays.append(self.pa.array(values, self.pa.string())
+                              .dictionary_encode())
+            else:
+                arrays.append(self.pa.array(values, field.type))
+        self.writer.write_table(
+            self.pa.Table.from_arrays(arrays, schema=self.schema))
+        self._buffer = dict((f, []) for f in FIELDS)
+        self._buffered = 0
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+
+
+EXPORTERS = {
+    'ndjson': NDJSONExporter,
+    'csv': CSVExporter,
+    'parquet': ParquetExporter,
+}
+
+
+def iter_crimes(api, forces=(), areas=(), months=(None,), category=None):
+    """
+    Yield lists of crimes for every month in ``months``: for each force (by
+    neighbourhood, via ``Force.crimes_by_neighbourhood``) and for each area
+    (a list of ``(lat, lng)`` tuples). Crimes on the border of two
+    neighbourhoods or forces are only yielded once per month. Forces and
+    areas holding more crimes than the API will return in one request are
+    fetched in pieces.
+    """
+    for month in months:
+        seen = set()
+        for force in forces:
+            if not isinstance(force, Force):
+                force = api.get_force(force)
+            by_neighbourhood = force.crimes_by_neighbourhood(
+                date=month, category=category)
+            for crimes in by_neighbourhood.values():
+                yield [c for c in crimes if c.id not in seen]
+                seen.update(c.id for c in crimes)
+        for points in areas:
+            yield get_crimes_polygon(api, points, date=month,
+                                     category=category)
+
+
+def export(source, fileobj, format='ndjson', **kwargs):
+    """
+    Stream crimes from ``source`` into ``fileobj`` in the given format,
+    returning the number of rows written.
+    """
+    with EXPORTERS[format](fileobj, **kwargs) as exporter:
+        exporter.write(source)
+    return exporter.rows
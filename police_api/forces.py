@@ -1,5 +1,7 @@
-from .neighbourhoods import Neighbourhood
+from .planner import get_crimes_box, split_box
+from .pool import concurrent_map
 from .resource import Resource, SimpleResource
+from .spatial import bounding_box, crime_coordinates, points_in_polygon
 
 
 class Force(Resource):
@@ -7,7 +9,6 @@ class Force(Resource):
     A police force.
     """
     id = None
-    _resource_cache = {}
     _neighbourhoods = None
     fields = ['description', 'telephone', 'name', 'engagement_methods', 'url']
 
@@ -27,21 +28,23 @@ class Force(Resource):
         return 'forces/%s' % self.id
 
     def _get_resource(self, cls, method):
-        if method in self._resource_cache:
-            return self._resource_cache[method]
-        objs = []
         method = 'forces/%s/%s' % (self.id, method)
-        for d in self.api.service.request('GET', method):
-            d.update({
-                'force': self,
-            })
-            objs.append(cls(self.api, data=d))
-        self._resource_cache[method] = objs
-        return objs
+
+        def load():
+            objs = []
+            for d in self.api.service.request_reference('GET', method):
+                d = dict(d)
+                d.update({
+                    'force': self,
+                })
+                objs.append(cls(self.api, data=d))
+            return objs
+
+        return self._get_cached(method, load)
 
     def get_neighbourhood(self, neighbourhood_id, **attrs):
-        return Neighbourhood(self.api, force=self, id=neighbourhood_id,
-                             **attrs)
+        return self.api.identity.neighbourhood(self, neighbourhood_id,
+                                               **attrs)
 
     @property
     def senior_officers(self):
@@ -49,9 +52,56 @@ class Force(Resource):
 
     @property
     def neighbourhoods(self):
-        if self._neighbourhoods is None:
-            self._neighbourhoods = self.api.get_neighbourhoods(self)
-        return self._neighbourhoods
+        return self._memoise('_neighbourhoods',
+                             lambda: self.api.get_neighbourhoods(self))
+
+    def crimes_by_neighbourhood(self, date=None, category=None, tiles=1,
+                                workers=8):
+        """
+        Fetch the force's crimes for a month and assign each to the
+        neighbourhood whose boundary contains it, returning a ``dict`` of
+        neighbourhood to crimes.
+
+        Rather than one area request per neighbourhood (each sending the
+        whole boundary, and fetching crimes on shared borders twice), the
+        bounding box of every boundary is fetched in ``tiles`` x ``tiles``
+        rectangles, split further if any holds too many crimes. Crimes
+        outside every neighbourhood (e.g. in a neighbouring force) are
+        dropped.
+        """
+        neighbourhoods = self.neighbourhoods
+        boundaries = concurrent_map(lambda n: n.boundary, neighbourhoods,
+                                    workers)
+        every_point = [p for b in boundaries for p in b]
+        result = dict((n, []) for n in neighbourhoods)
+        if not every_point:
+            return result
+        fetched = concurrent_map(
+            lambda box: get_crimes_box(self.api, box, date, category),
+            split_box(bounding_box(every_point), tiles, tiles), workers)
+
+        crimes, lats, lngs, seen = [], [], [], set()
+        for crime in (c for tile in fetched for c in tile):
+            coordinates = crime_coordinates(crime)
+            if crime.id in seen or coordinates is None:
+                continue
+            seen.add(crime.id)
+            crimes.append(crime)
+            lats.append(coordinates[0])
+            lngs.append(coordinates[1])
+
+        # Test every remaining crime against each boundary in one pass, so
+        # crimes on a shared border go to the first neighbourhood only.
+        remaining = list(range(len(crimes)))
+        for neighbourhood, boundary in zip(neighbourhoods, boundaries):
+            if not remaining:
+                break
+            inside = points_in_polygon([lats[i] for i in remaining],
+                                       [lngs[i] for i in remaining], boundary)
+            result[neighbourhood] = [crimes[i] for i, hit in
+                                     zip(remaining, inside) if hit]
+            remaining = [i for i, hit in zip(remaining, inside) if not hit]
+        return result
 
     @property
     def slug(self):
@@ -0,0 +1,95 @@
+import threading
+import weakref
+from collections import OrderedDict
+
+from .crime import Location
+from .forces import Force
+from .neighbourhoods import Neighbourhood
+
+
+class IdentityMap(object):
+    """
+    Keeps one ``Force`` per force id, one ``Neighbourhood`` per force and
+    neighbourhood id, and one ``Location`` per street, for a client, so that
+    details and sub-resources loaded through one reference are seen through
+    every other.
+
+    Objects are held weakly, so they are freed once nothing else uses them,
+    except for the ``size`` forces and neighbourhoods most recently asked
+    for, which are kept so that their loaded state can be reused.
+    """
+
+    def __init__(self, api, size=1024):
+        self.api = api
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._objects = weakref.WeakValueDictionary()
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._objects)
+
+    def _get(self, key, create, attrs, keep=True):
+        preload = attrs.pop('preload', False) if attrs else False
+        with self._lock:
+            obj = self._objects.get(key)
+        if obj is None:
+            # Built outside the lock; if another thread got there first,
+            # theirs is kept and this one dropped.
+            created = create()
+            with self._lock:
+                obj = self._objects.get(key)
+                if obj is None:
+                    self.misses += 1
+                    obj = self._objects[key] = created
+                    attrs = None
+                else:
+                    self.hits += 1
+        else:
+            self.hits += 1
+        if attrs:
+            obj._update(attrs)
+        if keep and self.size:
+            with self._lock:
+                self._recent.pop(key, None)
+                self._recent[key] = obj
+                while len(self._recent) > self.size:
+                    self._recent.popitem(last=False)
+        if preload:
+            obj.load()
+        return obj
+
+    def force(self, id, **attrs):
+        return self._get(('force', id),
+                         lambda: Force(self.api, id=id, **attrs), attrs)
+
+    def neighbourhood(self, force, id, **attrs):
+        """
+        The neighbourhood ``id`` of ``force`` (a ``Force`` or its id).
+        """
+        if not isinstance(force, Force):
+            force = self.force(force)
+        return self._get(
+            ('neighbourhood', force.id, id),
+            lambda: Neighbourhood(self.api, force=force, id=id, **attrs),
+            attrs)
+
+    def location(self, data):
+        """
+        The ``Location`` described by a location from an API response.
+        Locations without a street id aren't shared.
+        """
+        street = data.get('street') or {}
+        if street.get('id') is None:
+            return Location(self.api, data=data)
+        key = ('location', street['id'], data.get('type'),
+               data.get('subtype'))
+        return self._get(key, lambda: Location(self.api, data=data), None,
+                         keep=False)
+
+    def clear(self):
+        with self._lock:
+            self._objects.clear()
+            self._recent.clear()
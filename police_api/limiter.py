@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(values, p):
+    """
+    The ``p``th percentile (0-100) of a list of numbers, by nearest rank.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(round(p / 100.0 * (len(values) - 1)))
+    return values[rank]
+
+
+class Decision(object):
+    """
+    One adjustment (or non-adjustment) of an ``AdaptiveLimiter``'s limit,
+    with the measurements it was based on.
+    """
+
+    def __init__(self, old, new, reason, p50, p90, error_rate, throttled):
+        self.time = time.time()
+        self.old = old
+        self.new = new
+        self.reason = reason
+        self.p50 = p50
+        self.p90 = p90
+        self.error_rate = error_rate
+        self.throttled = throttled
+
+    def __str__(self):
+        return '<Decision> %d -> %d (%s)' % (self.old, self.new, self.reason)
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class AdaptiveLimiter(object):
+    """
+    Limits the number of requests in flight, adjusting the limit by additive
+    increase, multiplicative decrease (AIMD).
+
+    After every ``window`` completed requests the limit is cut by a factor
+    of ``decrease`` if any were throttled (429), more than
+    ``error_threshold`` of them failed, or their 90th percentile latency
+    exceeded ``tolerance`` times the baseline (the lowest median latency
+    seen, allowed to drift upwards slowly). Otherwise, if the limit was
+    reached during the window, it grows by ``increase``.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=64, increase=1,
+                 decrease=0.5, window=20, error_threshold=0.1, tolerance=2.0,
+                 history=100):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.window = window
+        self.error_threshold = error_threshold
+        self.tolerance = tolerance
+        self.baseline = None
+        self.in_flight = 0
+        self.history = deque(maxlen=history)
+        self._samples = []
+        self._saturated = False
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+            if self.in_flight >= self.limit:
+                self._saturated = True
+
+    def release(self, latency, status):
+        """
+        Record a finished request: its latency in seconds, and its HTTP
+        status (``None`` if it failed without one).
+        """
+        with self._condition:
+            self.in_flight -= 1
+            self._samples.append((latency, status))
+            if len(self._samples) >= self.window:
+                self._decide()
+            self._condition.notify_all()
+
+    def _decide(self):
+        samples, self._samples = self._samples, []
+        latencies = [s[0] for s in samples]
+        throttled = sum(1 for s in samples if s[1] == 429)
+        errors = sum(1 for s in samples if s[1] is None or s[1] >= 500)
+        error_rate = errors / float(len(samples))
+        p50 = percentile(latencies, 50)
+        p90 = percentile(latencies, 90)
+        if self.baseline is None:
+            self.baseline = p50
+        else:
+            self.baseline = min(p50, self.baseline * 1.1)
+
+        old = self.limit
+        shrunk = max(self.minimum, int(old * self.decrease))
+        if throttled:
+            new, reason = shrunk, 'throttled'
+        elif error_rate > self.error_threshold:
+            new, reason = shrunk, 'errors'
+        elif p90 > self.baseline * self.tolerance:
+            new, reason = shrunk, 'latency'
+        elif self._saturated:
+            new, reason = min(self.maximum, old + self.increase), 'increase'
+        else:
+            new, reason = old, 'hold'
+        self._saturated = False
+        self.limit = new
+        decision = Decision(old, new, reason, p50, p90, error_rate,
+                            throttled)
+        self.history.append(decision)
+        if new != old:
+            logger.debug('Concurrency limit %s' % decision)
@@ -9,7 +9,6 @@ class Neighbourhood(Resource):
     A policing neighbourhood.
     """
     force = None
-    _resource_cache = {}
     _boundary = None
     _crimes = None
     fields = ['contact_details', 'name', 'links', 'description', 'url_force',
@@ -86,21 +85,23 @@ class Neighbourhood(Resource):
         return int(data) if data is not None else None
 
     def _get_resource(self, cls, method):
-        if method in self._resource_cache:
-            return self._resource_cache[method]
-        objs = []
         method = '%s/%s/%s' % (self.force.id, self.id, method)
-        for d in self.api.service.request('GET', method):
-            d.update({
-                'neighbourhood': self,
-            })
-            objs.append(cls(self.api, data=d))
-        self._resource_cache[method] = objs
-        return objs
+
+        def load():
+            objs = []
+            for d in self.api.service.request_reference('GET', method):
+                d = dict(d)
+                d.update({
+                    'neighbourhood': self,
+                })
+                objs.append(cls(self.api, data=d))
+            return objs
+
+        return self._get_cached(method, load)
 
     def _get_boundary(self):
         method = '%s/%s/boundary' % (self.force.id, self.id)
-        points = self.api.service.request('GET', method)
+        points = self.api.service.request_reference('GET', method)
         return [(float(p['latitude']), float(p['longitude'])) for p in points]
 
     def _get_crimes(self):
@@ -121,12 +122,8 @@ class Neighbourhood(Resource):
 
     @property
     def boundary(self):
-        if self._boundary is None:
-            self._boundary = self._get_boundary()
-        return self._boundary
+        return self._memoise('_boundary', self._get_boundary)
 
     @property
     def crimes(self):
-        if self._crimes is None:
-            self._crimes = self._get_crimes()
-        return self._crimes
+        return self._memoise('_crimes', self._get_crimes)
@@ -0,0 +1,203 @@
+import logging
+import sqlite3
+import time
+
+from .exceptions import APIError
+from .pool import concurrent_map
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outcomes (
+    persistent_id TEXT PRIMARY KEY,
+    month TEXT NOT NULL,
+    status TEXT,
+    status_date TEXT,
+    checked REAL,
+    changed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outcomes_checked ON outcomes (checked);
+"""
+
+# Outcome statuses which are still expected to change. Anything else is
+# treated as final, and never refreshed.
+OPEN_STATUSES = frozenset([
+    'Under investigation',
+    'Awaiting court outcome',
+    'Court result unavailable',
+    'Status update unavailable',
+    'Suspect charged',
+    'Suspect charged as part of another case',
+    'Defendant sent to Crown Court',
+    'Court case unable to proceed',
+])
+
+DAY = 24 * 60 * 60
+
+
+class OutcomeTracker(object):
+    """
+    Records the last known outcome status of each crime, keyed by persistent
+    ID, so that only crimes whose outcome can still change are re-fetched.
+
+    A crime is due for a refresh when its status is one of ``open_statuses``
+    (or it has no status yet, unless ``refresh_unknown`` is ``False``) and it
+    hasn't been checked for ``recheck_interval`` seconds. Crimes which
+    have never been checked are refreshed first, followed by those checked
+    longest ago, with more recent crimes first amongst equals.
+
+    A refresh which finds no outcomes keeps the last known status. Crimes the
+    API no longer has (a 404) stop being tracked; other API errors are
+    logged, and the crime is tried again after ``recheck_interval``. A crime
+    whose request fails before the API answers (e.g. a timeout) stays due.
+    """
+
+    def __init__(self, api, path, open_statuses=OPEN_STATUSES,
+                 recheck_interval=30 * DAY, refresh_unknown=True):
+        self.api = api
+        self.path = path
+        self.open_statuses = frozenset(open_statuses)
+        self.refresh_unknown = refresh_unknown
+        self.recheck_interval = recheck_interval
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM outcomes').fetchone()[0]
+
+    def _status(self, crime):
+        status = crime.outcome_status
+        if status is None and crime._outcomes:
+            status = crime._outcomes[-1]
+        if status is None:
+            return None, None
+        return status.category.name, status.date
+
+    def _save(self, persistent_id, month, status, date, checked=None):
+        now = time.time()
+        row = self.db.execute(
+            'SELECT status FROM outcomes WHERE persistent_id = ?',
+            (persistent_id,)).fetchone()
+        if row is None:
+            self.db.execute(
+                'INSERT INTO outcomes (persistent_id, month, status, '
+                'status_date, checked, changed) VALUES (?, ?, ?, ?, ?, ?)',
+                (persistent_id, month, status, date, checked, now))
+            return True
+        if row[0] != status:
+            self.db.execute(
+                'UPDATE outcomes SET status = ?, status_date = ?, '
+                'changed = ? WHERE persistent_id = ?',
+                (status, date, now, persistent_id))
+        if checked is not None:
+            self.db.execute(
+                'UPDATE outcomes SET checked = ? WHERE persistent_id = ?',
+                (checked, persistent_id))
+        return row[0] != status
+
+    def track(self, crimes, fresh=True):
+        """
+        Record the outcome status carried by each crime (e.g. from
+        ``get_crimes_area``), without making any API calls. Crimes without a
+        persistent ID (such as anti-social behaviour) are ignored.
+
+        If ``fresh``, the crimes have just come from the API, so count as
+        checked now; otherwise (e.g. for crimes from a store or snapshot)
+        they are due for a refresh straight away.
+        """
+        checked = time.time() if fresh else None
+        with self.db:
+            for crime in crimes:
+                if not crime.persistent_id:
+                    continue
+                status, date = self._status(crime)
+                self._save(crime.persistent_id, crime.month, status, date,
+                           checked=checked)
+
+    def status(self, persistent_id):
+        """
+        The last known outcome status of a crime, or ``None``.
+        """
+        row = self.db.execute(
+            'SELECT status FROM outcomes WHERE persistent_id = ?',
+            (persistent_id,)).fetchone()
+        return row[0] if row else None
+
+    def is_open(self, status):
+        if status is None:
+            return self.refresh_unknown
+        return status in self.open_statuses
+
+    def due(self, limit=None, now=None):
+        """
+        The persistent IDs of open crimes due for a refresh, highest priority
+        first.
+        """
+        now = time.time() if now is None else now
+        statuses = sorted(self.open_statuses)
+        query = (
+            'SELECT persistent_id FROM outcomes '
+            'WHERE (status IN (%s)%s) AND (checked IS NULL OR checked <= ?) '
+            'ORDER BY checked IS NOT NULL, checked, month DESC' % (
+                ', '.join('?' * len(statuses)),
+                ' OR status IS NULL' if self.refresh_unknown else ''))
+        params = statuses + [now - self.recheck_interval]
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        return [row[0] for row in self.db.execute(query, params)]
+
+    def refresh(self, limit=None, batch_size=100, workers=8):
+        """
+        Re-fetch the outcomes of open crimes which are due, ``batch_size`` at
+        a time using ``workers`` concurrent requests. Returns a ``list`` of
+        ``(persistent_id, old_status, new_status)`` for every crime whose
+        status changed.
+        """
+        due = self.due(limit=limit)
+        changed = []
+        for i in range(0, len(due), batch_size):
+            batch = due[i:i + batch_size]
+            crimes = concurrent_map(self._get_crime, batch, workers)
+            now = time.time()
+            with self.db:
+                for persistent_id, crime in zip(batch, crimes):
+                    old = self.status(persistent_id)
+                    if isinstance(crime, Exception):
+                        self._failed(persistent_id, crime, now)
+                        continue
+                    status, date = self._status(crime)
+                    if status is None:
+                        status = old
+                    if self._save(persistent_id, crime.month, status, date,
+                                  checked=now):
+                        changed.append((persistent_id, old, status))
+            logger.debug('Refreshed %d outcomes, %d changed' %
+                         (len(batch), len(changed)))
+        return changed
+
+    def _get_crime(self, persistent_id):
+        # Failures, including those of the transport, are returned rather
+        # than raised, so that one crime can't sink the rest of its batch.
+        try:
+            return self.api.get_crime(persistent_id)
+        except Exception as e:
+            return e
+
+    def _failed(self, persistent_id, error, now):
+        if not isinstance(error, APIError):
+            logger.warning('Refreshing %s failed, will retry: %s' %
+                           (persistent_id, error))
+        elif error.status_code == 404:
+            logger.warning('%s no longer exists, so is no longer tracked' %
+                           persistent_id)
+            self.db.execute('DELETE FROM outcomes WHERE persistent_id = ?',
+                            (persistent_id,))
+        else:
+            logger.warning('Refreshing %s failed: %s' % (persistent_id, error))
+            self.db.execute(
+                'UPDATE outcomes SET checked = ? WHERE persistent_id = ?',
+                (now, persistent_id))
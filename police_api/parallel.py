@@ -0,0 +1,69 @@
+import json
+import multiprocessing
+
+from .columnar import CrimeColumns
+from .pool import WorkerPool
+
+
+def parse_crimes(payload):
+    """
+    Decode a ``crimes-street`` response body into ``CrimeColumns``. This is
+    a module-level function so that worker processes can import it.
+    """
+    if isinstance(payload, bytes):
+        payload = payload.decode('utf-8')
+    return CrimeColumns.from_json(json.loads(payload))
+
+
+class ParsePool(object):
+    """
+    Decodes large crime responses in a pool of worker processes, so that
+    parsing many of them in parallel isn't bound to one core by the GIL.
+    Results come back as compact ``CrimeColumns``, which can be hydrated into
+    ``Crime`` objects with ``to_crimes(api)`` if needed.
+    """
+
+    def __init__(self, processes=None, threads=8):
+        self.processes = processes or multiprocessing.cpu_count()
+        self.threads = threads
+        self._pool = multiprocessing.Pool(self.processes)
+
+    def parse_crimes(self, payloads, chunksize=1):
+        """
+        Decode many response bodies, returning a ``CrimeColumns`` for each in
+        the same order.
+        """
+        return self._pool.map(parse_crimes, payloads, chunksize)
+
+    def get_crimes_area(self, api, areas, date=None, category=None):
+        """
+        Fetch crimes for many polygons, downloading on a pool of threads and
+        decoding in the worker processes. Yields a ``CrimeColumns`` for each
+        polygon, in the same order as ``areas``.
+        """
+        def fetch(points):
+            method, kwargs = api._crimes_area_request(points, date=date,
+                                                      category=category)
+            body = api.service.request_raw('POST', method, **kwargs)
+            return self._pool.apply_async(parse_crimes, (body,))
+
+        areas = list(areas)
+        if not areas:
+            return
+        threads = WorkerPool(min(self.threads, len(areas)))
+        try:
+            futures = [threads.submit(fetch, points) for points in areas]
+            for future in futures:
+                yield future.result().get()
+        finally:
+            threads.close(cancel=True)
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,332 @@
+import logging
+import math
+
+from .exceptions import APIError
+from .pool import concurrent_map
+from .spatial import (ONE_MILE, METRES_PER_DEGREE, bounding_box,
+                      points_in_polygon, polygon_contains)
+from .store import CrimeStore
+
+logger = logging.getLogger(__name__)
+
+# The API refuses (with a 503) any crimes-street request which would return
+# more than this many crimes.
+OVERFLOW_LIMIT = 10000
+
+# The approximate size of one crime in a crimes-street response.
+BYTES_PER_CRIME = 650
+
+# The density assumed for areas with no statistics, in crimes per square
+# kilometre per month.
+DEFAULT_DENSITY = 50.0
+
+
+def polygon_area(points):
+    """
+    The area of a polygon of ``(lat, lng)`` tuples in square kilometres,
+    using an equirectangular projection about its centre.
+    """
+    if len(points) < 3:
+        return 0.0
+    south, west, north, east = bounding_box(points)
+    scale = math.cos(math.radians((south + north) / 2))
+    xy = [(float(lng) * scale * METRES_PER_DEGREE / 1000,
+           float(lat) * METRES_PER_DEGREE / 1000) for lat, lng in points]
+    area = 0.0
+    for (x1, y1), (x2, y2) in zip(xy, xy[1:] + xy[:1]):
+        area += x1 * y2 - x2 * y1
+    return abs(area) / 2
+
+
+def rectangle(south, west, north, east):
+    return [(south, west), (north, west), (north, east), (south, east)]
+
+
+def split_box(box, rows, columns):
+    south, west, north, east = box
+    height = (north - south) / float(rows)
+    width = (east - west) / float(columns)
+    return [(south + r * height, west + c * width,
+             south + (r + 1) * height, west + (c + 1) * width)
+            for r in range(rows) for c in range(columns)]
+
+
+def get_crimes_box(api, box, date=None, category=None):
+    """
+    Every crime within a ``(south, west, north, east)`` box. Boxes holding
+    more crimes than the API will return are split into quarters until each
+    piece fits.
+    """
+    try:
+        return api.get_crimes_area(rectangle(*box), date=date,
+                                   category=category)
+    except APIError as e:
+        if e.status_code != 503:
+            raise
+    logger.info('Tile %s overflowed, splitting' % (box,))
+    crimes = []
+    for b in split_box(box, 2, 2):
+        crimes.extend(get_crimes_box(api, b, date, category))
+    return crimes
+
+
+def get_crimes_polygon(api, points, date=None, category=None):
+    """
+    Every crime within the polygon ``points``. If it holds more crimes than
+    the API will return, its bounding box is fetched with
+    ``get_crimes_box``, and the crimes outside the polygon dropped.
+    """
+    try:
+        return api.get_crimes_area(points, date=date, category=category)
+    except APIError as e:
+        if e.status_code != 503:
+            raise
+    logger.info('Area overflowed, fetching its bounding box')
+    return crimes_within(
+        get_crimes_box(api, bounding_box(points), date, category), points)
+
+
+def crimes_within(crimes, points):
+    """
+    Those of ``crimes`` which lie within the polygon ``points``.
+    """
+    located = [c for c in crimes if c.location is not None and
+               c.location.latitude is not None]
+    inside = points_in_polygon(
+        [float(c.location.latitude) for c in located],
+        [float(c.location.longitude) for c in located], points)
+    return [c for c, i in zip(located, inside) if i]
+
+
+class DensityStats(object):
+    """
+    Observed crime densities, in crimes per square kilometre per month,
+    bucketed by coarse grid cell so that estimates for nearby areas can
+    share them.
+    """
+
+    def __init__(self, cell_size=0.1, default=DEFAULT_DENSITY):
+        self.cell_size = cell_size
+        self.default = default
+        self._cells = {}
+
+    def _cell(self, points):
+        south, west, north, east = bounding_box(points)
+        return (int(math.floor((south + north) / 2 / self.cell_size)),
+                int(math.floor((west + east) / 2 / self.cell_size)))
+
+    def record(self, points, months, crimes):
+        area = polygon_area(points)
+        if not area or not months:
+            return
+        cell = self._cell(points)
+        total_crimes, total_area = self._cells.get(cell, (0, 0.0))
+        self._cells[cell] = (total_crimes + crimes,
+                             total_area + area * months)
+
+    def density(self, points):
+        crimes, area = self._cells.get(self._cell(points), (0, 0.0))
+        return crimes / area if area else self.default
+
+
+class Plan(object):
+    """
+    One way of answering a query, with its estimated cost.
+    """
+
+    def __init__(self, strategy, calls, bytes, overflow_risk, cost,
+                 units=None, note=''):
+        self.strategy = strategy
+        self.calls = calls
+        self.bytes = bytes
+        self.overflow_risk = overflow_risk
+        self.cost = cost
+        self.units = units or []
+        self.note = note
+
+    def __str__(self):
+        return '<Plan> %s' % self.strategy
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class QueryPlanner(object):
+    """
+    Answers "all crimes in this area over these months" by choosing the
+    cheapest of several strategies:
+
+    - ``store``: crimes already held locally for an area containing this one
+    - ``area``: one crimes-street POST per month
+    - ``tiled``: the bounding box split into tiles small enough not to
+      overflow, each filtered back to the area
+    - ``points``: one-mile crimes-street point queries covering the area
+    - ``location``: crimes-at-location for known location IDs
+
+    Each is costed in upstream calls, bytes and risk of exceeding the API's
+    10,000 crime limit, using the densities seen in earlier queries.
+    """
+
+    def __init__(self, api, store=None, stats=None, workers=8,
+                 byte_weight=1.0 / 100000, tile_target=OVERFLOW_LIMIT / 2):
+        self.api = api
+        self.store = store if store is not None else CrimeStore()
+        self.stats = stats if stats is not None else DensityStats()
+        self.workers = workers
+        self.byte_weight = byte_weight
+        self.tile_target = tile_target
+        self._covered = []
+
+    def _plan(self, strategy, calls, crimes_downloaded, per_call, units,
+              note=''):
+        # The expected number of calls which overflow. A call near the limit
+        # may or may not, depending on how the crimes fall; one well over it
+        # certainly will. Overflowing calls are split into quarters until
+        # the pieces fit, and every level but the last overflows too.
+        risk = min(1.0, per_call / float(OVERFLOW_LIMIT)) ** 8 * calls
+        depth = 1
+        while per_call / 4 ** depth > OVERFLOW_LIMIT:
+            depth += 1
+        retry = sum(4 ** d for d in range(1, depth + 1))
+        cost = (calls + risk * retry +
+                crimes_downloaded * BYTES_PER_CRIME * self.byte_weight)
+        return Plan(strategy, calls, int(crimes_downloaded * BYTES_PER_CRIME),
+                    risk, cost, units, note)
+
+    def _covers(self, points, month):
+        for covered, covered_month in self._covered:
+            if covered_month == month and polygon_contains(covered, points):
+                return True
+        return False
+
+    def plans(self, points, months, location_ids=None):
+        """
+        Every applicable plan for the query, cheapest first.
+        """
+        points = [(float(lat), float(lng)) for lat, lng in points]
+        months = list(months)
+        area = polygon_area(points)
+        per_month = self.stats.density(points) * area
+        expected = per_month * len(months)
+        box = bounding_box(points)
+        plans = []
+
+        if months and all(self._covers(points, m) for m in months):
+            plans.append(Plan('store', 0, 0, 0.0, 0.0,
+                              note='every month is held locally'))
+
+        plans.append(self._plan('area', len(months), expected, per_month,
+                                [points]))
+
+        box_area = polygon_area(rectangle(*box)) or area
+        box_per_month = per_month * (box_area / area if area else 1)
+        side = max(1, int(math.ceil(math.sqrt(
+            box_per_month / self.tile_target))))
+        tiles = [rectangle(*b) for b in split_box(box, side, side)]
+        plans.append(self._plan(
+            'tiled', len(tiles) * len(months), box_per_month * len(months),
+            box_per_month / len(tiles), tiles,
+            '%dx%d tiles' % (side, side)))
+
+        centres = self._point_centres(box)
+        circle = math.pi * (ONE_MILE / 1000) ** 2
+        point_per_month = per_month / area * circle if area else 0
+        plans.append(self._plan(
+            'points', len(centres) * len(months),
+            point_per_month * len(centres) * len(months), point_per_month,
+            centres, '%d one-mile circles' % len(centres)))
+
+        if location_ids:
+            per_location = per_month / len(location_ids)
+            plans.append(self._plan(
+                'location', len(location_ids) * len(months), expected,
+                per_location, list(location_ids)))
+
+        return sorted(plans, key=lambda p: p.cost)
+
+    def _point_centres(self, box):
+        # Hexagonally packed circles leave no gaps when spaced sqrt(3) radii
+        # apart along a row, and 1.5 radii between rows.
+        south, west, north, east = box
+        dlat = ONE_MILE / METRES_PER_DEGREE
+        dlng = dlat / math.cos(math.radians((south + north) / 2))
+        rows = max(1, int(math.ceil((north - south) / (1.5 * dlat))) + 1)
+        columns = max(1, int(math.ceil(
+            (east - west) / (math.sqrt(3) * dlng))) + 1)
+        centres = []
+        for r in range(rows):
+            offset = (r % 2) * math.sqrt(3) * dlng / 2
+            for c in range(columns):
+                centres.append((south + r * 1.5 * dlat,
+                                west + c * math.sqrt(3) * dlng + offset))
+        return centres
+
+    def explain(self, points, months, location_ids=None):
+        """
+        A human-readable comparison of the plans for a query.
+        """
+        lines = []
+        for i, plan in enumerate(self.plans(points, months, location_ids)):
+            lines.append('%s %-8s calls=%-5d bytes=%-10d overflow=%.2f '
+                         'cost=%.2f%s' % (
+                             '*' if i == 0 else ' ', plan.strategy,
+                             plan.calls, plan.bytes, plan.overflow_risk,
+                             plan.cost,
+                             ' (%s)' % plan.note if plan.note else ''))
+        return '\n'.join(lines)
+
+    def _fetch_box(self, box, month, category):
+        return get_crimes_box(self.api, box, date=month, category=category)
+
+    def _fetch(self, strategy, unit, month, category):
+        if strategy == 'area':
+            return get_crimes_polygon(self.api, unit, date=month,
+                                      category=category)
+        if strategy == 'tiled':
+            return self._fetch_box(bounding_box(unit), month, category)
+        if strategy == 'points':
+            return self.api.get_crimes_point(unit[0], unit[1], date=month,
+                                             category=category)
+        if strategy == 'location':
+            return self.api.get_crimes_location(unit, date=month)
+        raise ValueError('Unknown strategy: %s' % strategy)
+
+    def run(self, points, months, category=None, location_ids=None,
+            plan=None):
+        """
+        Fetch every crime within the area for each month, using the cheapest
+        plan (or the one given). Returns a ``dict`` of month to crimes.
+        """
+        points = [(float(lat), float(lng)) for lat, lng in points]
+        months = list(months)
+        if plan is None:
+            plan = self.plans(points, months, location_ids)[0]
+        logger.debug('Running %s plan for %d months' %
+                     (plan.strategy, len(months)))
+        results = dict((m, []) for m in months)
+        if plan.strategy == 'store':
+            candidates = dict(
+                (m, self.store.filter(month=m, category=category))
+                for m in months)
+        else:
+            queries = [(unit, m) for m in months for unit in plan.units]
+            fetched = concurrent_map(
+                lambda q: self._fetch(plan.strategy, q[0], q[1], category),
+                queries, self.workers)
+            candidates = dict((m, []) for m in months)
+            for (unit, month), crimes in zip(queries, fetched):
+                candidates[month].extend(self.store.update(crimes))
+        total = 0
+        for month in months:
+            seen = set()
+            crimes = [c for c in candidates[month]
+                      if c.id not in seen and not seen.add(c.id)]
+            if plan.strategy != 'area':
+                crimes = crimes_within(crimes, points)
+            results[month] = crimes
+            total += len(crimes)
+        if plan.strategy != 'store':
+            if category is None:
+                self._covered.extend((points, m) for m in months)
+                self.stats.record(points, len(months), total)
+        return results
@@ -0,0 +1,151 @@
+import queue
+import sys
+import threading
+
+from .scheduler import current_priority, priority
+
+
+class CancelledError(Exception):
+    """
+    The call was dropped from the pool before it started.
+    """
+
+
+class Future(object):
+    """
+    The eventual result of a call submitted to a ``WorkerPool``.
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def _set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def _set_exception(self, exc_info):
+        self._exc_info = exc_info
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def done(self):
+        return self._done.is_set()
+
+    def exception(self, timeout=None):
+        self._done.wait(timeout)
+        if self._exc_info is not None:
+            return self._exc_info[1]
+
+    def result(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise RuntimeError('Timed out waiting for result')
+        if self._exc_info is not None:
+            raise self._exc_info[1]
+        return self._result
+
+
+class WorkerPool(object):
+    """
+    A bounded pool of daemon threads which run submitted calls. Calls make
+    their requests in the ``priority`` class given, or else that of the
+    thread which submitted them.
+    """
+
+    def __init__(self, workers=8, priority=None):
+        self.workers = workers
+        self.priority = priority
+        self._queue = queue.Queue()
+        self._threads = []
+        self._closed = False
+        for i in range(workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            future, name, func, args, kwargs = item
+            try:
+                with priority(name):
+                    future._set_result(func(*args, **kwargs))
+            except Exception:
+                future._set_exception(sys.exc_info())
+
+    def submit(self, func, *args, **kwargs):
+        if self._closed:
+            raise RuntimeError('Cannot submit to a closed pool')
+        future = Future()
+        self._queue.put((future, self.priority or current_priority(), func,
+                         args, kwargs))
+        return future
+
+    def map(self, func, items):
+        """
+        Call ``func`` on every item concurrently, returning the results in the
+        same order as the items. The first exception raised is re-raised.
+        """
+        futures = [self.submit(func, item) for item in items]
+        return [f.result() for f in futures]
+
+    def close(self, cancel=False):
+        """
+        Stop the pool once the calls already submitted have finished. If
+        ``cancel`` is ``True``, calls which haven't started yet are dropped and
+        their futures fail with ``CancelledError``.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if cancel:
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    raise CancelledError()
+                except CancelledError:
+                    item[0]._set_exception(sys.exc_info())
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def concurrent_map(func, items, workers=8, priority=None):
+    """
+    Call ``func`` on every item using a temporary pool of ``workers`` threads,
+    returning the results in order.
+    """
+    items = list(items)
+    if not items:
+        return []
+    with WorkerPool(min(workers, len(items)), priority) as pool:
+        return pool.map(func, items)
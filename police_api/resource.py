@@ -1,3 +1,6 @@
+import threading
+
+
 class SimpleResource(object):
 
     def __init__(self, api, data={}):
@@ -13,6 +16,33 @@ class SimpleResource(object):
     def __repr__(self):
         return self.__str__()
 
+    def __getstate__(self):
+        # The client isn't picklable (and shouldn't travel with the data), so
+        # it is dropped here and re-attached with ``attach()`` after loading.
+        state = self.__dict__.copy()
+        state.pop('api', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.api = None
+
+    def attach(self, api, _seen=None):
+        """
+        Attach this resource, and any resources it refers to, to ``api``.
+        """
+        seen = set() if _seen is None else _seen
+        if id(self) in seen:
+            return self
+        seen.add(id(self))
+        self.api = api
+        for value in list(self.__dict__.values()):
+            values = value if isinstance(value, list) else [value]
+            for v in values:
+                if isinstance(v, SimpleResource):
+                    v.attach(api, seen)
+        return self
+
 
 class Resource(SimpleResource):
     _requested = False
@@ -20,6 +50,8 @@ class Resource(SimpleResource):
     fields = []
 
     def __init__(self, api, preload=False, **attrs):
+        self._lock = threading.RLock()
+        self._resource_cache = {}
         super(Resource, self).__init__(api)
         for key, val in attrs.items():
             setattr(self, key, val)
@@ -29,17 +61,75 @@ class Resource(SimpleResource):
         if preload:
             self._make_api_request()
 
+    def __getstate__(self):
+        state = super(Resource, self).__getstate__()
+        state.pop('_lock', None)
+        return state
+
+    def __setstate__(self, state):
+        super(Resource, self).__setstate__(state)
+        self._lock = threading.RLock()
+
+    def _update(self, attrs):
+        # Set attributes which aren't known yet, as the constructor would,
+        # leaving any already set or loaded alone.
+        with self._lock:
+            for key, val in attrs.items():
+                if key in self.__dict__:
+                    continue
+                setattr(self, key, val)
+                if key in self.fields:
+                    self.fields = list(self.fields)
+                    self.fields.remove(key)
+
     def __getattr__(self, attr):
         if not self._requested and attr in self.fields:
-            self._make_api_request()
+            self.load()
         return self.__getattribute__(attr)
 
+    def load(self):
+        """
+        Fetch this resource's details, unless they have been already.
+        """
+        if not self._requested:
+            with self._lock:
+                if not self._requested:
+                    self._make_api_request()
+        return self
+
     def _make_api_request(self):
         self._response_data = self.api.service.request(
             'GET', self._get_api_method())
         self._hydrate(self._response_data)
+        # Only mark the resource as requested once every field is in place,
+        # so that readers which skip the lock never see a partial object.
         self._requested = True
 
+    def _get_cached(self, method, load):
+        if self.api.service.reference_cache is not None:
+            # The shared reference cache decides when to refetch, so
+            # memoising here would pin the first response forever.
+            return load()
+        # Double-checked so that reading a cached value never takes a lock.
+        try:
+            return self._resource_cache[method]
+        except KeyError:
+            pass
+        with self._lock:
+            if method not in self._resource_cache:
+                self._resource_cache[method] = load()
+            return self._resource_cache[method]
+
+    def _memoise(self, attr, load):
+        value = getattr(self, attr)
+        if value is None:
+            with self._lock:
+                value = getattr(self, attr)
+                if value is None:
+                    value = load()
+                    setattr(self, attr, value)
+        return value
+
     def _get_api_method(self):
         if self.api_method is None:
             raise RuntimeError('You must set the api_method attribute')
@@ -0,0 +1,171 @@
+"""
+Orders requests from callers of differing urgency. Each request belongs to a
+priority class, set for the calling thread with ``priority()``; the
+``Scheduler`` lets a limited number of requests run at once, and gives the
+next free slot to waiting requests by weighted fair queuing, so an
+interactive call overtakes queued bulk work without the bulk work starving.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+
+WEIGHTS = {
+    INTERACTIVE: 16,
+    BULK: 1,
+}
+
+_local = threading.local()
+
+
+def current_priority():
+    """
+    The priority class of requests made by this thread, or ``None`` for the
+    scheduler's default.
+    """
+    return getattr(_local, 'priority', None)
+
+
+@contextmanager
+def priority(name):
+    """
+    Make requests from this thread, and calls it submits to a
+    ``WorkerPool``, in the priority class ``name``.
+    """
+    previous = current_priority()
+    _local.priority = name
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+def call_with_priority(name, func, *args, **kwargs):
+    with priority(name):
+        return func(*args, **kwargs)
+
+
+class ClassStats(object):
+    """
+    Requests, and the time they spent queued, for one priority class.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.queued = 0
+        self.depth = 0
+        self.max_depth = 0
+        self.wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def mean_wait(self):
+        return self.wait / self.requests if self.requests else 0.0
+
+
+class _Waiter(object):
+
+    def __init__(self, tag):
+        self.tag = tag
+        self.queued = time.time()
+        self.granted = False
+
+
+class Scheduler(object):
+    """
+    Lets up to ``slots`` requests run at once. When they are all taken,
+    requests queue by priority class, and each slot that frees goes to the
+    waiting request with the earliest virtual finish time: a request's is
+    ``1 / weight`` of its class after the later of its class's previous
+    request and the one last started. So while both are queued, classes get
+    slots in proportion to their weights.
+    """
+
+    def __init__(self, slots=8, weights=None, default=INTERACTIVE):
+        self.slots = slots
+        self.weights = dict(weights or WEIGHTS)
+        if default not in self.weights:
+            raise ValueError('Unknown priority class: %s' % default)
+        self.default = default
+        self.active = 0
+        self.stats = dict((name, ClassStats()) for name in self.weights)
+        self._queues = dict((name, deque()) for name in self.weights)
+        self._finish = dict((name, 0.0) for name in self.weights)
+        self._virtual = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self, name=None):
+        """
+        Wait for a slot for a request in class ``name`` (by default, the
+        calling thread's ``current_priority()``). Returns the seconds
+        waited.
+        """
+        name = name or current_priority() or self.default
+        if name not in self.weights:
+            raise ValueError('Unknown priority class: %s' % name)
+        stats = self.stats[name]
+        with self._condition:
+            tag = max(self._virtual, self._finish[name]) + \
+                1.0 / self.weights[name]
+            self._finish[name] = tag
+            stats.requests += 1
+            if self.active < self.slots and not self.depth():
+                self.active += 1
+                self._virtual = tag
+                return 0.0
+            waiter = _Waiter(tag)
+            self._queues[name].append(waiter)
+            stats.queued += 1
+            stats.depth += 1
+            stats.max_depth = max(stats.max_depth, stats.depth)
+            while not waiter.granted:
+                self._condition.wait()
+        waited = time.time() - waiter.queued
+        with self._condition:
+            stats.wait += waited
+            stats.max_wait = max(stats.max_wait, waited)
+        return waited
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._dispatch()
+
+    def _dispatch(self):
+        while self.active < self.slots:
+            queued = [(q[0].tag, name) for name, q in self._queues.items()
+                      if q]
+            if not queued:
+                return
+            tag, name = min(queued)
+            waiter = self._queues[name].popleft()
+            self.stats[name].depth -= 1
+            waiter.granted = True
+            self.active += 1
+            self._virtual = tag
+            self._condition.notify_all()
+
+    def depth(self, name=None):
+        """
+        The number of requests queued in class ``name``, or in total.
+        """
+        if name is not None:
+            return len(self._queues[name])
+        return sum(len(q) for q in self._queues.values())
+
+    def report(self):
+        """
+        A table of requests, queue depths and waits by priority class.
+        """
+        rows = [('class', 'requests', 'queued', 'depth', 'max depth',
+                 'mean wait', 'max wait')]
+        for name in sorted(self.weights, key=lambda n: -self.weights[n]):
+            s = self.stats[name]
+            rows.append((name, str(s.requests), str(s.queued), str(s.depth),
+                         str(s.max_depth), '%.3fs' % s.mean_wait,
+                         '%.3fs' % s.max_wait))
+        return '\n'.join('%-12s %8s %8s %6s %9s %10s %9s' % row
+                         for row in rows)
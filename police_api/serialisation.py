@@ -0,0 +1,271 @@
+"""
+A compact, versioned binary format for crimes, forces and neighbourhoods.
+
+Every document starts with a fixed header, followed by a zlib-compressed
+JSON body::
+
+    magic (4 bytes, 'PAPI') | version (1 byte) | kind (1 byte) | body
+
+Lists of crimes are stored column by column, with repetitive values
+(months, categories, streets, outcome statuses) stored once in a table and
+referenced by index. The client is never stored; resources are attached to
+the ``api`` passed to ``loads``.
+"""
+import json
+import struct
+import zlib
+
+from .crime import Crime, CrimeCategory, Location, NoLocationCrime
+from .forces import Force
+from .neighbourhoods import Neighbourhood
+
+MAGIC = b'PAPI'
+VERSION = 1
+HEADER = struct.Struct('>4sBB')
+
+# Document kinds
+CRIMES = 1
+RESOURCES = 2
+SNAPSHOT = 3
+
+# Added to the kind when the document holds a single object, not a list.
+SINGLE = 0x80
+
+
+class SerialisationError(ValueError):
+    """
+    The data isn't a document in a format this version can read.
+    """
+
+
+class _Table(object):
+
+    def __init__(self):
+        self.values = []
+        self.index = {}
+
+    def code(self, value):
+        key = json.dumps(value, sort_keys=True)
+        if key not in self.index:
+            self.index[key] = len(self.values)
+            self.values.append(value)
+        return self.index[key]
+
+
+def _loaded_attrs(resource):
+    return dict((f, resource.__dict__[f]) for f in type(resource).fields
+                if f in resource.__dict__)
+
+
+def _encode_crimes(crimes):
+    columns = dict((name, []) for name in [
+        'id', 'persistent_id', 'month', 'category', 'context',
+        'location_type', 'location_subtype', 'latitude', 'longitude',
+        'street', 'outcome', 'outcomes'])
+    tables = dict((name, _Table()) for name in [
+        'month', 'category', 'location_type', 'location_subtype', 'street',
+        'outcome'])
+    for crime in crimes:
+        columns['id'].append(crime.id)
+        columns['persistent_id'].append(crime.persistent_id)
+        columns['context'].append(crime.context)
+        columns['month'].append(tables['month'].code(crime.month))
+        category = crime.category
+        columns['category'].append(tables['category'].code(
+            [category.id, category.name] if category else None))
+        columns['location_type'].append(
+            tables['location_type'].code(crime.location_type))
+        columns['location_subtype'].append(
+            tables['location_subtype'].code(crime.location_subtype))
+        location = crime.location
+        if location is not None and location.latitude is not None:
+            columns['latitude'].append(location.latitude)
+            columns['longitude'].append(location.longitude)
+            columns['street'].append(tables['street'].code(
+                [location.id, location.name]))
+        else:
+            columns['latitude'].append(None)
+            columns['longitude'].append(None)
+            columns['street'].append(None)
+        status = crime.outcome_status
+        columns['outcome'].append(tables['outcome'].code(
+            [status.category.name, status.date] if status else None))
+        outcomes = crime._outcomes
+        if outcomes is not None:
+            outcomes = [[o.category.id, o.category.name, o.date]
+                        for o in outcomes]
+        columns['outcomes'].append(outcomes)
+    if not any(o is not None for o in columns['outcomes']):
+        del columns['outcomes']
+    for name, table in tables.items():
+        columns['%s_table' % name] = table.values
+    return columns
+
+
+def _decode_crimes(api, columns):
+    tables = {}
+    for name in ['month', 'location_type', 'location_subtype', 'street',
+                 'outcome']:
+        tables[name] = columns['%s_table' % name]
+    # Categories are shared between crimes, as they are when hydrated from
+    # the API's category tables.
+    categories = [CrimeCategory(api, data={'url': c[0], 'name': c[1]})
+                  if c else None for c in columns['category_table']]
+    outcomes = columns.get('outcomes') or [None] * len(columns['id'])
+    crimes = []
+    for i in range(len(columns['id'])):
+        crime = Crime(api)
+        crime.id = columns['id'][i]
+        crime.persistent_id = columns['persistent_id'][i]
+        crime.context = columns['context'][i]
+        crime.month = tables['month'][columns['month'][i]]
+        crime.category = categories[columns['category'][i]]
+        crime.location_type = tables['location_type'][
+            columns['location_type'][i]]
+        crime.location_subtype = tables['location_subtype'][
+            columns['location_subtype'][i]]
+        street = columns['street'][i]
+        if street is None:
+            crime.location = Location(api, data={})
+        else:
+            street_id, street_name = tables['street'][street]
+            crime.location = Location(api, data={
+                'latitude': columns['latitude'][i],
+                'longitude': columns['longitude'][i],
+                'street': {'id': street_id, 'name': street_name},
+                'type': crime.location_type,
+                'subtype': crime.location_subtype,
+            })
+        status = tables['outcome'][columns['outcome'][i]]
+        crime.outcome_status = None
+        if status is not None:
+            crime.outcome_status = crime.Outcome(api, {
+                'crime': crime, 'category': status[0], 'date': status[1]})
+        if outcomes[i] is not None:
+            crime._outcomes = [
+                crime.Outcome(api, {'crime': crime, 'date': date,
+                                    'category': {'code': code, 'name': name}})
+                for code, name, date in outcomes[i]]
+        crimes.append(crime)
+    return crimes
+
+
+def _encode_resource(obj):
+    if isinstance(obj, Force):
+        return ['force', {
+            'id': obj.id,
+            'attrs': _loaded_attrs(obj),
+            'requested': obj._requested,
+        }]
+    if isinstance(obj, Neighbourhood):
+        return ['neighbourhood', {
+            'id': obj.id,
+            'force': _encode_resource(obj.force)[1],
+            'attrs': _loaded_attrs(obj),
+            'requested': obj._requested,
+            'boundary': obj._boundary,
+        }]
+    if isinstance(obj, Crime):
+        return ['crime', _encode_crimes([obj])]
+    if isinstance(obj, NoLocationCrime):
+        return ['no_location_crime', _loaded_attrs(obj)]
+    raise TypeError('Cannot serialise %r' % obj)
+
+
+def _decode_force(api, state):
+    force = Force(api, id=state['id'], **state['attrs'])
+    force._requested = state['requested']
+    return force
+
+
+def _decode_resource(api, tag, state):
+    if tag == 'force':
+        return _decode_force(api, state)
+    if tag == 'neighbourhood':
+        neighbourhood = Neighbourhood(
+            api, force=_decode_force(api, state['force']), id=state['id'],
+            **state['attrs'])
+        neighbourhood._requested = state['requested']
+        if state['boundary'] is not None:
+            neighbourhood._boundary = [tuple(p) for p in state['boundary']]
+        return neighbourhood
+    if tag == 'crime':
+        return _decode_crimes(api, state)[0]
+    if tag == 'no_location_crime':
+        crime = NoLocationCrime(api)
+        crime.__dict__.update(state)
+        return crime
+    raise SerialisationError('Unknown resource type: %s' % tag)
+
+
+def pack(kind, body):
+    """
+    Write a document of the given kind, with a JSON-serialisable body.
+    """
+    payload = json.dumps(body, separators=(',', ':')).encode('utf-8')
+    return HEADER.pack(MAGIC, VERSION, kind) + zlib.compress(payload)
+
+
+def unpack(data):
+    """
+    Read the ``(kind, body)`` of a document written by ``pack``.
+    """
+    try:
+        magic, version, kind = HEADER.unpack_from(data)
+    except struct.error:
+        raise SerialisationError('Truncated document')
+    if magic != MAGIC:
+        raise SerialisationError('Not a police_api document')
+    if version > VERSION:
+        raise SerialisationError('Unsupported format version: %d' % version)
+    try:
+        body = zlib.decompress(data[HEADER.size:])
+    except zlib.error:
+        raise SerialisationError('Truncated or corrupt document')
+    try:
+        return kind, json.loads(body.decode('utf-8'))
+    except ValueError:
+        raise SerialisationError('Corrupt document')
+
+
+def dumps(obj):
+    """
+    Serialise a ``Crime``, ``NoLocationCrime``, ``Force`` or
+    ``Neighbourhood``, or a list of them. Forces and neighbourhoods keep the
+    details which have been loaded, and neighbourhoods keep their boundary.
+    """
+    single = not isinstance(obj, (list, tuple))
+    objs = [obj] if single else list(obj)
+    if objs and all(type(o) is Crime for o in objs):
+        kind, body = CRIMES, _encode_crimes(objs)
+    else:
+        kind, body = RESOURCES, [_encode_resource(o) for o in objs]
+    if single:
+        kind |= SINGLE
+    return pack(kind, body)
+
+
+def loads(data, api):
+    """
+    Load a document written by ``dumps``, attaching every resource to
+    ``api``.
+    """
+    kind, body = unpack(data)
+    single = kind & SINGLE
+    kind &= ~SINGLE
+    if kind == CRIMES:
+        objs = _decode_crimes(api, body)
+    elif kind == RESOURCES:
+        objs = [_decode_resource(api, tag, state) for tag, state in body]
+    else:
+        raise SerialisationError('Unknown document kind: %d' % kind)
+    return objs[0] if single else objs
+
+
+def attach(objs, api):
+    """
+    Attach resources loaded some other way (e.g. unpickled) to ``api``.
+    """
+    for obj in objs if isinstance(objs, list) else [objs]:
+        obj.attach(api)
+    return objs
@@ -1,12 +1,139 @@
 import logging
+import functools
 import requests
+import sys
+import threading
+import time
+import weakref
 
+from .areacache import AreaCache
+from .cache import LRUCache, RefreshingCache
 from .exceptions import APIError
+from .limiter import AdaptiveLimiter
+from .scheduler import Scheduler, call_with_priority, current_priority
+from .shared import SharedState, request_key
+from .transport import accept_encoding, get_transport
 from .version import __version__
 
 logger = logging.getLogger(__name__)
 
 
+class SingleFlight(object):
+    """
+    Collapses concurrent calls with the same key into one. The first caller
+    runs the function, and any callers which arrive while it is running wait
+    for and share its result (or exception).
+    """
+
+    class Call(object):
+
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.exc_info = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.shared = 0
+
+    def joined(self):
+        """
+        Count a caller which shared a call coalesced elsewhere.
+        """
+        with self._lock:
+            self.shared += 1
+
+    def do(self, key, func, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self.Call()
+            else:
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.exc_info is not None:
+                raise call.exc_info[1]
+            return call.result
+        try:
+            call.result = func(*args)
+        except Exception:
+            call.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+# Top-level API calls, as opposed to those under a force or neighbourhood.
+API_METHODS = set([
+    'crime-categories', 'crime-last-updated', 'crimes-at-location',
+    'crimes-no-location', 'crimes-street', 'crimes-street-dates',
+    'locate-neighbourhood', 'outcomes-at-location', 'outcomes-for-crime',
+    'stops-at-location', 'stops-force', 'stops-no-location', 'stops-street',
+])
+
+
+def endpoint(method):
+    """
+    The name of the API call a method path is for, without any IDs, e.g.
+    ``boundary`` for ``leicestershire/NC04/boundary``.
+    """
+    parts = method.split('/')
+    if parts[0] in API_METHODS:
+        return parts[0]
+    if parts[0] == 'forces':
+        return '/'.join(['forces'] + parts[2:])
+    if len(parts) == 2:
+        return 'neighbourhoods' if parts[1] == 'neighbourhoods' else \
+            'neighbourhood'
+    return parts[-1]
+
+
+class TransferStats(object):
+    """
+    Requests made and bytes received, both as sent over the wire and once
+    decompressed, per API call.
+    """
+
+    def __init__(self):
+        self.endpoints = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, wire_bytes, decoded_bytes):
+        with self._lock:
+            counts = self.endpoints.setdefault(endpoint, [0, 0, 0])
+            counts[0] += 1
+            counts[1] += wire_bytes
+            counts[2] += decoded_bytes
+
+    def totals(self):
+        """
+        ``(requests, wire_bytes, decoded_bytes)`` over every API call.
+        """
+        with self._lock:
+            return tuple(sum(c[i] for c in self.endpoints.values())
+                         for i in range(3))
+
+    def report(self):
+        """
+        A table of requests and bytes per API call, with the compression
+        ratio.
+        """
+        rows = [('call', 'requests', 'wire', 'decoded', 'ratio')]
+        with self._lock:
+            items = sorted(self.endpoints.items())
+        for name, (calls, wire, decoded) in items + [
+                ('total', self.totals())]:
+            rows.append((name, str(calls), str(wire), str(decoded),
+                         '%.1fx' % (float(decoded) / wire) if wire else '-'))
+        return '\n'.join('%-24s %8s %12s %12s %7s' % row for row in rows)
+
+
 class BaseService(object):
 
     def __init__(self, api, **config):
@@ -14,8 +141,46 @@ class BaseService(object):
         self.config = {
             'base_url': 'http://data.police.uk/api/',
             'user_agent': 'police-api-client-python/%s' % __version__,
+            'single_flight': True,
+            'transport': None,
+            'compression': True,
+            'reference_ttl': None,
+            'reference_max_stale': 24 * 60 * 60,
+            'month_cache_size': 256,
+            'mutable_months': 1,
+            'adaptive_concurrency': False,
+            'shared': None,
+            'scheduler': None,
+            'area_cache': None,
         }
         self.config.update(config)
+        self.transport = get_transport(self.config['transport'])
+        self.transfer = TransferStats()
+        self.limiter = self.config['adaptive_concurrency']
+        if self.limiter is True:
+            self.limiter = AdaptiveLimiter()
+        elif not self.limiter:
+            self.limiter = None
+        self.shared = self.config['shared']
+        if self.shared is not None and not isinstance(self.shared,
+                                                      SharedState):
+            self.shared = SharedState(self.shared)
+        self.scheduler = self.config['scheduler']
+        if self.scheduler is True:
+            self.scheduler = Scheduler()
+        self.area_cache = self.config['area_cache']
+        if self.area_cache is True:
+            self.area_cache = AreaCache()
+        self.single_flight = SingleFlight()
+        self.reference_cache = None
+        self.month_cache = LRUCache(self.config['month_cache_size'])
+        self._reference_seeds = {}
+        if self.config['reference_ttl'] is not None:
+            self.reference_cache = RefreshingCache(
+                self.config['reference_ttl'],
+                self.config['reference_max_stale'])
+        self._async_calls = weakref.WeakKeyDictionary()
+        self._async_lock = threading.Lock()
 
     def raise_for_status(self, request):
         try:
@@ -23,25 +188,155 @@ class BaseService(object):
         except requests.models.HTTPError as e:
             raise APIError(e)
 
-    def _make_request(self, verb, url, params={}):
-        request_kwargs = {
-            'headers': {
-                'User-Agent': self.config['user_agent'],
-            },
-            'timeout': self.config.get('timeout', 30),
+    def _send(self, verb, url, params):
+        if self.shared is None:
+            return self._schedule(verb, url, params)
+        return self.shared.fetch(request_key(verb, url, params),
+                                 lambda: self._schedule(verb, url, params))
+
+    def _schedule(self, verb, url, params):
+        if self.scheduler is None:
+            return self._transmit(verb, url, params)
+        self.scheduler.acquire()
+        try:
+            return self._transmit(verb, url, params)
+        finally:
+            self.scheduler.release()
+
+    def _transmit(self, verb, url, params):
+        headers = {
+            'User-Agent': self.config['user_agent'],
+            'Accept-Encoding': accept_encoding()
+            if self.config['compression'] else 'identity',
         }
+        auth = None
         if 'username' in self.config:
-            request_kwargs['auth'] = (self.config.get('username', ''),
-                                      self.config.get('password', ''))
-        if verb == 'GET':
-            request_kwargs['params'] = params
-        else:
-            request_kwargs['data'] = params
+            auth = (self.config.get('username', ''),
+                    self.config.get('password', ''))
         logger.debug('%s %s' % (verb, url))
-        r = requests.request(verb, url, **request_kwargs)
+        if self.limiter is None:
+            r = self.transport.send(verb, url, params, headers,
+                                    timeout=self.config.get('timeout', 30),
+                                    auth=auth)
+        else:
+            r = self._send_limited(verb, url, params, headers, auth)
+        self.transfer.record(
+            endpoint(url[len(self.config['base_url']):]), r.wire_bytes,
+            len(r.content))
+        return r
+
+    def _send_limited(self, verb, url, params, headers, auth):
+        self.limiter.acquire()
+        start = time.time()
+        status = None
+        try:
+            r = self.transport.send(verb, url, params, headers,
+                                    timeout=self.config.get('timeout', 30),
+                                    auth=auth)
+            status = r.status_code
+            return r
+        finally:
+            self.limiter.release(time.time() - start, status)
+
+    def _fetch(self, verb, url, params):
+        # Identical requests in flight at the same time share one response.
+        # Each caller decodes its own copy of the body, since callers go on
+        # to mutate the decoded data while hydrating resources.
+        if not self.config['single_flight']:
+            return self._send(verb, url, params)
+        key = (verb, url, tuple(sorted(params.items())))
+        return self.single_flight.do(key, self._send, verb, url, params)
+
+    def _decode(self, r):
         self.raise_for_status(r)
         return r.json()
 
+    def _make_request(self, verb, url, params={}):
+        return self._decode(self._fetch(verb, url, params))
+
     def request(self, verb, method, **kwargs):
         url = self.config['base_url'] + method
         return self._make_request(verb.upper(), url, kwargs)
+
+    def request_reference(self, verb, method, **kwargs):
+        """
+        Make a request for slowly-changing reference data (forces,
+        neighbourhoods, officers, ...), served stale-while-revalidate from
+        ``reference_cache`` if ``reference_ttl`` is configured. Callers must
+        not mutate the response, since it may be shared.
+        """
+        key = (verb.upper(), method, tuple(sorted(kwargs.items())))
+        if self.reference_cache is None:
+            if key in self._reference_seeds:
+                return self._reference_seeds[key]
+            return self.request(verb, method, **kwargs)
+        return self.reference_cache.get(
+            key, lambda: self.request(verb, method, **kwargs))
+
+    def seed_reference(self, verb, method, response, fetched=None, **kwargs):
+        """
+        Provide the response to a reference data request in advance (e.g.
+        from a snapshot). Without ``reference_ttl`` it is served until the
+        client is discarded; with it, it ages from ``fetched`` like any
+        other cached response.
+        """
+        key = (verb.upper(), method, tuple(sorted(kwargs.items())))
+        if self.reference_cache is None:
+            self._reference_seeds[key] = response
+        else:
+            self.reference_cache.set(key, response, fetched)
+
+    def request_raw(self, verb, method, **kwargs):
+        """
+        Make a request and return the undecoded response body, for callers
+        which decode it elsewhere (e.g. in another process).
+        """
+        url = self.config['base_url'] + method
+        r = self._fetch(verb.upper(), url, kwargs)
+        self.raise_for_status(r)
+        return r.content
+
+    def request_async(self, verb, method, **kwargs):
+        """
+        Make a request from within a running asyncio event loop, returning an
+        awaitable future of the decoded response. Identical requests made on
+        the same loop while one is in flight share the upstream call, which
+        runs on the loop's default executor (and so also coalesces with
+        threaded callers).
+        """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        verb = verb.upper()
+        url = self.config['base_url'] + method
+        key = (verb, url, tuple(sorted(kwargs.items())))
+        with self._async_lock:
+            calls = self._async_calls.setdefault(loop, {})
+        # Executor threads make the request in the caller's priority class.
+        send = functools.partial(call_with_priority, current_priority())
+        if not self.config['single_flight']:
+            shared = loop.run_in_executor(None, send, self._send, verb, url,
+                                          kwargs)
+        elif key in calls:
+            shared = calls[key]
+            self.single_flight.joined()
+        else:
+            shared = calls[key] = loop.run_in_executor(
+                None, send, self._fetch, verb, url, kwargs)
+            shared.add_done_callback(lambda f: calls.pop(key, None))
+        result = loop.create_future()
+
+        def decode(f):
+            if result.cancelled():
+                return
+            if f.cancelled():
+                result.cancel()
+            elif f.exception() is not None:
+                result.set_exception(f.exception())
+            else:
+                try:
+                    result.set_result(self._decode(f.result()))
+                except Exception as e:
+                    result.set_exception(e)
+
+        shared.add_done_callback(decode)
+        return result
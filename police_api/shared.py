@@ -0,0 +1,208 @@
+"""
+State shared by every ``PoliceAPI`` on one machine, so that several worker
+processes keep to one request budget between them and fetch each response
+only once. It lives in an SQLite database, whose file locks serialise the
+processes' updates.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from .transport import Response
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bucket (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    status INTEGER NOT NULL,
+    url TEXT,
+    content BLOB NOT NULL,
+    fetched REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS claims (
+    key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+"""
+
+
+class SharedState(object):
+    """
+    A token bucket, refilled at ``rate`` requests per second up to
+    ``burst``, and a cache of successful responses kept for ``ttl`` seconds,
+    stored at ``path`` and shared with every other ``SharedState`` using the
+    same file.
+
+    While one process is fetching a response, others wanting the same one
+    wait for it to reach the cache rather than fetching it too. A claim on
+    a fetch lapses after ``lease`` seconds, in case its process has died.
+    """
+
+    def __init__(self, path, rate=15, burst=None, ttl=60 * 60, lease=60,
+                 poll=0.02):
+        self.path = os.path.abspath(path)
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.ttl = ttl
+        self.lease = lease
+        self.poll = poll
+        self.hits = 0
+        self.misses = 0
+        self.waited = 0.0
+        self._local = threading.local()
+        self._connection().executescript(SCHEMA)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def _connection(self):
+        # SQLite connections can't be shared between threads, or survive a
+        # fork, so each thread of each process opens its own.
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def _transaction(self):
+        return _Transaction(self._connection())
+
+    def take(self):
+        """
+        Take a token from the bucket, waiting until one is available.
+        Returns the number of seconds waited.
+        """
+        waited = 0.0
+        while True:
+            with self._transaction() as db:
+                now = time.time()
+                row = db.execute(
+                    'SELECT tokens, updated FROM bucket').fetchone()
+                if row is None:
+                    tokens = self.burst
+                else:
+                    tokens = min(self.burst,
+                                 row[0] + (now - row[1]) * self.rate)
+                if tokens >= 1:
+                    tokens -= 1
+                    wait = 0
+                else:
+                    wait = (1 - tokens) / self.rate
+                db.execute('INSERT OR REPLACE INTO bucket VALUES (0, ?, ?)',
+                           (tokens, now))
+            if not wait:
+                self.waited += waited
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    def get(self, key):
+        """
+        The cached ``Response`` for ``key``, or ``None``.
+        """
+        row = self._connection().execute(
+            'SELECT status, url, content FROM responses '
+            'WHERE key = ? AND fetched > ?',
+            (key, time.time() - self.ttl)).fetchone()
+        if row is None:
+            return None
+        return Response(row[0], bytes(row[2]), url=row[1], wire_bytes=0)
+
+    def set(self, key, response):
+        with self._transaction() as db:
+            db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                (key, response.status_code, response.url,
+                 sqlite3.Binary(response.content), time.time()))
+
+    def _claim(self, key):
+        owner = '%d.%d' % (os.getpid(), threading.current_thread().ident)
+        with self._transaction() as db:
+            now = time.time()
+            db.execute('DELETE FROM claims WHERE expires < ?', (now,))
+            db.execute('INSERT OR IGNORE INTO claims VALUES (?, ?, ?)',
+                       (key, owner, now + self.lease))
+            row = db.execute('SELECT owner FROM claims WHERE key = ?',
+                             (key,)).fetchone()
+        return row[0] == owner
+
+    def _unclaim(self, key):
+        with self._transaction() as db:
+            db.execute('DELETE FROM claims WHERE key = ?', (key,))
+
+    def fetch(self, key, load):
+        """
+        The cached response for ``key``, or one from ``load()``, called
+        once a token is available. Successful responses are cached.
+        """
+        while True:
+            response = self.get(key)
+            if response is not None:
+                self.hits += 1
+                return response
+            if self._claim(key):
+                break
+            time.sleep(self.poll)
+        try:
+            # The claim may have been released just after our lookup.
+            response = self.get(key)
+            if response is not None:
+                self.hits += 1
+                return response
+            self.misses += 1
+            self.take()
+            response = load()
+            if response.status_code == 200:
+                self.set(key, response)
+            return response
+        finally:
+            self._unclaim(key)
+
+    def purge(self):
+        """
+        Delete expired responses.
+        """
+        with self._transaction() as db:
+            db.execute('DELETE FROM responses WHERE fetched <= ?',
+                       (time.time() - self.ttl,))
+
+    def clear(self):
+        """
+        Delete every cached response.
+        """
+        with self._transaction() as db:
+            db.execute('DELETE FROM responses')
+
+
+def request_key(verb, url, params):
+    return json.dumps([verb, url, sorted(
+        (k, v) for k, v in params.items() if v is not None)])
+
+
+class _Transaction(object):
+    # Takes SQLite's write lock up front, so that read-modify-write updates
+    # from several processes can't interleave.
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.db.execute('ROLLBACK' if exc_type else 'COMMIT')
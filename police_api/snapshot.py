@@ -0,0 +1,156 @@
+"""
+Reference data snapshots, for starting a client without downloading forces,
+neighbourhood lists, boundaries and crime categories again.
+
+A snapshot is a ``SNAPSHOT`` document in the format described in
+``police_api.serialisation``, and records the months the API had data for
+when it was taken, so that it can be checked against the API later.
+"""
+import io
+import logging
+import time
+
+from .pool import concurrent_map
+from .scheduler import BULK
+from .serialisation import SNAPSHOT, SerialisationError, pack, unpack
+
+logger = logging.getLogger(__name__)
+
+# Incremented when the snapshot body changes incompatibly.
+SNAPSHOT_VERSION = 1
+
+
+class StaleSnapshotError(Exception):
+    """
+    The API has published data for months after the snapshot was taken.
+    """
+
+
+class Snapshot(object):
+    """
+    A copy of the API's reference data: forces, neighbourhood lists,
+    neighbourhood boundaries and the crime categories for each month.
+    """
+
+    def __init__(self, dates, forces, neighbourhoods, boundaries, categories,
+                 created=None):
+        self.dates = dates
+        self.forces = forces
+        self.neighbourhoods = neighbourhoods
+        self.boundaries = boundaries
+        self.categories = categories
+        self.created = created if created is not None else time.time()
+
+    def __str__(self):
+        return '<Snapshot> %s (%d forces, %d neighbourhoods)' % (
+            self.dates[0] if self.dates else 'empty', len(self.forces),
+            sum(len(n) for n in self.neighbourhoods.values()))
+
+    def __repr__(self):
+        return self.__str__()
+
+    @classmethod
+    def create(cls, api, forces=None, months=None, boundaries=True,
+               workers=8):
+        """
+        Download reference data for every force (or those in ``forces``),
+        with crime categories for every month the API has (or those in
+        ``months``) and the latest.
+        """
+        request = api.service.request
+        dates = api.get_dates()
+        force_list = request('GET', 'forces')
+        if forces is not None:
+            force_list = [f for f in force_list if f['id'] in forces]
+        force_ids = [f['id'] for f in force_list]
+        neighbourhoods = dict(zip(force_ids, concurrent_map(
+            lambda f: request('GET', '%s/neighbourhoods' % f), force_ids,
+            workers, BULK)))
+
+        shapes = {}
+        if boundaries:
+            keys = ['%s/%s' % (f, n['id']) for f in force_ids
+                    for n in neighbourhoods[f]]
+            for key, points in zip(keys, concurrent_map(
+                    lambda k: request('GET', '%s/boundary' % k), keys,
+                    workers, BULK)):
+                shapes[key] = [[float(p['latitude']), float(p['longitude'])]
+                               for p in points]
+
+        months = [None] + list(dates if months is None else months)
+        categories = dict(zip(
+            [m or '' for m in months], concurrent_map(
+                lambda m: request('GET', 'crime-categories', date=m),
+                months, workers, BULK)))
+        return cls(dates, force_list, neighbourhoods, shapes, categories)
+
+    def dumps(self):
+        return pack(SNAPSHOT, {
+            'version': SNAPSHOT_VERSION,
+            'created': self.created,
+            'dates': self.dates,
+            'forces': self.forces,
+            'neighbourhoods': self.neighbourhoods,
+            'boundaries': self.boundaries,
+            'categories': self.categories,
+        })
+
+    @classmethod
+    def loads(cls, data):
+        kind, body = unpack(data)
+        if kind != SNAPSHOT:
+            raise SerialisationError('Not a snapshot')
+        if body['version'] > SNAPSHOT_VERSION:
+            raise SerialisationError('Unsupported snapshot version: %d' %
+                                     body['version'])
+        return cls(body['dates'], body['forces'], body['neighbourhoods'],
+                   body['boundaries'], body['categories'], body['created'])
+
+    def save(self, path):
+        with io.open(path, 'wb') as f:
+            f.write(self.dumps())
+
+    @classmethod
+    def load(cls, path):
+        with io.open(path, 'rb') as f:
+            return cls.loads(f.read())
+
+    def new_months(self, api):
+        """
+        Months the API has data for which the snapshot doesn't know about.
+        """
+        return [d for d in api.get_dates() if d not in self.dates]
+
+    def check(self, api):
+        """
+        Raise ``StaleSnapshotError`` if the API has moved on since the
+        snapshot was taken.
+        """
+        new = self.new_months(api)
+        if new:
+            raise StaleSnapshotError(
+                'Snapshot of %s is missing %s' % (
+                    self.dates[0] if self.dates else 'nothing',
+                    ', '.join(sorted(new))))
+
+    def apply(self, api, latest=True):
+        """
+        Fill ``api``'s reference data from the snapshot. If ``latest`` is
+        ``False``, the categories for the latest month (requested without a
+        date) are left to be fetched, as they are when the snapshot is stale.
+        """
+        service = api.service
+        service.seed_reference('GET', 'forces', self.forces,
+                               fetched=self.created)
+        for force, neighbourhoods in self.neighbourhoods.items():
+            service.seed_reference('GET', '%s/neighbourhoods' % force,
+                                   neighbourhoods, fetched=self.created)
+        for key, points in self.boundaries.items():
+            service.seed_reference(
+                'GET', '%s/boundary' % key,
+                [{'latitude': lat, 'longitude': lng} for lat, lng in points],
+                fetched=self.created)
+        for month, categories in self.categories.items():
+            if month or latest:
+                api._set_crime_categories(month or None, categories)
+        return api
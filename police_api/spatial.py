@@ -0,0 +1,318 @@
+import heapq
+import math
+from array import array
+
+from .crime import CrimeCategory
+
+# Mean radius of the earth, in metres.
+EARTH_RADIUS = 6371008.8
+
+# The radius used by the crime-street API call for point queries.
+ONE_MILE = 1609.344
+
+# The length of one degree of latitude, in metres.
+METRES_PER_DEGREE = EARTH_RADIUS * math.pi / 180
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """
+    The great-circle distance between two points, in metres.
+    """
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def haversine_many(lat, lng, lats, lngs):
+    """
+    The great-circle distances between one point and the points described by
+    the parallel sequences ``lats`` and ``lngs``, in metres.
+    """
+    radians = math.radians
+    sin = math.sin
+    cos = math.cos
+    asin = math.asin
+    sqrt = math.sqrt
+    lat0 = radians(lat)
+    lng0 = radians(lng)
+    cos_lat0 = cos(lat0)
+    diameter = 2 * EARTH_RADIUS
+    distances = array('d')
+    append = distances.append
+    for lat1, lng1 in zip(lats, lngs):
+        lat1 = radians(lat1)
+        a = (sin((lat1 - lat0) / 2) ** 2 +
+             cos_lat0 * cos(lat1) * sin((radians(lng1) - lng0) / 2) ** 2)
+        append(diameter * asin(min(1.0, sqrt(a))))
+    return distances
+
+
+def point_in_polygon(lat, lng, points):
+    """
+    Whether a point falls inside a polygon given as a list of ``(lat, lng)``
+    tuples, using the even-odd rule.
+    """
+    return points_in_polygon([lat], [lng], points)[0]
+
+
+def points_in_polygon(lats, lngs, points):
+    """
+    Test many points against one polygon at once. The polygon's edges are
+    walked once, with each edge tested against every point, so the cost of
+    unpacking the polygon is shared across the whole batch.
+    """
+    inside = [False] * len(lats)
+    points = [(float(y), float(x)) for y, x in points]
+    if len(points) < 3:
+        return inside
+    south, west, north, east = bounding_box(points)
+    candidates = [i for i, (y, x) in enumerate(zip(lats, lngs))
+                  if south <= y <= north and west <= x <= east]
+    if not candidates:
+        return inside
+    edges = zip(points, points[-1:] + points[:-1])
+    for (y1, x1), (y2, x2) in edges:
+        if y1 == y2:
+            continue
+        slope = (x2 - x1) / float(y2 - y1)
+        low, high = min(y1, y2), max(y1, y2)
+        for i in candidates:
+            y = lats[i]
+            if low <= y < high and lngs[i] < x1 + (y - y1) * slope:
+                inside[i] = not inside[i]
+    return inside
+
+
+def _turn(a, b, c):
+    return (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+
+
+def _edges_near(points, box):
+    south, west, north, east = box
+    return [(a, b) for a, b in zip(points, points[1:] + points[:1])
+            if min(a[0], b[0]) <= north and max(a[0], b[0]) >= south and
+            min(a[1], b[1]) <= east and max(a[1], b[1]) >= west]
+
+
+def edges_cross(a, b):
+    """
+    Whether an edge of polygon ``a`` crosses an edge of polygon ``b``.
+    Edges which only touch, or run along each other, don't count.
+    """
+    for p1, p2 in _edges_near(a, bounding_box(b)):
+        for q1, q2 in _edges_near(b, bounding_box(a)):
+            d1 = _turn(q1, q2, p1)
+            d2 = _turn(q1, q2, p2)
+            d3 = _turn(p1, p2, q1)
+            d4 = _turn(p1, p2, q2)
+            if d1 * d2 < 0 and d3 * d4 < 0:
+                return True
+    return False
+
+
+def _on_boundary(point, points, tolerance=1e-12):
+    for a, b in _edges_near(points, (point[0], point[1], point[0], point[1])):
+        if abs(_turn(a, b, point)) <= tolerance:
+            return True
+    return False
+
+
+def polygon_contains(outer, inner):
+    """
+    Whether polygon ``inner`` lies entirely within polygon ``outer``, both
+    lists of ``(lat, lng)`` tuples. ``inner`` may touch ``outer``'s edges,
+    as tiles cut from it do.
+    """
+    outer = [(float(y), float(x)) for y, x in outer]
+    inner = [(float(y), float(x)) for y, x in inner]
+    inside = points_in_polygon([p[0] for p in inner], [p[1] for p in inner],
+                               outer)
+    if not all(i or _on_boundary(p, outer) for p, i in zip(inner, inside)):
+        return False
+    return not edges_cross(outer, inner)
+
+
+def polygons_intersect(a, b):
+    """
+    Whether polygons ``a`` and ``b`` overlap at all.
+    """
+    a = [(float(y), float(x)) for y, x in a]
+    b = [(float(y), float(x)) for y, x in b]
+    return (any(points_in_polygon([p[0] for p in a], [p[1] for p in a], b))
+            or any(points_in_polygon([p[0] for p in b], [p[1] for p in b],
+                                     a))
+            or edges_cross(a, b))
+
+
+def bounding_box(points):
+    """
+    The ``(south, west, north, east)`` bounds of a list of ``(lat, lng)``
+    tuples.
+    """
+    lats = [float(p[0]) for p in points]
+    lngs = [float(p[1]) for p in points]
+    return min(lats), min(lngs), max(lats), max(lngs)
+
+
+def crime_coordinates(crime):
+    """
+    The ``(lat, lng)`` of a crime as floats, or ``None`` if it has no location.
+    """
+    location = getattr(crime, 'location', None)
+    if location is None or location.latitude is None:
+        return None
+    return float(location.latitude), float(location.longitude)
+
+
+class SpatialIndex(object):
+    """
+    An in-memory uniform grid over crime locations, which can answer radius,
+    bounding box and nearest-neighbour queries without calling the API.
+    """
+
+    def __init__(self, crimes=(), cell_size=0.01):
+        self.cell_size = float(cell_size)
+        self._lats = array('d')
+        self._lngs = array('d')
+        self._crimes = []
+        self._cells = {}
+        self._extent = None
+        self.extend(crimes)
+
+    def __len__(self):
+        return len(self._crimes)
+
+    def __iter__(self):
+        return iter(self._crimes)
+
+    def _cell(self, lat, lng):
+        return (int(math.floor(lat / self.cell_size)),
+                int(math.floor(lng / self.cell_size)))
+
+    def add(self, crime):
+        coords = crime_coordinates(crime)
+        if coords is None:
+            return False
+        lat, lng = coords
+        index = len(self._crimes)
+        self._lats.append(lat)
+        self._lngs.append(lng)
+        self._crimes.append(crime)
+        cell = self._cell(lat, lng)
+        if cell not in self._cells:
+            self._cells[cell] = array('l')
+        self._cells[cell].append(index)
+        if self._extent is None:
+            self._extent = cell + cell
+        else:
+            i1, j1, i2, j2 = self._extent
+            self._extent = (min(i1, cell[0]), min(j1, cell[1]),
+                            max(i2, cell[0]), max(j2, cell[1]))
+        return True
+
+    def extend(self, crimes):
+        for crime in crimes:
+            self.add(crime)
+
+    def _candidates(self, south, west, north, east):
+        (i1, j1), (i2, j2) = self._cell(south, west), self._cell(north, east)
+        indices = []
+        if (i2 - i1 + 1) * (j2 - j1 + 1) > len(self._cells):
+            for (i, j), cell in self._cells.items():
+                if i1 <= i <= i2 and j1 <= j <= j2:
+                    indices.extend(cell)
+        else:
+            for i in range(i1, i2 + 1):
+                for j in range(j1, j2 + 1):
+                    indices.extend(self._cells.get((i, j), ()))
+        return sorted(indices)
+
+    def _filter(self, indices, date=None, category=None):
+        if isinstance(category, CrimeCategory):
+            category = category.id
+        for i in indices:
+            crime = self._crimes[i]
+            if date is not None and crime.month != date:
+                continue
+            if category is not None and crime.category.id != category:
+                continue
+            yield i
+
+    def within_bbox(self, south, west, north, east, date=None,
+                    category=None):
+        """
+        All crimes whose location falls within the given bounds.
+        """
+        lats = self._lats
+        lngs = self._lngs
+        indices = [i for i in self._candidates(south, west, north, east)
+                   if south <= lats[i] <= north and west <= lngs[i] <= east]
+        return [self._crimes[i]
+                for i in self._filter(indices, date, category)]
+
+    def within_radius(self, lat, lng, radius=ONE_MILE, date=None,
+                      category=None):
+        """
+        All crimes whose location is within ``radius`` metres of a point.
+        """
+        lat = float(lat)
+        lng = float(lng)
+        dlat = radius / METRES_PER_DEGREE
+        dlng = dlat / max(
+            math.cos(math.radians(min(abs(lat) + dlat, 90.0))), 1e-12)
+        indices = self._candidates(lat - dlat, lng - dlng,
+                                   lat + dlat, lng + dlng)
+        distances = haversine_many(lat, lng,
+                                   [self._lats[i] for i in indices],
+                                   [self._lngs[i] for i in indices])
+        indices = [i for i, d in zip(indices, distances) if d <= radius]
+        return [self._crimes[i]
+                for i in self._filter(indices, date, category)]
+
+    def nearest(self, lat, lng, k=1, date=None, category=None):
+        """
+        The ``k`` crimes closest to a point, as a list of ``(distance,
+        crime)`` tuples ordered by distance in metres.
+        """
+        if not self._crimes or k < 1:
+            return []
+        lat = float(lat)
+        lng = float(lng)
+        ci, cj = self._cell(lat, lng)
+        i1, j1, i2, j2 = self._extent
+        extent = max(ci - i1, i2 - ci, cj - j1, j2 - cj)
+        best = []
+        ring = 0
+        while ring <= extent:
+            # Cells in this ring are at least ``ring - 1`` whole cells away,
+            # measured across the narrowest cell the ring can contain.
+            widest_lat = min(abs(lat) + ring * self.cell_size, 90.0)
+            cell_metres = self.cell_size * METRES_PER_DEGREE * min(
+                1.0, math.cos(math.radians(widest_lat)))
+            if len(best) == k and -best[0][0] < (ring - 1) * cell_metres:
+                break
+            indices = []
+            for i in range(ci - ring, ci + ring + 1):
+                for j in range(cj - ring, cj + ring + 1):
+                    if max(abs(i - ci), abs(j - cj)) == ring:
+                        indices.extend(self._cells.get((i, j), ()))
+            indices = list(self._filter(sorted(indices), date, category))
+            distances = haversine_many(lat, lng,
+                                       [self._lats[i] for i in indices],
+                                       [self._lngs[i] for i in indices])
+            for i, d in zip(indices, distances):
+                if len(best) < k:
+                    heapq.heappush(best, (-d, -i))
+                elif d < -best[0][0]:
+                    heapq.heapreplace(best, (-d, -i))
+            ring += 1
+        return [(-d, self._crimes[-i]) for d, i in sorted(best, reverse=True)]
+
+    def get_crimes_point(self, lat, lng, date=None, category=None):
+        """
+        Crimes within one mile of a point, mirroring
+        ``PoliceAPI.get_crimes_point`` over the crimes held in the index.
+        """
+        return self.within_radius(lat, lng, ONE_MILE, date=date,
+                                  category=category)
@@ -0,0 +1,133 @@
+import threading
+
+from .crime import CrimeCategory
+
+
+class CrimeStore(object):
+    """
+    Holds each unique crime once, however many overlapping queries return
+    it. Crimes are keyed by ``id`` (``persistent_id`` is not unique, since
+    anti-social behaviour has none), with secondary indexes on
+    ``persistent_id``, month, category and location.
+    """
+
+    def __init__(self, crimes=()):
+        self._crimes = {}
+        self._by_persistent_id = {}
+        self._by_month = {}
+        self._by_category = {}
+        self._by_location = {}
+        self._locations = {}
+        self._lock = threading.Lock()
+        self.merged = 0
+        self.update(crimes)
+
+    def __len__(self):
+        return len(self._crimes)
+
+    def __iter__(self):
+        return iter(list(self._crimes.values()))
+
+    def __contains__(self, crime):
+        return getattr(crime, 'id', crime) in self._crimes
+
+    def _index(self, index, key, id):
+        if not key:
+            return
+        ids = index.get(key)
+        if ids is None:
+            ids = index[key] = set()
+        ids.add(id)
+
+    def _keys(self, crime):
+        return [
+            (self._by_persistent_id, getattr(crime, 'persistent_id', None)),
+            (self._by_month, crime.month),
+            (self._by_category,
+             getattr(getattr(crime, 'category', None), 'id', None)),
+            (self._by_location,
+             getattr(getattr(crime, 'location', None), 'id', None)),
+        ]
+
+    def add(self, crime):
+        """
+        Add a crime, returning the stored instance. If an equal crime (by
+        ``id``) is already stored, that instance is returned instead, so
+        callers can drop their duplicate.
+        """
+        existing = self._crimes.get(crime.id)
+        if existing is not None:
+            self.merged += 1
+            return existing
+        with self._lock:
+            existing = self._crimes.get(crime.id)
+            if existing is not None:
+                self.merged += 1
+                return existing
+            self._crimes[crime.id] = crime
+            location = getattr(crime, 'location', None)
+            if location is not None and location.id is not None:
+                # Many crimes are snapped to the same location, so share one
+                # Location object between them.
+                crime.location = self._locations.setdefault(location.id,
+                                                            location)
+            for index, key in self._keys(crime):
+                self._index(index, key, crime.id)
+        return crime
+
+    def update(self, crimes):
+        """
+        Merge the results of any query, returning the stored instance of
+        each crime in the same order.
+        """
+        return [self.add(c) for c in crimes]
+
+    def get(self, id, default=None):
+        return self._crimes.get(id, default)
+
+    def get_by_persistent_id(self, persistent_id):
+        ids = self._by_persistent_id.get(persistent_id, ())
+        return [self._crimes[i] for i in sorted(ids)]
+
+    def filter(self, month=None, category=None, location=None):
+        """
+        Stored crimes matching every given criterion, intersecting the
+        secondary indexes smallest first. ``category`` may be an ID or a
+        ``CrimeCategory``, and ``location`` a location ID or ``Location``.
+        """
+        if isinstance(category, CrimeCategory):
+            category = category.id
+        location = getattr(location, 'id', location)
+        sets = [index.get(key, set()) for index, key in [
+            (self._by_month, month), (self._by_category, category),
+            (self._by_location, location)] if key is not None]
+        if not sets:
+            ids = self._crimes.keys()
+        else:
+            sets.sort(key=len)
+            ids = sets[0].intersection(*sets[1:])
+        return [self._crimes[i] for i in sorted(ids)]
+
+    def months(self):
+        return sorted(self._by_month)
+
+    def categories(self):
+        return sorted(self._by_category)
+
+    def discard(self, crime):
+        """
+        Remove a crime (or crime ID) from the store and its indexes.
+        """
+        id = getattr(crime, 'id', crime)
+        with self._lock:
+            crime = self._crimes.pop(id, None)
+            if crime is None:
+                return
+            for index, key in self._keys(crime):
+                ids = index.get(key)
+                if ids is not None:
+                    ids.discard(id)
+                    if not ids:
+                        del index[key]
+                        if index is self._by_location:
+                            del self._locations[key]
@@ -0,0 +1,112 @@
+import logging
+import queue
+import sqlite3
+import time
+
+from .pool import WorkerPool
+from .scheduler import BULK
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS manifest (
+    area TEXT NOT NULL,
+    month TEXT NOT NULL,
+    crimes INTEGER NOT NULL,
+    synced REAL NOT NULL,
+    PRIMARY KEY (area, month)
+);
+"""
+
+
+class MonthlySync(object):
+    """
+    Keeps a set of tracked areas up to date, month by month. A manifest of
+    the ``(area, month)`` pairs already ingested is kept in a SQLite
+    database, so each sync only fetches months which have been published
+    since the last one.
+
+    ``areas`` is a ``dict`` mapping an area's ID to either a ``(lat, lng)``
+    tuple (fetched with ``get_crimes_point``) or a list of ``(lat, lng)``
+    tuples describing a polygon (fetched with ``get_crimes_area``).
+    """
+
+    def __init__(self, api, path, areas, workers=8, since=None):
+        self.api = api
+        self.path = path
+        self.areas = areas
+        self.workers = workers
+        self.since = since
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def _fetch(self, area, month):
+        shape = self.areas[area]
+        if len(shape) == 2 and not isinstance(shape[0], (list, tuple)):
+            return self.api.get_crimes_point(shape[0], shape[1], date=month)
+        return self.api.get_crimes_area(shape, date=month)
+
+    def ingested(self):
+        """
+        The set of ``(area, month)`` pairs already in the manifest.
+        """
+        return set(self.db.execute('SELECT area, month FROM manifest'))
+
+    def missing(self, months=None):
+        """
+        The ``(area, month)`` pairs which are published upstream (or in
+        ``months``, if given) but not yet in the manifest, oldest first.
+        """
+        if months is None:
+            months = self.api.get_dates()
+        if self.since is not None:
+            months = [m for m in months if m >= self.since]
+        ingested = self.ingested()
+        return [(area, month)
+                for month in sorted(months)
+                for area in sorted(self.areas)
+                if (area, month) not in ingested]
+
+    def _record(self, area, month, crimes):
+        with self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO manifest '
+                '(area, month, crimes, synced) VALUES (?, ?, ?, ?)',
+                (area, month, len(crimes), time.time()))
+
+    def sync(self, months=None):
+        """
+        Fetch every missing ``(area, month)`` pair concurrently, yielding
+        ``(area, month, crimes)`` tuples as they arrive. A pair is recorded
+        in the manifest when the consumer asks for the next one, so
+        abandoning the generator part way through leaves the remainder
+        (including the last pair yielded) for the next sync. Pairs which
+        fail to fetch are logged and skipped, to be retried by the next
+        sync.
+        """
+        missing = self.missing(months)
+        if not missing:
+            return
+        logger.info('Syncing %d area-months' % len(missing))
+        completions = queue.Queue()
+        pool = WorkerPool(min(self.workers, len(missing)), BULK)
+        try:
+            for area, month in missing:
+                future = pool.submit(self._fetch, area, month)
+                future.add_done_callback(
+                    lambda f, a=area, m=month: completions.put((a, m, f)))
+            for i in range(len(missing)):
+                area, month, future = completions.get()
+                try:
+                    crimes = future.result()
+                except Exception as e:
+                    logger.warning('Syncing %s for %s failed: %s' %
+                                   (area, month, e))
+                    continue
+                yield area, month, crimes
+                self._record(area, month, crimes)
+        finally:
+            pool.close(cancel=True)
@@ -0,0 +1,512 @@
+"""
+A local stand-in for the police API, for testing pooling, rate limiting,
+retries and concurrent fan-out without touching the real service.
+
+``StandInAPI`` answers requests from a generated ``SyntheticDataset``, and
+can be made slow, rate limited or unreliable. It runs in memory, or over
+HTTP as a ``StandInServer``::
+
+    with StandInServer(SyntheticDataset(), latency=0.05, rate_limit=15) as s:
+        api = s.client()
+        api.get_crimes_area(api.get_neighbourhood('force-0', 'n0').boundary)
+"""
+import collections
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+from .spatial import ONE_MILE, haversine, point_in_polygon
+from .utils import decode_polygon, month_range
+
+# The most crimes the API returns from crimes-street before refusing with a
+# 503.
+OVERFLOW_LIMIT = 10000
+
+CATEGORIES = [
+    ('anti-social-behaviour', 'Anti-social behaviour'),
+    ('bicycle-theft', 'Bicycle theft'),
+    ('burglary', 'Burglary'),
+    ('criminal-damage-arson', 'Criminal damage and arson'),
+    ('drugs', 'Drugs'),
+    ('other-theft', 'Other theft'),
+    ('shoplifting', 'Shoplifting'),
+    ('vehicle-crime', 'Vehicle crime'),
+    ('violent-crime', 'Violence and sexual offences'),
+]
+
+OUTCOMES = [
+    ('under-investigation', 'Under investigation'),
+    ('no-further-action', 'Investigation complete; no suspect identified'),
+    ('local-resolution', 'Local resolution'),
+    ('offender-fined', 'Offender fined'),
+]
+
+
+class SyntheticDataset(object):
+    """
+    A reproducible, generated set of forces, neighbourhoods and crimes.
+
+    Forces sit side by side from ``origin``, each a column of rectangular
+    neighbourhoods of ``cell`` degrees. Every neighbourhood has
+    ``crimes_per_month`` crimes per month, snapped to a handful of street
+    locations, with anti-social behaviour having no outcomes.
+    """
+
+    def __init__(self, forces=2, neighbourhoods=3, months=('2014-01',
+                 '2014-03'), crimes_per_month=50, streets=10,
+                 no_location=2, origin=(52.6, -1.3), cell=0.02, seed=0):
+        rng = random.Random(seed)
+        self.months = month_range(*months)
+        self.categories = CATEGORIES
+        self.forces = []
+        self.force_details = {}
+        self.senior_officers = {}
+        self.neighbourhoods = {}
+        self.neighbourhood_details = {}
+        self.boundaries = {}
+        self.people = {}
+        self.events = {}
+        self.priorities = {}
+        self.crimes = dict((m, []) for m in self.months)
+        self.no_location = dict((m, {}) for m in self.months)
+        self.outcomes = {}
+        self._cells = {}
+
+        next_id = [1]
+        for f in range(forces):
+            force_id = 'force-%d' % f
+            name = 'Force %d' % f
+            self.forces.append({'id': force_id, 'name': name})
+            self.force_details[force_id] = {
+                'id': force_id, 'name': name,
+                'description': '<p>The %s police force.</p>' % name,
+                'telephone': '101', 'url': 'http://example.com/%s' % force_id,
+                'engagement_methods': [],
+            }
+            self.senior_officers[force_id] = [
+                {'name': 'Chief %d' % f, 'rank': 'Chief Constable',
+                 'bio': None, 'contact_details': {}}]
+            self.neighbourhoods[force_id] = []
+            for n in range(neighbourhoods):
+                self._add_neighbourhood(rng, force_id, 'n%d' % n, origin,
+                                        cell, f, n, crimes_per_month,
+                                        streets, next_id)
+            for month in self.months:
+                self.no_location[month][force_id] = [
+                    self._crime(rng, next_id, month, None)
+                    for i in range(no_location)]
+
+    def _add_neighbourhood(self, rng, force_id, id, origin, cell, column, row,
+                           crimes_per_month, streets, next_id):
+        south = origin[0] + row * cell
+        west = origin[1] + column * cell
+        north, east = south + cell, west + cell
+        key = (force_id, id)
+        self.neighbourhoods[force_id].append(
+            {'id': id, 'name': 'Neighbourhood %s' % id.upper()})
+        self.neighbourhood_details[key] = {
+            'id': id, 'name': 'Neighbourhood %s' % id.upper(),
+            'description': None, 'population': str(rng.randint(1000, 20000)),
+            'centre': {'latitude': '%.6f' % (south + cell / 2),
+                       'longitude': '%.6f' % (west + cell / 2)},
+            'contact_details': {}, 'links': [], 'locations': [],
+            'url_force': 'http://example.com/%s/%s' % key,
+        }
+        self.boundaries[key] = [(south, west), (north, west), (north, east),
+                                (south, east)]
+        self._cells[key] = (south, west, north, east)
+        self.people[key] = [{'name': 'Officer %s' % id, 'rank': 'PC',
+                             'bio': None, 'contact_details': {}}]
+        self.events[key] = [{
+            'title': 'Beat meeting', 'type': 'meeting', 'description': None,
+            'address': 'Community Centre', 'contact_details': {},
+            'start_date': '%s-01T19:00:00' % self.months[-1]}]
+        self.priorities[key] = [{
+            'issue': 'Anti-social behaviour', 'action': None,
+            'issue-date': '%s-01T00:00:00' % self.months[0],
+            'action-date': None}]
+        locations = []
+        for i in range(streets):
+            locations.append((
+                rng.uniform(south, north), rng.uniform(west, east),
+                {'id': int('%d%02d%02d' % (len(self._cells), row, i)),
+                 'name': 'On or near Street %s-%d' % (id, i)}))
+        for month in self.months:
+            for i in range(crimes_per_month):
+                self.crimes[month].append(
+                    self._crime(rng, next_id, month, rng.choice(locations)))
+
+    def _crime(self, rng, next_id, month, location):
+        id = next_id[0]
+        next_id[0] += 1
+        category = rng.choice(self.categories)[0]
+        outcomes = []
+        if category != 'anti-social-behaviour':
+            code, name = rng.choice(OUTCOMES)
+            outcomes.append({'category': {'code': code, 'name': name},
+                             'date': month, 'person_id': None})
+        crime = {
+            'id': id,
+            'persistent_id': '%064x' % rng.getrandbits(256)
+            if outcomes else '',
+            'month': month,
+            'category': category,
+            'context': '',
+            'location_type': 'Force' if location else None,
+            'location_subtype': '',
+            'outcome_status': {'category': outcomes[-1]['category']['name'],
+                               'date': month} if outcomes else None,
+        }
+        if location is not None:
+            lat, lng, street = location
+            crime['location'] = {'latitude': '%.6f' % lat,
+                                 'longitude': '%.6f' % lng,
+                                 'street': street}
+        else:
+            crime['location'] = None
+        if outcomes:
+            self.outcomes[crime['persistent_id']] = (crime, outcomes)
+        return crime
+
+    def latest_month(self):
+        return self.months[-1]
+
+    def _filter(self, month, category, match):
+        if month not in self.crimes:
+            return None
+        return [c for c in self.crimes[month]
+                if category in (None, 'all-crime', c['category']) and
+                match(float(c['location']['latitude']),
+                      float(c['location']['longitude']))]
+
+    def crimes_in_polygon(self, points, month, category=None):
+        return self._filter(month, category,
+                            lambda lat, lng: point_in_polygon(lat, lng,
+                                                              points))
+
+    def crimes_near(self, lat, lng, month, category=None):
+        return self._filter(month, category, lambda a, b: haversine(
+            lat, lng, a, b) <= ONE_MILE)
+
+    def crimes_at_location(self, location_id, month):
+        return [c for c in self.crimes.get(month, [])
+                if c['location']['street']['id'] == location_id]
+
+    def locate(self, lat, lng):
+        for (force, id), (south, west, north, east) in self._cells.items():
+            if south <= lat < north and west <= lng < east:
+                return {'force': force, 'neighbourhood': id}
+        return None
+
+
+class StandInAPI(object):
+    """
+    The API calls ``PoliceAPI`` makes, answered in-process from a
+    ``SyntheticDataset``. ``routes`` maps further paths (without ``/api/``)
+    to fixed JSON responses, and take precedence. Use it directly with a
+    ``MemoryTransport`` (see ``client()``), or over HTTP as a
+    ``StandInServer``.
+
+    :param float latency: Seconds to wait before answering each request.
+    :param float rate_limit: Requests allowed per second (with bursts of
+                             ``burst``), beyond which requests get a 429.
+    :param float error_rate: The probability of answering any request with
+                             a 500.
+    :param bool compress: Whether to compress responses when the client
+                          accepts gzip or brotli.
+
+    Requests are counted by path in ``hits``, and ``log`` records each
+    ``(verb, path, status)``.
+    """
+    base_url = 'http://stand-in.invalid/api/'
+
+    def __init__(self, dataset=None, routes=None, latency=0.0,
+                 rate_limit=None, burst=None, error_rate=0.0,
+                 overflow_limit=OVERFLOW_LIMIT, compress=True, seed=0):
+        self.dataset = dataset
+        self.routes = routes or {}
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.burst = burst or rate_limit
+        self.error_rate = error_rate
+        self.overflow_limit = overflow_limit
+        self.compress = compress
+        self.hits = collections.Counter()
+        self.log = []
+        self._faults = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._last_refill = time.time()
+
+    def client(self, **config):
+        """
+        A ``PoliceAPI`` which talks to this stand-in in memory.
+        """
+        from . import PoliceAPI
+        from .transport import MemoryTransport
+        config.setdefault('transport', MemoryTransport(self))
+        return PoliceAPI(base_url=self.base_url, **config)
+
+    def fail(self, status, count=1, path=None, retry_after=None):
+        """
+        Answer the next ``count`` requests (for paths starting with
+        ``path``, if given) with ``status``.
+        """
+        with self._lock:
+            self._faults.append([status, count, path, retry_after])
+
+    def _fault(self, path):
+        with self._lock:
+            for fault in self._faults:
+                status, count, prefix, retry_after = fault
+                if prefix is None or path.startswith(prefix):
+                    fault[1] -= 1
+                    if fault[1] <= 0:
+                        self._faults.remove(fault)
+                    return status, retry_after
+            if self.rate_limit is not None:
+                now = time.time()
+                self._tokens = min(self.burst, self._tokens + (
+                    now - self._last_refill) * self.rate_limit)
+                self._last_refill = now
+                if self._tokens < 1:
+                    return 429, 1
+                self._tokens -= 1
+            if self.error_rate and self._random.random() < self.error_rate:
+                return 500, None
+        return None, None
+
+    def _encode(self, data, accept_encoding):
+        accepted = [e.split(';')[0].strip()
+                    for e in (accept_encoding or '').split(',')]
+        if not self.compress or not data:
+            return None, data
+        if 'br' in accepted:
+            try:
+                import brotli
+                return 'br', brotli.compress(data)
+            except ImportError:
+                pass
+        if 'gzip' in accepted:
+            compressor = zlib.compressobj(6, zlib.DEFLATED,
+                                          16 + zlib.MAX_WBITS)
+            return 'gzip', compressor.compress(data) + compressor.flush()
+        return None, data
+
+    def handle(self, verb, path, params, headers=None):
+        """
+        Answer a request, returning ``(status, headers, body)``.
+        """
+        path = path[len('/api/'):] if path.startswith('/api/') else path
+        self.hits[path] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        status, retry_after = self._fault(path)
+        body = None
+        if status is None:
+            if path in self.routes:
+                status, body = 200, self.routes[path]
+            elif self.dataset is not None:
+                status, body = self._dispatch(verb, path, params)
+            else:
+                status = 404
+        with self._lock:
+            self.log.append((verb, path, status))
+        response_headers = {}
+        data = b''
+        if status == 200:
+            response_headers['Content-Type'] = 'application/json'
+            encoding, data = self._encode(
+                json.dumps(body).encode('utf-8'),
+                dict((k.lower(), v) for k, v in (headers or {}).items()).get(
+                    'accept-encoding'))
+            if encoding:
+                response_headers['Content-Encoding'] = encoding
+        if retry_after is not None:
+            response_headers['Retry-After'] = str(retry_after)
+        return status, response_headers, data
+
+    def _dispatch(self, verb, path, params):
+        for pattern, name in self.ENDPOINTS:
+            match = re.match(pattern + '$', path)
+            if match:
+                return getattr(self, '_' + name)(params, *match.groups())
+        return 404, None
+
+    ENDPOINTS = [
+        (r'forces', 'forces'),
+        (r'forces/([\w-]+)', 'force'),
+        (r'forces/([\w-]+)/people', 'senior_officers'),
+        (r'crime-categories', 'crime_categories'),
+        (r'crimes-street-dates', 'dates'),
+        (r'crime-last-updated', 'last_updated'),
+        (r'crimes-street/([\w-]+)', 'crimes_street'),
+        (r'crimes-at-location', 'crimes_at_location'),
+        (r'crimes-no-location', 'crimes_no_location'),
+        (r'outcomes-for-crime/(\w+)', 'outcomes'),
+        (r'locate-neighbourhood', 'locate'),
+        (r'([\w-]+)/neighbourhoods', 'neighbourhoods'),
+        (r'([\w-]+)/([\w-]+)', 'neighbourhood'),
+        (r'([\w-]+)/([\w-]+)/(boundary|people|events|priorities)',
+         'neighbourhood_resource'),
+    ]
+
+    def _month(self, params):
+        return params.get('date') or self.dataset.latest_month()
+
+    def _forces(self, params):
+        return 200, self.dataset.forces
+
+    def _force(self, params, id):
+        details = self.dataset.force_details.get(id)
+        return (200, details) if details else (404, None)
+
+    def _senior_officers(self, params, id):
+        if id not in self.dataset.force_details:
+            return 404, None
+        return 200, self.dataset.senior_officers[id]
+
+    def _crime_categories(self, params):
+        return 200, [{'url': 'all-crime', 'name': 'All crime'}] + [
+            {'url': url, 'name': name} for url, name in
+            self.dataset.categories]
+
+    def _dates(self, params):
+        return 200, [{'date': m, 'stop-and-search': []}
+                     for m in reversed(self.dataset.months)]
+
+    def _last_updated(self, params):
+        return 200, {'date': '%s-01' % self.dataset.latest_month()}
+
+    def _crimes_street(self, params, category):
+        month = self._month(params)
+        if 'poly' in params:
+            crimes = self.dataset.crimes_in_polygon(
+                decode_polygon(params['poly']), month, category)
+        elif 'lat' in params and 'lng' in params:
+            crimes = self.dataset.crimes_near(
+                float(params['lat']), float(params['lng']), month, category)
+        else:
+            return 400, None
+        if crimes is None:
+            return 404, None
+        if len(crimes) > self.overflow_limit:
+            return 503, None
+        return 200, crimes
+
+    def _crimes_at_location(self, params):
+        try:
+            location_id = int(params['location_id'])
+        except (KeyError, ValueError):
+            return 400, None
+        return 200, self.dataset.crimes_at_location(location_id,
+                                                    self._month(params))
+
+    def _crimes_no_location(self, params):
+        month = self.dataset.no_location.get(self._month(params))
+        if month is None or params.get('force') not in month:
+            return 404, None
+        category = params.get('category', 'all-crime')
+        return 200, [c for c in month[params['force']]
+                     if category in ('all-crime', c['category'])]
+
+    def _outcomes(self, params, persistent_id):
+        if persistent_id not in self.dataset.outcomes:
+            return 404, None
+        crime, outcomes = self.dataset.outcomes[persistent_id]
+        return 200, {'crime': crime, 'outcomes': outcomes}
+
+    def _locate(self, params):
+        try:
+            lat, lng = [float(c) for c in params['q'].split(',')]
+        except (KeyError, ValueError):
+            return 400, None
+        result = self.dataset.locate(lat, lng)
+        return (200, result) if result else (404, None)
+
+    def _neighbourhoods(self, params, force):
+        if force not in self.dataset.neighbourhoods:
+            return 404, None
+        return 200, self.dataset.neighbourhoods[force]
+
+    def _neighbourhood(self, params, force, id):
+        details = self.dataset.neighbourhood_details.get((force, id))
+        return (200, details) if details else (404, None)
+
+    def _neighbourhood_resource(self, params, force, id, resource):
+        key = (force, id)
+        if key not in self.dataset.boundaries:
+            return 404, None
+        if resource == 'boundary':
+            return 200, [{'latitude': '%.6f' % lat, 'longitude': '%.6f' % lng}
+                         for lat, lng in self.dataset.boundaries[key]]
+        return 200, getattr(self.dataset, resource)[key]
+
+
+class StandInServer(StandInAPI):
+    """
+    A ``StandInAPI`` served over HTTP on a random local port, for testing
+    the real transports.
+    """
+
+    def __init__(self, dataset=None, **kwargs):
+        super(StandInServer, self).__init__(dataset, **kwargs)
+        app = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                path, _, query = self.path.partition('?')
+                self.respond('GET', path, dict(parse_qsl(query)))
+
+            def do_POST(self):
+                path, _, query = self.path.partition('?')
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length).decode('utf-8')
+                params = dict(parse_qsl(query))
+                params.update(parse_qsl(body))
+                self.respond('POST', path, params)
+
+            def respond(self, verb, path, params):
+                status, headers, body = app.handle(verb, path, params,
+                                                   self.headers)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.base_url = 'http://127.0.0.1:%d/api/' % self.httpd.server_port
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def client(self, **config):
+        """
+        A ``PoliceAPI`` which talks to this server over HTTP.
+        """
+        from . import PoliceAPI
+        return PoliceAPI(base_url=self.base_url, **config)
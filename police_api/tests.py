@@ -1,21 +1,110 @@
+import asyncio
+import csv
 import datetime
+import gc
+import io
 import json
+import multiprocessing
+import os
+import pickle
+import requests
 import responses
-from unittest import TestCase
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from unittest import TestCase, skipUnless
 
 from . import PoliceAPI
-from .exceptions import NeighbourhoodsNeighbourhoodException
+from .aggregate import CountTable
+from .areacache import AreaCache
+from .binning import BNGGrid, HeatMap, HexGrid, LatLngGrid, to_bng
+from .columnar import CrimeColumns
+from .cli import main
+from .crawler import Crawler
+from .crime import Crime
+from .exceptions import APIError, NeighbourhoodsNeighbourhoodException
+from .limiter import AdaptiveLimiter
+from .export import export, iter_crimes
+from .outcomes import OutcomeTracker
+from .parallel import ParsePool
+from .planner import DensityStats, QueryPlanner, polygon_area, rectangle
+from .pool import concurrent_map
+from .scheduler import BULK, INTERACTIVE, Scheduler, priority
+from .serialisation import SerialisationError, dumps, loads
+from .shared import SharedState
+from .snapshot import Snapshot, StaleSnapshotError
+from .spatial import (SpatialIndex, bounding_box, haversine,
+                      points_in_polygon, polygon_contains,
+                      polygons_intersect)
+from .store import CrimeStore
+from .sync import MonthlySync
+from .testing import StandInAPI, StandInServer, SyntheticDataset
+from .transport import HTTP2Transport, MemoryTransport
+from .utils import decode_polygon
+
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+CATEGORIES = [
+    {'url': 'all-crime', 'name': 'All crime and ASB'},
+    {'url': 'anti-social-behaviour', 'name': 'Anti-social behaviour'},
+    {'url': 'burglary', 'name': 'Burglary'},
+]
+
+
+def crime_data(id, lat, lng, month='2013-10', category='burglary',
+               street_id=None, outcome='Under investigation'):
+    return {
+        'id': id,
+        'persistent_id': 'crime-%s' % id,
+        'month': month,
+        'category': category,
+        'context': '',
+        'location_type': 'Force',
+        'location_subtype': '',
+        'location': {
+            'latitude': str(lat),
+            'longitude': str(lng),
+            'street': {
+                'id': street_id if street_id is not None else id,
+                'name': 'On or near Test Street',
+            },
+        },
+        'outcome_status': {
+            'category': outcome,
+            'date': month,
+        } if outcome else None,
+    }
 
 
 class PoliceAPITestCase(TestCase):
     api = PoliceAPI()
 
     def run(self, *args, **kwargs):
+        # Tests share one client, but not the resources it has loaded.
+        self.api.identity.clear()
+
         @responses.activate
         def wrapped():
             return super(PoliceAPITestCase, self).run(*args, **kwargs)
         return wrapped()
 
+    def add_crime_categories(self):
+        responses.add(responses.GET,
+                      'http://data.police.uk/api/crime-categories',
+                      body=json.dumps(CATEGORIES),
+                      content_type='application/json')
+
 
 class TestForces(PoliceAPITestCase):
 
@@ -144,6 +233,37 @@ class TestNeighbourhood(PoliceAPITestCase):
         self.assertEqual(neighbourhoods[0].id, 'test-neighbourhood')
         self.assertEqual(neighbourhoods[0].name, 'Test Neighbourhood')
 
+    def test_preload(self):
+        responses.add(responses.GET,
+                      'http://data.police.uk/api/test-force/neighbourhoods',
+                      body=json.dumps([{'id': 'n%d' % i, 'name': 'N%d' % i}
+                                       for i in range(3)]),
+                      content_type='application/json')
+        for i in range(3):
+            responses.add(
+                responses.GET, 'http://data.police.uk/api/test-force/n%d' % i,
+                body=json.dumps({'population': str(i * 1000)}),
+                content_type='application/json')
+            responses.add(
+                responses.GET,
+                'http://data.police.uk/api/test-force/n%d/people' % i,
+                body=json.dumps([{'name': 'Officer %d' % i}]),
+                content_type='application/json')
+        neighbourhoods = self.api.get_neighbourhoods('test-force')
+
+        # Names came with the list, so only the sub-resources are fetched.
+        self.api.preload(neighbourhoods, fields=['name'],
+                         include=['officers', 'senior_officers'])
+        self.assertEqual(len(responses.calls), 4)
+        self.assertFalse(neighbourhoods[0]._requested)
+
+        self.api.preload(neighbourhoods, fields=['population'])
+        self.assertEqual(len(responses.calls), 7)
+        self.assertEqual([n.population for n in neighbourhoods],
+                         [0, 1000, 2000])
+        self.assertEqual(neighbourhoods[2].officers[0].name, 'Officer 2')
+        self.assertEqual(len(responses.calls), 7)
+
     def test_neighbourhood_population(self):
         attributes = {
             'population': '27000',
@@ -332,6 +452,63 @@ class TestNeighbourhood(PoliceAPITestCase):
         )
 
 
+class TestIdentityMap(TestCase):
+
+    def setUp(self):
+        self.app = StandInAPI(SyntheticDataset())
+        self.api = self.app.client()
+
+    def test_resources(self):
+        api = self.api
+        force = api.get_force('force-0')
+        self.assertTrue(api.get_forces()[0] is force)
+        self.assertEqual(force.name, 'Force 0')
+        neighbourhood = api.get_neighbourhood('force-0', 'n0')
+        self.assertTrue(neighbourhood.force is force)
+        self.assertTrue(force.get_neighbourhood('n0') is neighbourhood)
+        self.assertTrue(neighbourhood in force.neighbourhoods)
+        self.assertTrue(force.neighbourhoods[0] is neighbourhood)
+        lat, lng = neighbourhood.boundary[0]
+        self.assertTrue(api.locate_neighbourhood(lat + 0.001, lng + 0.001)
+                        is neighbourhood)
+        self.assertEqual(self.app.hits['force-0/n0/boundary'], 1)
+
+        # Attributes given later don't replace loaded ones.
+        name = neighbourhood.name
+        self.assertTrue(api.get_neighbourhood('force-0', 'n0', name='Other')
+                        is neighbourhood)
+        self.assertEqual(neighbourhood.name, name)
+        neighbourhood.population
+        api.get_neighbourhood('force-0', 'n0').population
+        self.assertEqual(self.app.hits['force-0/n0'], 1)
+
+    def test_preload(self):
+        neighbourhood = self.api.get_neighbourhood('force-0', 'n1')
+        self.assertFalse(neighbourhood._requested)
+        self.assertTrue(self.api.get_neighbourhood('force-0', 'n1',
+                                                   preload=True)
+                        is neighbourhood)
+        self.assertTrue(neighbourhood._requested)
+        self.assertFalse('preload' in neighbourhood.__dict__)
+        self.assertTrue(self.api.get_force('force-1', preload=True)
+                        ._requested)
+        self.assertEqual(self.app.hits['force-0/n1'], 1)
+
+    def test_locations(self):
+        boundary = self.api.get_neighbourhood('force-0', 'n0').boundary
+        crimes = self.api.get_crimes_area(boundary, '2014-01')
+        crimes += self.api.get_crimes_area(boundary, '2014-02')
+        locations = dict((c.location.id, c.location) for c in crimes)
+        for crime in crimes:
+            self.assertTrue(crime.location is locations[crime.location.id])
+        self.assertTrue(len(locations) < len(crimes))
+
+        size = len(self.api.identity)
+        del crimes, locations
+        gc.collect()
+        self.assertTrue(len(self.api.identity) < size)
+
+
 class TestLocateNeighbourhood(PoliceAPITestCase):
 
     def test_locate_neighbourhood_not_found(self):
@@ -382,3 +559,1400 @@ class TestDates(PoliceAPITestCase):
                       body=json.dumps(dates), content_type='application/json')
         latest_date = self.api.get_latest_date()
         self.assertEqual(latest_date, '2013-10')
+
+
+class TestSpatialIndex(PoliceAPITestCase):
+
+    def setUp(self):
+        self.add_crime_categories()
+        self.crimes = [
+            Crime(self.api, data=crime_data(1, 52.6300, -1.1300)),
+            Crime(self.api, data=crime_data(2, 52.6350, -1.1350)),
+            Crime(self.api, data=crime_data(3, 52.6400, -1.1300,
+                                            month='2013-09')),
+            Crime(self.api, data=crime_data(4, 52.7000, -1.1300,
+                                            category='anti-social-behaviour')),
+        ]
+        self.index = SpatialIndex(self.crimes)
+
+    def test_haversine(self):
+        # One degree of latitude is roughly 111km.
+        self.assertAlmostEqual(haversine(52, -1, 53, -1) / 1000, 111.2, 1)
+
+    def test_within_radius(self):
+        crimes = self.index.get_crimes_point(52.63, -1.13)
+        self.assertEqual([c.id for c in crimes], [1, 2, 3])
+        crimes = self.index.within_radius(52.63, -1.13, radius=1000)
+        self.assertEqual([c.id for c in crimes], [1, 2])
+        crimes = self.index.get_crimes_point(52.63, -1.13, date='2013-09')
+        self.assertEqual([c.id for c in crimes], [3])
+
+    def test_within_bbox(self):
+        crimes = self.index.within_bbox(52.62, -1.14, 52.70, -1.12,
+                                        category='anti-social-behaviour')
+        self.assertEqual([c.id for c in crimes], [4])
+        crimes = self.index.within_bbox(52.62, -1.14, 52.638, -1.12)
+        self.assertEqual([c.id for c in crimes], [1, 2])
+
+    def test_nearest(self):
+        nearest = self.index.nearest(52.699, -1.13, k=2)
+        self.assertEqual([c.id for d, c in nearest], [4, 3])
+        self.assertTrue(nearest[0][0] < nearest[1][0])
+        self.assertEqual(len(self.index.nearest(52.63, -1.13, k=10)), 4)
+
+
+class TestWorkerPool(TestCase):
+
+    def test_concurrent_map(self):
+        self.assertEqual(concurrent_map(lambda x: x * 2, range(10), workers=3),
+                         [x * 2 for x in range(10)])
+
+    def test_concurrent_map_error(self):
+        self.assertRaises(ZeroDivisionError,
+                          lambda: concurrent_map(lambda x: 1 / x, [1, 0]))
+
+
+class TestCrawler(PoliceAPITestCase):
+
+    def setUp(self):
+        self.add_crime_categories()
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'crawl.db')
+        dates = [{'date': '2013-10'}, {'date': '2013-09'}]
+        responses.add(responses.GET,
+                      'http://data.police.uk/api/crimes-street-dates',
+                      body=json.dumps(dates), content_type='application/json')
+        responses.add(responses.GET, 'http://data.police.uk/api/forces',
+                      body='[{"id": "test-force", "name": "Test Force"}]',
+                      content_type='application/json')
+        neighbourhoods = [{'id': 'n%d' % i, 'name': 'N%d' % i}
+                          for i in range(3)]
+        responses.add(responses.GET,
+                      'http://data.police.uk/api/test-force/neighbourhoods',
+                      body=json.dumps(neighbourhoods),
+                      content_type='application/json')
+        for i, n in enumerate(neighbourhoods):
+            # Distinct boundaries, so their crime requests aren't coalesced.
+            boundary = [{'latitude': '52.6', 'longitude': '-1.1%d' % i},
+                        {'latitude': '52.7', 'longitude': '-1.1%d' % i},
+                        {'latitude': '52.7', 'longitude': '-1.2%d' % i}]
+            responses.add(
+                responses.GET,
+                'http://data.police.uk/api/test-force/%s/boundary' % n['id'],
+                body=json.dumps(boundary), content_type='application/json')
+        responses.add(responses.POST,
+                      'http://data.police.uk/api/crimes-street/all-crime',
+                      body=json.dumps([crime_data(1, 52.65, -1.15)]),
+                      content_type='application/json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def crawl_count(self):
+        return len([c for c in responses.calls
+                    if c.request.method == 'POST'])
+
+    def test_crawl(self):
+        results = []
+        crawler = Crawler(self.api, self.path,
+                          sink=lambda t, r: results.append(t.kind),
+                          mutable_months=0)
+        report = crawler.run(months=['2013-10', '2013-09'])
+        self.assertEqual(report.total('done'), 1 + 1 + 3 + 6)
+        self.assertEqual(results.count('crimes'), 6)
+        self.assertEqual(crawler.progress()['crimes'], {'done': 6})
+
+        # Crimes for immutable months aren't fetched again.
+        report = crawler.run(months=['2013-10', '2013-09'])
+        self.assertEqual(report.counts['crimes'], {'skipped': 6})
+        self.assertEqual(self.crawl_count(), 6)
+        crawler.close()
+
+    def test_crawl_resume(self):
+        class Interrupted(Exception):
+            pass
+
+        def sink(task, result):
+            if task.kind == 'crimes':
+                if len(crimes) == 2:
+                    raise Interrupted()
+                crimes.append(task)
+
+        crimes = []
+        crawler = Crawler(self.api, self.path, sink=sink, workers=1)
+        self.assertRaises(Interrupted,
+                          lambda: crawler.run(months=['2013-10']))
+        self.assertEqual(crawler.progress()['crimes'],
+                         {'done': 2, 'pending': 1})
+        crimes.append(None)
+        report = crawler.run()
+        self.assertEqual(report.counts, {'crimes': {'done': 1}})
+        self.assertEqual(crawler.progress()['crimes'], {'done': 3})
+        crawler.close()
+
+
+class TestMonthlySync(PoliceAPITestCase):
+
+    def setUp(self):
+        self.add_crime_categories()
+        self.tmp = tempfile.mkdtemp()
+        for dates in (['2013-09'], ['2013-10', '2013-09']):
+            responses.add(responses.GET,
+                          'http://data.police.uk/api/crimes-street-dates',
+                          body=json.dumps([{'date': d} for d in dates]),
+                          content_type='application/json')
+        for verb in (responses.GET, responses.POST):
+            responses.add(verb,
+                          'http://data.police.uk/api/crimes-street/all-crime',
+                          body=json.dumps([crime_data(1, 52.65, -1.15)]),
+                          content_type='application/json')
+        self.sync = MonthlySync(self.api, os.path.join(self.tmp, 'sync.db'), {
+            'point': (52.63, -1.13),
+            'area': [(52.6, -1.1), (52.7, -1.1), (52.7, -1.2)],
+        })
+
+    def tearDown(self):
+        self.sync.close()
+        shutil.rmtree(self.tmp)
+
+    def test_sync(self):
+        results = sorted((a, m, len(c)) for a, m, c in self.sync.sync())
+        self.assertEqual(results, [('area', '2013-09', 1),
+                                   ('point', '2013-09', 1)])
+        self.assertEqual(len([c for c in responses.calls
+                              if 'crimes-street/' in c.request.url]), 2)
+
+        # Only the newly published month is fetched.
+        results = sorted((a, m) for a, m, c in self.sync.sync())
+        self.assertEqual(results, [('area', '2013-10'), ('point', '2013-10')])
+        self.assertEqual(self.sync.missing(), [])
+
+    def test_sync_abandoned(self):
+        stream = self.sync.sync()
+        next(stream)
+        next(stream)
+        stream.close()
+        # The second pair was never acknowledged by asking for a third.
+        self.assertEqual(len(self.sync.missing(['2013-09'])), 1)
+
+    def test_sync_failure(self):
+        url = 'http://data.police.uk/api/crimes-street/all-crime'
+        responses.replace(responses.POST, url, status=500)
+        results = [(a, m) for a, m, c in self.sync.sync(['2013-09'])]
+        self.assertEqual(results, [('point', '2013-09')])
+        # The failed pair is left for the next sync.
+        self.assertEqual(self.sync.missing(['2013-09']),
+                         [('area', '2013-09')])
+
+        responses.replace(responses.POST, url,
+                          body=json.dumps([crime_data(1, 52.65, -1.15)]),
+                          content_type='application/json')
+        results = [(a, m) for a, m, c in self.sync.sync(['2013-09'])]
+        self.assertEqual(results, [('area', '2013-09')])
+        self.assertEqual(self.sync.missing(['2013-09']), [])
+
+
+class TestOutcomeTracker(PoliceAPITestCase):
+
+    def setUp(self):
+        self.add_crime_categories()
+        self.tmp = tempfile.mkdtemp()
+        self.tracker = OutcomeTracker(self.api,
+                                      os.path.join(self.tmp, 'outcomes.db'))
+
+    def tearDown(self):
+        self.tracker.close()
+        shutil.rmtree(self.tmp)
+
+    def add_outcomes(self, id, *statuses):
+        data = crime_data(id, 52.63, -1.13, outcome=None)
+        data.pop('outcome_status')
+        responses.add(
+            responses.GET,
+            'http://data.police.uk/api/outcomes-for-crime/crime-%s' % id,
+            body=json.dumps({'crime': data, 'outcomes': [
+                {'category': {'code': s.lower(), 'name': s},
+                 'date': '2013-10'} for s in statuses]}),
+            content_type='application/json')
+
+    def test_refresh(self):
+        self.tracker.track([
+            Crime(self.api, data=crime_data(1, 52.63, -1.13)),
+            Crime(self.api, data=crime_data(2, 52.63, -1.13,
+                                            outcome='Awaiting court outcome')),
+            Crime(self.api, data=crime_data(3, 52.63, -1.13,
+                                            outcome='Offender fined')),
+            Crime(self.api, data=crime_data(4, 52.63, -1.13, outcome=None,
+                                            category='anti-social-behaviour')),
+        ], fresh=False)
+        self.assertEqual(len(self.tracker), 4)
+        # crime-4 has no outcome yet, so may still get one.
+        self.assertEqual(sorted(self.tracker.due()),
+                         ['crime-1', 'crime-2', 'crime-4'])
+
+        self.add_outcomes(1, 'Under investigation')
+        self.add_outcomes(2, 'Awaiting court outcome', 'Offender fined')
+        self.add_outcomes(4)
+        changed = self.tracker.refresh(batch_size=1)
+        self.assertEqual(changed, [
+            ('crime-2', 'Awaiting court outcome', 'Offender fined')])
+        self.assertEqual(self.tracker.status('crime-2'), 'Offender fined')
+
+        # crime-1 is still open, but was checked too recently.
+        self.assertEqual(self.tracker.due(), [])
+        self.assertEqual(
+            sorted(self.tracker.due(now=time.time() + 31 * 24 * 3600)),
+            ['crime-1', 'crime-4'])
+
+    def test_unknown_status(self):
+        self.tracker.track([
+            Crime(self.api, data=crime_data(1, 52.63, -1.13, outcome=None))],
+            fresh=False)
+        self.assertEqual(self.tracker.due(), ['crime-1'])
+        tracker = OutcomeTracker(self.api, self.tracker.path,
+                                 refresh_unknown=False)
+        self.assertEqual(tracker.due(), [])
+        tracker.close()
+
+    def test_no_outcomes(self):
+        # A refresh which finds no outcomes keeps the crime's last status.
+        self.tracker.track([Crime(self.api, data=crime_data(1, 52.63, -1.13))],
+                           fresh=False)
+        self.add_outcomes(1)
+        self.assertEqual(self.tracker.refresh(), [])
+        self.assertEqual(self.tracker.status('crime-1'), 'Under investigation')
+        self.assertEqual(
+            self.tracker.due(now=time.time() + 31 * 24 * 3600), ['crime-1'])
+
+    def test_failures(self):
+        self.tracker.track([
+            Crime(self.api, data=crime_data(i, 52.63, -1.13))
+            for i in (1, 2, 3, 4)], fresh=False)
+        responses.add(
+            responses.GET,
+            'http://data.police.uk/api/outcomes-for-crime/crime-1',
+            status=404)
+        responses.add(
+            responses.GET,
+            'http://data.police.uk/api/outcomes-for-crime/crime-2',
+            status=500)
+        self.add_outcomes(3, 'Under investigation', 'Offender fined')
+        responses.add(
+            responses.GET,
+            'http://data.police.uk/api/outcomes-for-crime/crime-4',
+            body=requests.ConnectionError('Connection refused'))
+        changed = self.tracker.refresh()
+        self.assertEqual(changed, [
+            ('crime-3', 'Under investigation', 'Offender fined')])
+
+        # crime-1 is gone upstream, crime-2 waits to be tried again, and
+        # crime-4, which never reached the API, is still due.
+        self.assertEqual(len(self.tracker), 3)
+        self.assertEqual(self.tracker.status('crime-1'), None)
+        self.assertEqual(self.tracker.due(), ['crime-4'])
+        self.assertEqual(
+            sorted(self.tracker.due(now=time.time() + 31 * 24 * 3600)),
+            ['crime-2', 'crime-4'])
+
+    def test_fresh(self):
+        # Statuses read from a crimes-street response are already current.
+        self.tracker.track([
+            Crime(self.api, data=crime_data(i, 52.63, -1.13))
+            for i in (1, 2, 3)])
+        self.assertEqual(self.tracker.due(), [])
+        self.assertEqual(self.tracker.refresh(), [])
+        self.assertEqual(len(responses.calls), 0)
+        self.assertEqual(
+            sorted(self.tracker.due(now=time.time() + 31 * 24 * 3600)),
+            ['crime-1', 'crime-2', 'crime-3'])
+
+
+class TestSingleFlight(PoliceAPITestCase):
+
+    def setUp(self):
+        self.api = PoliceAPI()
+        self.release = threading.Event()
+
+        def callback(request):
+            self.release.wait(5)
+            return 200, {}, json.dumps([{'date': '2013-10'}])
+
+        responses.add_callback(
+            responses.GET, 'http://data.police.uk/api/crimes-street-dates',
+            callback=callback, content_type='application/json')
+
+    def test_threads_share_request(self):
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(self.api.get_dates()))
+            for i in range(5)]
+        for thread in threads:
+            thread.start()
+        while self.api.service.single_flight.shared < 4:
+            time.sleep(0.01)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [['2013-10']] * 5)
+        self.assertEqual(len(responses.calls), 1)
+
+        # Each caller gets its own copy of the decoded response.
+        self.assertEqual(len(set(id(r) for r in results)), 5)
+
+    def test_asyncio_shares_request(self):
+        self.release.set()
+        service = self.api.service
+
+        async def fetch():
+            return await asyncio.gather(*[
+                service.request_async('GET', 'crimes-street-dates')
+                for i in range(5)])
+
+        results = asyncio.run(fetch())
+        self.assertEqual(results, [[{'date': '2013-10'}]] * 5)
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(service.single_flight.shared, 4)
+
+
+class TestThreadSafety(TestCase):
+
+    def setUp(self):
+        self.server = StandInServer(routes={
+            'crime-categories': CATEGORIES,
+            'test-force/test-neighbourhood': {
+                'name': 'Test Neighbourhood', 'population': '1000'},
+            'test-force/test-neighbourhood/people': [
+                {'name': 'Test Officer', 'rank': 'PC'}],
+            'test-force/test-neighbourhood/boundary': [
+                {'latitude': '52.6', 'longitude': '-1.1'}],
+            'forces/test-force/people': [
+                {'name': 'Test Officer', 'rank': 'Chief Constable'}],
+        }, latency=0.05)
+        self.api = PoliceAPI(base_url=self.server.base_url)
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_shared_client(self):
+        neighbourhood = self.api.get_neighbourhood('test-force',
+                                                   'test-neighbourhood')
+        force = neighbourhood.force
+        errors = []
+        start = threading.Event()
+
+        def hammer():
+            start.wait()
+            try:
+                for i in range(20):
+                    self.assertEqual(
+                        self.api.get_crime_category('burglary').name,
+                        'Burglary')
+                    self.assertEqual(neighbourhood.population, 1000)
+                    self.assertEqual(neighbourhood.name, 'Test Neighbourhood')
+                    self.assertEqual(len(neighbourhood.officers), 1)
+                    self.assertEqual(len(neighbourhood.boundary), 1)
+                    self.assertEqual(len(force.senior_officers), 1)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=hammer) for i in range(32)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(self.server.hits, {
+            'crime-categories': 1,
+            'test-force/test-neighbourhood': 1,
+            'test-force/test-neighbourhood/people': 1,
+            'test-force/test-neighbourhood/boundary': 1,
+            'forces/test-force/people': 1,
+        })
+
+
+class TestStandInServer(TestCase):
+
+    def setUp(self):
+        self.server = StandInServer(SyntheticDataset(crimes_per_month=20))
+        self.api = self.server.client()
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_dataset(self):
+        forces = self.api.get_forces()
+        self.assertEqual([f.id for f in forces], ['force-0', 'force-1'])
+        self.assertEqual(forces[0].description,
+                         '<p>The Force 0 police force.</p>')
+        self.assertEqual(self.api.get_latest_date(), '2014-03')
+        neighbourhoods = self.api.get_neighbourhoods('force-1')
+        self.assertEqual(len(neighbourhoods), 3)
+        neighbourhood = neighbourhoods[0]
+        self.assertEqual(len(neighbourhood.officers), 1)
+        self.assertEqual(
+            self.api.locate_neighbourhood(neighbourhood.centre['latitude'],
+                                          neighbourhood.centre['longitude']),
+            neighbourhood)
+
+        crimes = self.api.get_crimes_area(neighbourhood.boundary,
+                                          date='2014-02')
+        self.assertEqual(len(crimes), 20)
+        crime = [c for c in crimes if c.persistent_id][0]
+        self.assertEqual(self.api.get_crime(crime.persistent_id).id,
+                         crime.id)
+        self.assertTrue(crime.id in [c.id for c in self.api.get_crimes_point(
+            crime.location.latitude, crime.location.longitude,
+            date='2014-02')])
+        self.assertEqual(len(self.api.get_crimes_no_location(
+            'force-1', date='2014-02')), 2)
+
+    def test_faults(self):
+        area = self.api.get_neighbourhood('force-0', 'n0').boundary
+        self.server.overflow_limit = 10
+        with self.assertRaises(APIError) as e:
+            self.api.get_crimes_area(area)
+        self.assertEqual(e.exception.status_code, 503)
+
+        self.server.fail(500, path='forces')
+        with self.assertRaises(APIError) as e:
+            self.api.get_forces()
+        self.assertEqual(e.exception.status_code, 500)
+        self.assertEqual(len(self.api.get_forces()), 2)
+
+        self.server.rate_limit = 1
+        self.server.burst = self.server._tokens = 2
+        statuses = []
+        for i in range(4):
+            try:
+                self.api.get_dates()
+                statuses.append(200)
+            except APIError as e:
+                statuses.append(e.status_code)
+        self.assertEqual(statuses, [200, 200, 429, 429])
+        self.assertEqual(self.server.log[-1],
+                         ('GET', 'crimes-street-dates', 429))
+
+
+class TestReferenceCache(TestCase):
+
+    def setUp(self):
+        self.server = StandInServer(SyntheticDataset())
+        self.api = self.server.client(reference_ttl=60,
+                                      reference_max_stale=600)
+        self.cache = self.api.service.reference_cache
+        self.now = 1000.0
+        self.cache.clock = lambda: self.now
+
+    def tearDown(self):
+        self.cache.close()
+        self.server.close()
+
+    def test_stale_while_revalidate(self):
+        self.assertEqual(len(self.api.get_forces()), 2)
+        self.api.get_forces()
+        self.assertEqual(self.server.hits['forces'], 1)
+
+        # Stale data is served while it is refreshed in the background.
+        self.now += 100
+        self.assertEqual(len(self.api.get_forces()), 2)
+        self.cache.wait()
+        self.assertEqual(self.server.hits['forces'], 2)
+        self.assertEqual(self.cache.age(('GET', 'forces', ())), 0)
+
+        # A failed refresh keeps the stale data...
+        self.server.fail(500, path='forces')
+        self.now += 100
+        self.assertEqual(len(self.api.get_forces()), 2)
+        self.cache.wait()
+        self.assertEqual(self.cache.stats['errors'], 1)
+        self.assertEqual(len(self.api.get_forces()), 2)
+        self.cache.wait()
+        self.assertEqual(self.server.hits['forces'], 4)
+
+        # ...until it expires, when callers wait for fresh data.
+        self.now += 1000
+        self.server.fail(500, path='forces')
+        self.assertRaises(APIError, self.api.get_forces)
+
+    def test_sub_resources(self):
+        neighbourhood = self.api.get_neighbourhood('force-0', 'n0')
+        other = self.api.get_neighbourhood('force-0', 'n0')
+        self.assertEqual(neighbourhood.officers[0].name, 'Officer n0')
+        self.assertTrue(other.officers[0].neighbourhood is other)
+        self.assertEqual(self.server.hits['force-0/n0/people'], 1)
+        self.now += 100
+        neighbourhood.officers
+        self.cache.wait()
+        self.assertEqual(self.server.hits['force-0/n0/people'], 2)
+
+
+class TestSnapshot(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'reference.snap')
+        self.server = StandInServer(SyntheticDataset())
+        main(['--base-url', self.server.base_url, 'snapshot', '-o',
+              self.path])
+        self.server.hits.clear()
+
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.dir)
+
+    def test_warm_start(self):
+        api = self.server.client(snapshot=self.path)
+        self.assertFalse(api.snapshot_stale)
+        self.assertEqual(api.snapshot.dates,
+                         ['2014-03', '2014-02', '2014-01'])
+        self.assertEqual([f.id for f in api.get_forces()],
+                         ['force-0', 'force-1'])
+        neighbourhood = api.get_neighbourhoods('force-1')[2]
+        self.assertEqual(neighbourhood.boundary[0], (52.64, -1.28))
+        self.assertEqual(api.get_crime_category('burglary').name,
+                         'Burglary')
+        self.assertEqual(
+            len(api.get_crime_categories(date='2014-01')), 9)
+        self.assertEqual(self.server.hits, {'crimes-street-dates': 1})
+
+        api = self.server.client(snapshot=Snapshot.load(self.path),
+                                 snapshot_check=False)
+        api.get_forces()
+        self.assertEqual(self.server.hits, {'crimes-street-dates': 1})
+
+    def test_stale(self):
+        self.server.dataset.months.append('2014-04')
+        api = self.server.client(snapshot=self.path)
+        self.assertTrue(api.snapshot_stale)
+        self.assertRaises(StaleSnapshotError, api.snapshot.check, api)
+        api.get_crime_categories()
+        api.get_crime_categories(date='2014-01')
+        self.assertEqual(self.server.hits['crime-categories'], 1)
+
+        # With a reference cache, snapshot data ages from when it was taken.
+        api = self.server.client(snapshot=self.path, reference_ttl=60)
+        self.assertTrue(api.service.reference_cache.age(
+            ('GET', 'forces', ())) >= 0)
+        api.service.reference_cache.close()
+
+
+class TestTransport(TestCase):
+
+    def check_client(self, api):
+        boundary = api.get_neighbourhood('force-0', 'n1').boundary
+        self.assertEqual(len(api.get_crimes_area(boundary)), 50)
+        self.assertEqual(len(api.get_crimes_point(52.63, -1.29)), 104)
+        with self.assertRaises(APIError) as e:
+            api.get_crime('unknown')
+        self.assertEqual(e.exception.status_code, 404)
+        requests, wire, decoded = api.service.transfer.endpoints[
+            'crimes-street']
+        self.assertEqual(requests, 2)
+        return wire, decoded
+
+    def test_memory(self):
+        app = StandInAPI(SyntheticDataset())
+        api = app.client()
+        self.assertTrue(isinstance(api.service.transport, MemoryTransport))
+        wire, decoded = self.check_client(api)
+        self.assertTrue(wire * 4 < decoded)
+        self.assertEqual(api.service.transfer.endpoints['boundary'][0], 1)
+        self.assertTrue('crimes-street' in api.service.transfer.report())
+
+        api = app.client(compression=False)
+        wire, decoded = self.check_client(api)
+        self.assertEqual(wire, decoded)
+
+    def test_requests(self):
+        with StandInServer(SyntheticDataset()) as server:
+            wire, decoded = self.check_client(server.client())
+        self.assertTrue(wire * 4 < decoded)
+
+    @skipUnless(httpx, 'httpx is not installed')
+    def test_http2(self):
+        with StandInServer(SyntheticDataset()) as server:
+            api = server.client(transport=HTTP2Transport())
+            wire, decoded = self.check_client(api)
+            self.assertEqual(
+                len(concurrent_map(lambda i: api.get_forces(), range(8))), 8)
+        self.assertTrue(wire * 4 < decoded)
+
+
+class TestCrimesByNeighbourhood(TestCase):
+
+    def test_join(self):
+        app = StandInAPI(SyntheticDataset(neighbourhoods=4),
+                         overflow_limit=120)
+        api = app.client()
+        force = api.get_force('force-1')
+        by_neighbourhood = force.crimes_by_neighbourhood('2014-02')
+        self.assertEqual(sorted(n.id for n in by_neighbourhood),
+                         ['n0', 'n1', 'n2', 'n3'])
+        for neighbourhood, crimes in by_neighbourhood.items():
+            expected = app.dataset.crimes_in_polygon(
+                neighbourhood.boundary, '2014-02')
+            self.assertEqual(sorted(c.id for c in crimes),
+                             sorted(c['id'] for c in expected))
+            self.assertEqual(len(crimes), 50)
+
+        # The 200 crimes overflowed one request, so were fetched as four
+        # tiles, rather than four full polygons.
+        self.assertEqual(
+            [status for verb, path, status in app.log
+             if path.startswith('crimes-street')], [503, 200, 200, 200, 200])
+
+
+class TestDateRanges(TestCase):
+
+    def setUp(self):
+        self.app = StandInAPI(SyntheticDataset())
+        self.api = self.app.client()
+
+    def crimes_street_calls(self):
+        return len([p for v, p, s in self.app.log
+                    if p.startswith('crimes-street/')])
+
+    def test_area_range(self):
+        boundary = self.api.get_neighbourhood('force-0', 'n0').boundary
+        crimes = self.api.get_crimes_area_range(boundary, start='2014-01')
+        self.assertEqual(list(crimes), ['2014-01', '2014-02', '2014-03'])
+        self.assertEqual([len(c) for c in crimes.values()], [50, 50, 50])
+        self.assertEqual(crimes['2014-02'][0].month, '2014-02')
+        self.assertEqual(self.crimes_street_calls(), 3)
+
+        # Only the latest month may still change, so only it is refetched.
+        again = self.api.get_crimes_area_range(boundary, start='2014-01')
+        self.assertEqual(self.crimes_street_calls(), 4)
+        self.assertEqual([c.id for c in again['2014-01']],
+                         [c.id for c in crimes['2014-01']])
+        self.assertFalse(again['2014-01'][0] is crimes['2014-01'][0])
+
+        crimes = self.api.get_crimes_point_range(52.61, -1.29,
+                                                 end='2014-02')
+        self.assertEqual(list(crimes), ['2014-01', '2014-02'])
+
+    def test_stream(self):
+        months = []
+        for month, crimes in self.api.get_crimes_no_location_range(
+                'force-0', months=['2014-03', '2014-01'], stream=True):
+            months.append(month)
+            self.assertEqual(len(crimes), 2)
+            self.assertEqual(crimes[0].month, month)
+        self.assertEqual(sorted(months), ['2014-01', '2014-03'])
+
+
+class TestAreaCache(TestCase):
+
+    def setUp(self):
+        self.app = StandInAPI(SyntheticDataset())
+        self.api = self.app.client(area_cache=AreaCache(grid=4))
+
+    def assertCrimes(self, points, month='2014-01'):
+        crimes = self.api.get_crimes_area(points, month)
+        self.assertEqual(
+            sorted(c.id for c in crimes),
+            sorted(c['id'] for c in self.app.dataset.crimes_in_polygon(
+                points, month)))
+        return crimes
+
+    def posts(self):
+        return len([p for v, p, s in self.app.log if v == 'POST'])
+
+    def test_geometry(self):
+        square = rectangle(0, 0, 4, 4)
+        notch = [(0, 0), (4, 0), (4, 4), (2, 1), (0, 4)]
+        self.assertTrue(polygon_contains(square, rectangle(1, 1, 2, 2)))
+        self.assertTrue(polygon_contains(square, rectangle(0, 0, 2, 2)))
+        self.assertFalse(polygon_contains(square, rectangle(3, 3, 5, 5)))
+        # Every corner is inside, but the edges cross the notch.
+        self.assertFalse(polygon_contains(notch,
+                                          rectangle(0.2, 1.5, 3.8, 1.8)))
+        self.assertTrue(polygon_contains(notch, rectangle(0.2, 0.5, 3.8, 0.8)))
+        self.assertTrue(polygons_intersect(square, rectangle(3, 3, 5, 5)))
+        self.assertFalse(polygons_intersect(square, rectangle(5, 5, 6, 6)))
+
+    def test_contained(self):
+        stats = self.api.service.area_cache.stats
+        crimes = self.assertCrimes(rectangle(52.6, -1.3, 52.64, -1.26))
+        self.assertEqual(len(crimes), 200)
+        self.assertCrimes([(52.61, -1.29), (52.63, -1.28), (52.61, -1.27)])
+        again = self.assertCrimes(rectangle(52.6, -1.3, 52.64, -1.26))
+        self.assertFalse(again[0] is crimes[0])
+        self.assertEqual(self.posts(), 1)
+        self.assertEqual((stats['exact'], stats['contained']), (1, 1))
+
+        # Other months and categories are separate.
+        self.assertCrimes(rectangle(52.61, -1.29, 52.63, -1.27), '2014-02')
+        self.api.get_crimes_area(rectangle(52.61, -1.29, 52.63, -1.27),
+                                 '2014-01', 'burglary')
+        self.assertEqual(self.posts(), 3)
+
+    def test_partial(self):
+        self.assertCrimes(rectangle(52.6, -1.3, 52.64, -1.26))
+        # The northern half is new, and fetched as one box.
+        self.assertCrimes(rectangle(52.62, -1.3, 52.66, -1.26))
+        self.assertEqual(self.posts(), 2)
+        poly = self.api.service.transport.requests[-1][2]['poly']
+        self.assertEqual([round(x, 6) for x in bounding_box(
+            decode_polygon(poly))], [52.64, -1.3, 52.66, -1.26])
+        # Now only the western edge is, as one column of cells.
+        self.assertCrimes(rectangle(52.61, -1.31, 52.65, -1.27))
+        self.assertEqual(self.posts(), 3)
+        self.assertEqual(self.api.service.area_cache.stats['partial'], 2)
+
+
+class TestAdaptiveLimiter(TestCase):
+
+    def test_aimd(self):
+        limiter = AdaptiveLimiter(initial=2, window=2)
+        for i in range(2):
+            limiter.acquire()
+        for i in range(2):
+            limiter.release(0.1, 200)
+        self.assertEqual(limiter.limit, 3)
+        self.assertEqual(limiter.history[-1].reason, 'increase')
+
+        # Not reaching the limit gives no reason to raise it.
+        for i in range(2):
+            limiter.acquire()
+            limiter.release(0.1, 200)
+        self.assertEqual(limiter.limit, 3)
+        self.assertEqual(limiter.history[-1].reason, 'hold')
+
+        for status, reason in ((429, 'throttled'), (None, 'errors')):
+            limiter.limit = 4
+            for s in (200, status):
+                limiter.acquire()
+                limiter.release(0.1, s)
+            self.assertEqual(limiter.limit, 2)
+            self.assertEqual(limiter.history[-1].reason, reason)
+
+        limiter.limit = 4
+        for latency in (0.1, 0.5):
+            limiter.acquire()
+            limiter.release(latency, 200)
+        self.assertEqual(limiter.limit, 2)
+        self.assertEqual(limiter.history[-1].reason, 'latency')
+
+    def test_service(self):
+        app = StandInAPI(SyntheticDataset(), latency=0.02)
+        limiter = AdaptiveLimiter(initial=2, window=4, tolerance=10)
+        api = app.client(adaptive_concurrency=limiter)
+        self.assertTrue(api.service.limiter is limiter)
+        calls = [('force-0', '2014-01'), ('force-0', '2014-02'),
+                 ('force-1', '2014-01'), ('force-1', '2014-02')]
+        concurrent_map(lambda c: api.get_crimes_no_location(*c), calls,
+                       workers=4)
+        self.assertEqual(limiter.limit, 3)
+
+        app.fail(429, path='crimes-no-location')
+        for call in calls:
+            try:
+                api.get_crimes_no_location(*call, category='burglary')
+            except APIError:
+                pass
+        self.assertEqual(limiter.limit, 1)
+        self.assertEqual([d.reason for d in limiter.history],
+                         ['increase', 'throttled'])
+        self.assertEqual(limiter.in_flight, 0)
+        self.assertTrue(
+            app.client(adaptive_concurrency=True).service.limiter)
+
+
+class TestScheduler(TestCase):
+
+    def queue(self, scheduler, order, names):
+        # Queue a request in each class in turn, behind the one slot.
+        def request(name):
+            scheduler.acquire(name)
+            order.append(name)
+            scheduler.release()
+
+        threads = []
+        for name in names:
+            depth = scheduler.depth()
+            thread = threading.Thread(target=request, args=(name,))
+            thread.start()
+            threads.append(thread)
+            while scheduler.depth() == depth:
+                time.sleep(0.001)
+        return threads
+
+    def test_fair_queuing(self):
+        scheduler = Scheduler(slots=1)
+        self.assertEqual(scheduler.acquire(), 0.0)
+        order = []
+        threads = self.queue(scheduler, order,
+                             [BULK] * 3 + [INTERACTIVE] * 40)
+        self.assertEqual(scheduler.depth(BULK), 3)
+        self.assertEqual(scheduler.depth(INTERACTIVE), 40)
+        scheduler.release()
+        for thread in threads:
+            thread.join()
+
+        # Interactive requests overtake the queued bulk ones, but a bulk
+        # request still gets a turn after every 16 interactive ones.
+        self.assertEqual([i for i, name in enumerate(order)
+                          if name == BULK], [15, 32, 42])
+        stats = scheduler.stats[BULK]
+        self.assertEqual((stats.requests, stats.queued, stats.depth,
+                          stats.max_depth), (3, 3, 0, 3))
+        self.assertTrue(stats.max_wait >
+                        scheduler.stats[INTERACTIVE].mean_wait)
+        self.assertEqual(scheduler.report().splitlines()[2].split()[:5],
+                         ['bulk', '3', '3', '0', '3'])
+        with self.assertRaises(ValueError):
+            scheduler.acquire('urgent')
+
+    def test_service(self):
+        scheduler = Scheduler(slots=2)
+        api = StandInAPI(SyntheticDataset()).client(scheduler=scheduler)
+        api.get_forces()
+        concurrent_map(api.get_crimes_no_location, ['force-0', 'force-1'],
+                       priority=BULK)
+        with priority(BULK):
+            concurrent_map(lambda n: api.get_neighbourhood('force-0', n).name,
+                           ['n0', 'n1'])
+
+        async def locate():
+            return await api.service.request_async(
+                'GET', 'locate-neighbourhood', q='52.61,-1.29')
+
+        with priority(BULK):
+            asyncio.run(locate())
+        self.assertEqual(scheduler.stats[INTERACTIVE].requests, 1)
+        self.assertEqual(scheduler.stats[BULK].requests, 5)
+
+
+def shared_worker(server, path, index, results):
+    try:
+        api = server.client(shared=SharedState(path, rate=50, burst=5))
+        forces = api.get_forces()
+        crimes = [len(api.get_crimes_point(52.61 + 0.002 * i, -1.29,
+                                           '2014-0%d' % month))
+                  for i in (index, index + 1) for month in (1, 2, 3)]
+        results.put((index, len(forces), crimes, api.service.shared.hits))
+    except Exception as e:
+        results.put((index, repr(e), None, None))
+
+
+class TestSharedState(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'shared.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_cache(self):
+        app = StandInAPI(SyntheticDataset())
+        api = app.client(shared=self.path)
+        other = app.client(shared=SharedState(self.path))
+        self.assertEqual(len(api.get_forces()), 2)
+        self.assertEqual(len(other.get_forces()), 2)
+        self.assertEqual(app.hits['forces'], 1)
+        self.assertEqual(other.service.shared.hits, 1)
+        self.assertEqual(pickle.loads(pickle.dumps(
+            other.service.shared)).get(
+            '["GET", "%sforces", []]' % app.base_url).json(),
+            api.service.request('GET', 'forces'))
+
+        # Failures aren't cached.
+        app.fail(404, path='forces/force-9')
+        for client in (api, other):
+            with self.assertRaises(APIError):
+                client.service.request('GET', 'forces/force-9')
+        self.assertEqual(app.hits['forces/force-9'], 2)
+
+    def test_token_bucket(self):
+        shared = SharedState(self.path, rate=20, burst=2)
+        self.assertEqual([shared.take() for i in range(2)], [0, 0])
+        start = time.time()
+        self.assertTrue(shared.take() > 0)
+        self.assertTrue(time.time() - start >= 0.04)
+
+    def test_processes(self):
+        # Four processes share one budget of 50 requests a second, which
+        # the server enforces, and fetch the forces and each point once
+        # between them.
+        context = multiprocessing.get_context('fork')
+        with StandInServer(SyntheticDataset(), rate_limit=50,
+                           burst=5) as server:
+            results = context.Queue()
+            processes = [context.Process(target=shared_worker,
+                                         args=(server, self.path, i, results))
+                         for i in range(4)]
+            for process in processes:
+                process.start()
+            results = sorted(results.get(timeout=30) for p in processes)
+            for process in processes:
+                process.join()
+        self.assertEqual([r[1] for r in results], [2, 2, 2, 2])
+        for index, forces, crimes, hits in results:
+            self.assertEqual(len(crimes), 6)
+        self.assertEqual(results[0][2][3:], results[1][2][:3])
+        statuses = [status for verb, path, status in server.log]
+        self.assertEqual(set(statuses), set([200]))
+        self.assertEqual(server.hits['forces'], 1)
+        self.assertEqual(server.hits['crimes-street/all-crime'], 15)
+        # Each process asked for the forces, six points and three months'
+        # crime categories; the rest came from the cache.
+        self.assertEqual(server.hits['crime-categories'], 3)
+        self.assertEqual(sum(r[3] for r in results),
+                         4 * 10 - len(server.log))
+
+
+class TestCrimeColumns(PoliceAPITestCase):
+
+    def setUp(self):
+        self.add_crime_categories()
+        self.data = [
+            crime_data(1, 52.63, -1.13),
+            crime_data(2, 52.64, -1.14, category='anti-social-behaviour',
+                       outcome=None),
+            crime_data(3, 52.65, -1.15),
+        ]
+
+    def test_columns(self):
+        columns = CrimeColumns.from_json(self.data)
+        self.assertEqual(len(columns), 3)
+        self.assertEqual(columns.category.values,
+                         ['burglary', 'anti-social-behaviour'])
+        self.assertEqual(columns.category.counts(),
+                         {'burglary': 2, 'anti-social-behaviour': 1})
+        self.assertEqual(list(columns.latitude), [52.63, 52.64, 52.65])
+        self.assertEqual(columns.row(1)['outcome_status'], None)
+
+        columns.extend(CrimeColumns.from_json([crime_data(4, 52.6, -1.1)]))
+        self.assertEqual(len(columns), 4)
+        self.assertEqual(columns.category.counts()['burglary'], 3)
+
+        taken = columns.take([0, 3])
+        self.assertEqual(taken.id, [1, 4])
+        self.assertEqual(list(taken.category), ['burglary', 'burglary'])
+
+    def test_to_crimes(self):
+        columns = pickle.loads(pickle.dumps(CrimeColumns.from_json(self.data)))
+        crimes = columns.to_crimes(self.api)
+        self.assertEqual([c.id for c in crimes], [1, 2, 3])
+        self.assertEqual(crimes[0].category.name, 'Burglary')
+        self.assertEqual(crimes[0].location.latitude, '52.63')
+        self.assertEqual(crimes[0].location.id, 1)
+        self.assertEqual(crimes[0].outcome_status.category.name,
+                         'Under investigation')
+        self.assertEqual(crimes[1].outcome_status, None)
+
+
+class TestParsePool(PoliceAPITestCase):
+
+    def test_parse_pool(self):
+        responses.add(responses.POST,
+                      'http://data.police.uk/api/crimes-street/all-crime',
+                      body=json.dumps([crime_data(1, 52.63, -1.13),
+                                       crime_data(2, 52.64, -1.14)]),
+                      content_type='application/json')
+        with ParsePool(processes=2) as pool:
+            payloads = [json.dumps([crime_data(i, 52.6, -1.1)])
+                        for i in range(4)]
+            parsed = pool.parse_crimes(payloads)
+            self.assertEqual([c.id for c in parsed], [[0], [1], [2], [3]])
+
+            areas = [[(52.6, -1.1), (52.7, -1.1), (52.7, -1.2)]] * 3
+            results = list(pool.get_crimes_area(self.api, areas,
+                                                date='2013-10'))
+            self.assertEqual([len(c) for c in results], [2, 2, 2])
+
+
+class TestSerialisation(PoliceAPITestCase):
+
+    def setUp(self):
+        self.add_crime_categories()
+        self.crimes = [
+            Crime(self.api, data=crime_data(1, 52.63, -1.13)),
+            Crime(self.api, data=crime_data(2, 52.64, -1.14, street_id=1,
+                                            outcome=None)),
+        ]
+        self.crimes[0]._outcomes = []
+
+    def test_crimes(self):
+        other = PoliceAPI()
+        crimes = loads(dumps(self.crimes), other)
+        self.assertEqual(len(crimes), 2)
+        for a, b in zip(self.crimes, crimes):
+            for field in ['id', 'persistent_id', 'month', 'category',
+                          'location', 'location_type', 'context']:
+                self.assertEqual(getattr(a, field), getattr(b, field))
+            self.assertTrue(b.api is other)
+            self.assertTrue(b.location.api is other)
+        self.assertEqual(crimes[0].location.latitude, '52.63')
+        self.assertEqual(crimes[0].outcome_status.category.name,
+                         'Under investigation')
+        self.assertTrue(crimes[0].outcome_status.crime is crimes[0])
+        self.assertEqual(crimes[0].outcomes, [])
+        self.assertEqual(crimes[1].outcome_status, None)
+        self.assertTrue(crimes[0].category is crimes[1].category)
+
+        crime = loads(dumps(self.crimes[0]), other)
+        self.assertEqual(crime.id, 1)
+
+    def test_resources(self):
+        force = self.api.get_force('test-force', name='Test Force')
+        neighbourhood = self.api.get_neighbourhood(force, 'test', name='Test')
+        neighbourhood._boundary = [(52.6, -1.1), (52.7, -1.1)]
+        resources = loads(dumps([force, neighbourhood]), self.api)
+        self.assertEqual(resources[0].id, 'test-force')
+        self.assertEqual(resources[0].name, 'Test Force')
+        self.assertEqual(resources[1].name, 'Test')
+        self.assertEqual(resources[1].force.id, 'test-force')
+        self.assertEqual(resources[1].boundary, neighbourhood.boundary)
+
+    def test_invalid(self):
+        self.assertRaises(SerialisationError, lambda: loads(b'nope', None))
+        data = dumps(self.crimes)
+        self.assertRaises(SerialisationError,
+                          lambda: loads(data[:4] + b'\xff' + data[5:], None))
+        self.assertRaises(SerialisationError, lambda: loads(data[:-8], None))
+        self.assertRaises(SerialisationError, lambda: loads(
+            data[:6] + zlib.compress(b'{nope'), None))
+
+    def test_pickle(self):
+        crimes = pickle.loads(pickle.dumps(self.crimes))
+        self.assertEqual(crimes[0].api, None)
+        crimes[0].attach(self.api)
+        self.assertTrue(crimes[0].api is self.api)
+        self.assertTrue(crimes[0].outcome_status.category.api is self.api)
+        neighbourhood = pickle.loads(pickle.dumps(
+            self.api.get_neighbourhood('test-force', 'test', name='Test')))
+        self.assertEqual(neighbourhood.name, 'Test')
+
+
+class TestExport(PoliceAPITestCase):
+
+    def setUp(self):
+        self.add_crime_categories()
+        self.data = [crime_data(1, 52.63, -1.13),
+                     crime_data(2, 52.64, -1.14, outcome=None)]
+        self.crimes = [Crime(self.api, data=d) for d in self.data]
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_ndjson(self):
+        output = io.StringIO()
+        source = iter([self.crimes, CrimeColumns.from_json(self.data)])
+        self.assertEqual(export(source, output, 'ndjson'), 4)
+        rows = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(rows[0], rows[2])
+        self.assertEqual(rows[1], rows[3])
+        self.assertEqual(rows[0]['latitude'], 52.63)
+        self.assertEqual(rows[0]['outcome_status'], 'Under investigation')
+        self.assertEqual(rows[1]['outcome_status'], None)
+
+    def test_csv(self):
+        output = io.StringIO()
+        self.assertEqual(export(self.crimes, output, 'csv'), 2)
+        rows = list(csv.DictReader(io.StringIO(output.getvalue())))
+        self.assertEqual([r['id'] for r in rows], ['1', '2'])
+        self.assertEqual(rows[0]['category'], 'burglary')
+
+    @skipUnless(pyarrow, 'pyarrow is not installed')
+    def test_parquet(self):
+        path = os.path.join(self.tmp, 'crimes.parquet')
+        source = (self.crimes for i in range(3))
+        self.assertEqual(export(source, path, 'parquet', row_group_size=4), 6)
+        parquet = pyarrow.parquet.ParquetFile(path)
+        self.assertEqual(parquet.metadata.num_row_groups, 2)
+        table = parquet.read()
+        self.assertEqual(table.column('id').to_pylist(), [1, 2] * 3)
+        self.assertEqual(str(table.schema.field('category').type),
+                         'dictionary<values=string, indices=int32, '
+                         'ordered=0>')
+
+    def test_no_location(self):
+        api = StandInAPI(SyntheticDataset()).client()
+        crimes = api.get_crimes_no_location('force-0', date='2014-02')
+        output = io.StringIO()
+        self.assertEqual(export(crimes, output, 'csv'), 2)
+        rows = list(csv.DictReader(io.StringIO(output.getvalue())))
+        self.assertEqual([r['id'] for r in rows], [str(c.id) for c in crimes])
+        self.assertEqual(rows[0]['latitude'], '')
+        self.assertEqual(rows[0]['month'], '2014-02')
+
+    def test_iter_crimes_overflow(self):
+        app = StandInAPI(SyntheticDataset(), overflow_limit=100)
+        api = app.client()
+        triangle = [(52.6, -1.3), (52.66, -1.3), (52.6, -1.26)]
+        source = iter_crimes(api, forces=['force-0'], areas=[triangle],
+                             months=['2014-02'])
+        lists = list(source)
+        expected = set()
+        for neighbourhood in api.get_neighbourhoods('force-0'):
+            expected.update(c['id'] for c in app.dataset.crimes_in_polygon(
+                neighbourhood.boundary, '2014-02'))
+        self.assertEqual(len(expected), 150)
+        self.assertEqual(sorted(c.id for cs in lists[:-1] for c in cs),
+                         sorted(expected))
+        self.assertEqual(
+            sorted(c.id for c in lists[-1]),
+            sorted(c['id'] for c in app.dataset.crimes_in_polygon(
+                triangle, '2014-02')))
+        self.assertTrue(503 in [status for verb, path, status in app.log])
+
+    def test_cli(self):
+        responses.add(responses.POST,
+                      'http://data.police.uk/api/crimes-street/all-crime',
+                      body=json.dumps([crime_data(1, 52.63, -1.13),
+                                       crime_data(2, 52.64, -1.14)]),
+                      content_type='application/json')
+        path = os.path.join(self.tmp, 'crimes.csv')
+        main(['export', '--area', '52.6,-1.1:52.7,-1.1:52.7,-1.2',
+              '--month', '2013-09', '--month', '2013-10', '-o', path])
+        with io.open(path, newline='') as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(
+            [c.request.body for c in responses.calls
+             if c.request.method == 'POST'][0],
+            'poly=52.6%2C-1.1%3A52.7%2C-1.1%3A52.7%2C-1.2&date=2013-09')
+
+    def test_cli_format(self):
+        area = '52.6,-1.1:52.7,-1.1:52.7,-1.2'
+        stderr = sys.stderr
+        sys.stderr = io.StringIO()
+        try:
+            for path in ['crimes.json', 'crimes']:
+                path = os.path.join(self.tmp, path)
+                self.assertRaises(SystemExit, main,
+                                  ['export', '--area', area, '-o', path])
+                self.assertFalse(os.path.exists(path))
+                self.assertTrue('one of csv, ndjson, parquet'
+                                in sys.stderr.getvalue())
+            self.assertRaises(SystemExit, main, [
+                'export', '--area', area, '--format', 'parquet'])
+        finally:
+            sys.stderr = stderr
+        self.assertEqual(len(responses.calls), 0)
+
+        responses.add(responses.POST,
+                      'http://data.police.uk/api/crimes-street/all-crime',
+                      body=json.dumps([crime_data(1, 52.63, -1.13)]),
+                      content_type='application/json')
+        path = os.path.join(self.tmp, 'crimes.json')
+        main(['export', '--area', area, '--format', 'ndjson', '-o', path])
+        with io.open(path) as f:
+            self.assertEqual(json.loads(f.readline())['id'], 1)
+
+
+class TestAggregate(PoliceAPITestCase):
+
+    def test_aggregate_crimes(self):
+        for month, crimes in [
+                ('2013-09', [crime_data(1, 52.63, -1.13, month='2013-09'),
+                             crime_data(2, 52.63, -1.13, month='2013-09',
+                                        category='anti-social-behaviour',
+                                        outcome=None)]),
+                ('2013-10', [crime_data(3, 52.63, -1.13, street_id=1),
+                             crime_data(1, 52.63, -1.13)])]:
+            responses.add(
+                responses.POST,
+                'http://data.police.uk/api/crimes-street/all-crime',
+                body=json.dumps(crimes), content_type='application/json',
+                match=[responses.matchers.urlencoded_params_matcher(
+                    {'poly': '52.6,-1.1:52.7,-1.1:52.7,-1.2',
+                     'date': month})])
+        area = [(52.6, -1.1), (52.7, -1.1), (52.7, -1.2)]
+
+        table = self.api.aggregate_crimes(area, ['2013-09', '2013-10'],
+                                          by=['month', 'category'])
+        self.assertEqual(table.total(), 4)
+        self.assertEqual(table['2013-09', 'burglary'], 1)
+        self.assertEqual(table['2013-10', 'burglary'], 2)
+        self.assertEqual(table.group(['category'])['burglary'], 3)
+
+        # The same area twice, as overlapping tiles, counts crimes once.
+        table = self.api.aggregate_crimes([area, area], ['2013-10'],
+                                          by=['street', 'outcome'])
+        self.assertEqual(table.rows(), [((1, 'Under investigation'), 2)])
+
+        self.assertEqual(table + table,
+                         CountTable(('street', 'outcome'),
+                                    {(1, 'Under investigation'): 4}))
+
+
+class TestBinning(PoliceAPITestCase):
+
+    def setUp(self):
+        self.add_crime_categories()
+        self.crimes = [
+            Crime(self.api, data=crime_data(1, 52.631, -1.131)),
+            Crime(self.api, data=crime_data(2, 52.632, -1.132)),
+            Crime(self.api, data=crime_data(3, 52.655, -1.105)),
+        ]
+
+    def test_to_bng(self):
+        # Big Ben, to within a metre of the OS's Helmert transformation.
+        easting, northing = to_bng(51.500729, -0.124625)
+        self.assertAlmostEqual(easting, 530268, -1)
+        self.assertAlmostEqual(northing, 179644, -1)
+
+    def test_lat_lng_grid(self):
+        grid = LatLngGrid(0.01, bounds=(52.6, -1.2, 52.7, -1.1))
+        self.assertEqual(grid.shape, (10, 10))
+        heatmap = HeatMap(grid).add(self.crimes)
+        heatmap.add(CrimeColumns.from_json([crime_data(4, 53.0, -1.1)]))
+        self.assertEqual(heatmap.sparse(), {(3, 6): 2, (5, 9): 1})
+        self.assertEqual(heatmap.dropped, 1)
+        dense = heatmap.dense()
+        self.assertEqual(len(dense), 10)
+        self.assertEqual(dense[3][6], 2)
+        self.assertEqual(sum(sum(row) for row in dense), 3)
+
+    def test_bng_grid(self):
+        heatmap = HeatMap(BNGGrid(1000)).add(self.crimes)
+        self.assertEqual(heatmap.sparse(), {(304, 458): 2, (306, 460): 1})
+        self.assertRaises(ValueError, heatmap.dense)
+        heatmap = heatmap + HeatMap(BNGGrid(1000)).add(self.crimes[:1])
+        self.assertEqual(heatmap.total(), 4)
+
+    def test_hex_grid(self):
+        grid = HexGrid(500)
+        heatmap = HeatMap(grid).add(self.crimes)
+        self.assertEqual(sorted(heatmap.sparse().values()), [1, 2])
+        for key in heatmap.sparse():
+            easting, northing = grid.centre(key)
+            self.assertTrue(450000 < easting < 470000)
+            self.assertTrue(300000 < northing < 310000)
+
+
+class TestCrimeStore(PoliceAPITestCase):
+
+    def setUp(self):
+        self.add_crime_categories()
+
+    def crimes(self, *ids, **kwargs):
+        return [Crime(self.api, data=crime_data(i, 52.63, -1.13, **kwargs))
+                for i in ids]
+
+    def test_merge(self):
+        store = CrimeStore(self.crimes(1, 2, street_id=10))
+        overlapping = self.crimes(2, 3, street_id=10)
+        stored = store.update(overlapping)
+        self.assertEqual(len(store), 3)
+        self.assertEqual(store.merged, 1)
+        self.assertFalse(stored[0] is overlapping[0])
+        self.assertTrue(stored[0] is store.get(2))
+        self.assertTrue(stored[1] is overlapping[1])
+        self.assertTrue(2 in store)
+        self.assertTrue(store.get(3).location is store.get(1).location)
+        self.assertEqual([c.id for c in store.get_by_persistent_id('crime-3')],
+                         [3])
+
+    def test_filter(self):
+        store = CrimeStore(
+            self.crimes(1, 2, street_id=10) +
+            self.crimes(3, month='2013-09', street_id=10) +
+            self.crimes(4, category='anti-social-behaviour', outcome=None))
+        self.assertEqual([c.id for c in store.filter(month='2013-10')],
+                         [1, 2, 4])
+        self.assertEqual(
+            [c.id for c in store.filter(month='2013-10', location=10)],
+            [1, 2])
+        category = self.api.get_crime_category('anti-social-behaviour')
+        self.assertEqual([c.id for c in store.filter(category=category)], [4])
+        self.assertEqual(store.months(), ['2013-09', '2013-10'])
+
+        store.discard(4)
+        self.assertEqual(store.categories(), ['burglary'])
+        self.assertEqual(len(store.filter()), 3)
+
+
+class TestQueryPlanner(PoliceAPITestCase):
+
+    def setUp(self):
+        self.add_crime_categories()
+        self.area = [(52.6, -1.2), (52.7, -1.2), (52.7, -1.1), (52.6, -1.1)]
+
+    def posts(self):
+        return len([c for c in responses.calls
+                    if c.request.method == 'POST'])
+
+    def test_run_and_reuse(self):
+        responses.add(
+            responses.POST,
+            'http://data.police.uk/api/crimes-street/all-crime',
+            body=json.dumps([crime_data(1, 52.61, -1.19),
+                             crime_data(2, 52.69, -1.11)]),
+            content_type='application/json')
+        planner = QueryPlanner(self.api)
+        self.assertTrue(planner.explain(self.area, ['2013-10']).startswith(
+            '* area'))
+        results = planner.run(self.area, ['2013-10'])
+        self.assertEqual([c.id for c in results['2013-10']], [1, 2])
+        self.assertEqual(self.posts(), 1)
+
+        # A smaller area inside one already fetched is answered locally.
+        inner = [(52.6, -1.2), (52.65, -1.2), (52.65, -1.15), (52.6, -1.15)]
+        plan = planner.plans(inner, ['2013-10'])[0]
+        self.assertEqual(plan.strategy, 'store')
+        results = planner.run(inner, ['2013-10'])
+        self.assertEqual([c.id for c in results['2013-10']], [1])
+        self.assertEqual(self.posts(), 1)
+
+        # The observed density feeds later estimates.
+        self.assertAlmostEqual(planner.stats.density(self.area) * 77.5, 2,
+                               0)
+
+    def test_concave_coverage(self):
+        responses.add(
+            responses.POST,
+            'http://data.police.uk/api/crimes-street/all-crime',
+            body=json.dumps([]), content_type='application/json')
+        planner = QueryPlanner(self.api)
+        # A U shape, open to the north.
+        u_shape = [(52.6, -1.2), (52.7, -1.2), (52.7, -1.18), (52.62, -1.18),
+                   (52.62, -1.12), (52.7, -1.12), (52.7, -1.1), (52.6, -1.1)]
+        planner.run(u_shape, ['2013-10'])
+        # Every corner of this box is inside the U, but its middle isn't.
+        box = [(52.61, -1.19), (52.69, -1.19), (52.69, -1.11),
+               (52.61, -1.11)]
+        self.assertTrue(all(points_in_polygon([p[0] for p in box],
+                                              [p[1] for p in box], u_shape)))
+        self.assertNotEqual(planner.plans(box, ['2013-10'])[0].strategy,
+                            'store')
+        inside = [(52.61, -1.19), (52.615, -1.19), (52.615, -1.11),
+                  (52.61, -1.11)]
+        self.assertEqual(planner.plans(inside, ['2013-10'])[0].strategy,
+                         'store')
+
+    def test_area_overflow(self):
+        app = StandInAPI(SyntheticDataset(), overflow_limit=100)
+        planner = QueryPlanner(app.client())
+        triangle = [(52.6, -1.3), (52.66, -1.3), (52.6, -1.26)]
+        plan = [p for p in planner.plans(triangle, ['2014-02'])
+                if p.strategy == 'area'][0]
+        crimes = planner.run(triangle, ['2014-02'], plan=plan)['2014-02']
+        # The area overflowed, so was fetched as tiles of its bounding box,
+        # but only the crimes within it are returned.
+        self.assertEqual(
+            [status for verb, path, status in app.log
+             if path.startswith('crimes-street')][0], 503)
+        expected = app.dataset.crimes_in_polygon(triangle, '2014-02')
+        self.assertTrue(expected)
+        self.assertEqual(sorted(c.id for c in crimes),
+                         sorted(c['id'] for c in expected))
+        self.assertAlmostEqual(
+            planner.stats.density(triangle) * polygon_area(triangle),
+            len(expected), 0)
+
+    def test_dense_area_is_tiled(self):
+        stats = DensityStats(default=5000)
+        planner = QueryPlanner(self.api, stats=stats)
+        plans = planner.plans(self.area, ['2013-10'])
+        self.assertEqual(plans[0].strategy, 'tiled')
+        area = [p for p in plans if p.strategy == 'area'][0]
+        self.assertTrue(area.overflow_risk > plans[0].overflow_risk)
+        self.assertTrue(all(p.calls for p in plans))
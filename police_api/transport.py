@@ -0,0 +1,210 @@
+"""
+Transports carry requests from ``BaseService`` to the API. Each returns a
+``Response`` holding the decoded body and the number of bytes which crossed
+the wire, so that compression can be measured.
+
+- ``RequestsTransport`` (the default) uses a pooled ``requests`` session.
+- ``HTTP2Transport`` uses ``httpx``, multiplexing concurrent calls over one
+  connection where the server supports HTTP/2.
+- ``MemoryTransport`` calls an in-process application, for tests.
+"""
+import json
+import threading
+import zlib
+from urllib.parse import urlencode, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def accept_encoding():
+    """
+    The encodings to ask for: brotli when it can be decoded, and gzip.
+    """
+    return 'br, gzip' if _brotli() is not None else 'gzip'
+
+
+def decode_body(data, encoding):
+    """
+    Decompress a response body sent with the given ``Content-Encoding``.
+    """
+    encoding = (encoding or 'identity').strip().lower()
+    if encoding in ('identity', '') or not data:
+        return data
+    if encoding in ('gzip', 'x-gzip'):
+        return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        try:
+            return zlib.decompress(data)
+        except zlib.error:
+            return zlib.decompress(data, -zlib.MAX_WBITS)
+    if encoding == 'br':
+        brotli = _brotli()
+        if brotli is None:
+            raise ValueError('Received a brotli response, but brotli is not '
+                             'installed')
+        return brotli.decompress(data)
+    raise ValueError('Unsupported content encoding: %s' % encoding)
+
+
+class Response(object):
+    """
+    A decoded HTTP response, with the same ``status_code``, ``content``,
+    ``json()`` and ``raise_for_status()`` as a ``requests`` response.
+    """
+
+    def __init__(self, status_code, content, headers=None, url=None,
+                 wire_bytes=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = requests.structures.CaseInsensitiveDict(headers or {})
+        self.url = url
+        self.wire_bytes = len(content) if wire_bytes is None else wire_bytes
+
+    def __repr__(self):
+        return '<Response [%d]>' % self.status_code
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError('%d Error for url: %s' % (
+                self.status_code, self.url), response=self)
+
+
+class Transport(object):
+    """
+    Sends requests. ``params`` go in the query string of a GET, and the
+    form-encoded body of anything else.
+    """
+    name = None
+
+    def send(self, verb, url, params, headers, timeout=None, auth=None):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class RequestsTransport(Transport):
+    """
+    Sends requests with a ``requests`` session, keeping up to ``pool_size``
+    connections open for reuse.
+    """
+    name = 'requests'
+
+    def __init__(self, session=None, pool_size=10):
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size,
+                                  pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+
+    def send(self, verb, url, params, headers, timeout=None, auth=None):
+        kwargs = {'params' if verb == 'GET' else 'data': params}
+        r = self.session.request(verb, url, headers=headers, timeout=timeout,
+                                 auth=auth, stream=True, **kwargs)
+        try:
+            # Read the body as sent, to count it, and decode it ourselves.
+            raw = r.raw.read(decode_content=False)
+        finally:
+            r.close()
+        return Response(r.status_code,
+                        decode_body(raw, r.headers.get('Content-Encoding')),
+                        r.headers, r.url, len(raw))
+
+    def close(self):
+        self.session.close()
+
+
+class HTTP2Transport(Transport):
+    """
+    Sends requests with an ``httpx`` client, which multiplexes concurrent
+    requests as streams over a single HTTP/2 connection (over TLS, where the
+    server offers HTTP/2), instead of needing one connection per request in
+    flight. Requires ``httpx`` with its ``http2`` extra.
+    """
+    name = 'http2'
+
+    def __init__(self, client=None):
+        if client is None:
+            try:
+                import httpx
+            except ImportError:
+                raise ImportError('HTTP2Transport requires httpx: '
+                                  'pip install "httpx[http2]"')
+            client = httpx.Client(http2=True)
+        self.client = client
+
+    def send(self, verb, url, params, headers, timeout=None, auth=None):
+        kwargs = {'params' if verb == 'GET' else 'data': params}
+        with self.client.stream(verb, url, headers=headers, timeout=timeout,
+                                auth=auth, **kwargs) as r:
+            raw = b''.join(r.iter_raw())
+        return Response(r.status_code,
+                        decode_body(raw, r.headers.get('Content-Encoding')),
+                        dict(r.headers), str(r.url), len(raw))
+
+    def close(self):
+        self.client.close()
+
+
+class MemoryTransport(Transport):
+    """
+    Hands requests to an in-process application, such as
+    ``police_api.testing.StandInAPI``, with a ``handle(verb, path, params,
+    headers)`` method returning ``(status, headers, body)``. ``path`` is the
+    URL path, and ``body`` is bytes, possibly compressed.
+    """
+    name = 'memory'
+
+    def __init__(self, app):
+        self.app = app
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def send(self, verb, url, params, headers, timeout=None, auth=None):
+        params = dict((k, v) for k, v in params.items() if v is not None)
+        with self._lock:
+            self.requests.append((verb, url, params))
+        status, response_headers, body = self.app.handle(
+            verb, urlsplit(url).path, params, headers)
+        if verb == 'GET' and params:
+            url = '%s?%s' % (url, urlencode(sorted(params.items())))
+        response_headers = requests.structures.CaseInsensitiveDict(
+            response_headers)
+        return Response(status, decode_body(
+            body, response_headers.get('Content-Encoding')),
+            response_headers, url, len(body))
+
+
+TRANSPORTS = {
+    'requests': RequestsTransport,
+    'http2': HTTP2Transport,
+}
+
+
+def get_transport(transport):
+    """
+    A transport instance from a name in ``TRANSPORTS``, or ``transport``
+    itself if it already is one.
+    """
+    if transport is None:
+        return RequestsTransport()
+    if isinstance(transport, Transport):
+        return transport
+    try:
+        return TRANSPORTS[transport]()
+    except KeyError:
+        raise ValueError('Unknown transport: %s' % transport)
@@ -1,2 +1,19 @@
 def encode_polygon(points):
     return ':'.join(['{0},{1}'.format(*p) for p in points])
+
+
+def month_range(start, end):
+    """
+    Every month from ``start`` to ``end`` inclusive, as ``YYYY-MM`` strings.
+    """
+    year, month = map(int, start.split('-'))
+    end_year, end_month = map(int, end.split('-'))
+    months = []
+    while (year, month) <= (end_year, end_month):
+        months.append('%04d-%02d' % (year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def decode_polygon(poly):
+    return [tuple(float(c) for c in p.split(',')) for p in poly.split(':')]
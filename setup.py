@@ -16,11 +16,29 @@ setup(
     download_url='https://github.com/rkhleics/police-api-client-python/downloads',
     packages=find_packages(),
     include_package_data=True,
-    setup_requires=[
-        'nose',
-    ],
+    python_requires='>=3.7',
     install_requires=[
         'requests',
         'responses',
     ],
+    extras_require={
+        'parquet': ['pyarrow'],
+        'http2': ['httpx[http2]'],
+        'brotli': ['brotli'],
+    },
+    classifiers=[
+        'License :: OSI Approved :: MIT License',
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+    ],
+    entry_points={
+        'console_scripts': [
+            'police-api = police_api.cli:main',
+        ],
+    },
 )